@@ -0,0 +1,61 @@
+# Server-side store of analyzed inputs, referenced by analysis_id
+import os
+import time
+import uuid
+
+from upload_store import UploadStore
+
+# Analyses expire this many seconds after /api/analyze-tokens produced them
+ANALYSIS_TTL = int(os.environ.get('ANALYSIS_TTL', 3600))
+
+# Total characters of extracted text held by the store; the oldest analyses are dropped beyond this
+ANALYSIS_STORE_MAX_CHARS = int(os.environ.get('ANALYSIS_STORE_MAX_CHARS', 256 * 1024 * 1024))
+
+
+class AnalysisError(Exception):
+    """Raised for token analysis inputs that cannot be read; status_code is the HTTP status to return."""
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class AnalysisStore(UploadStore):
+    """
+    In-memory, TTL-bounded store of the extracted and normalized text from /api/analyze-tokens,
+    so the generation request that follows starts from it instead of decoding and extracting
+    the file again. Sizes are counted in characters of text.
+    """
+    def __init__(self, ttl=ANALYSIS_TTL, max_chars=ANALYSIS_STORE_MAX_CHARS):
+        super().__init__(ttl=ttl, max_bytes=max_chars)
+
+    def put(self, file_name, document, upload_id=None, analysis_id=None, sections=None, image_key=None):
+        """
+        Store an extraction result and return its analysis_id. upload_id points at the original
+        bytes in the upload store when they are still needed, e.g. for embedded images.
+        A content-derived analysis_id replaces any earlier analysis of the same input;
+        sections is the per-section token breakdown from token_histogram, and image_key
+        the image cache key of the document's prepared images.
+        """
+        if len(document['text']) > self.max_bytes:
+            raise ValueError(f"Analysis of {len(document['text'])} chars exceeds the analysis store limit of {self.max_bytes} chars")
+
+        if analysis_id is None:
+            analysis_id = uuid.uuid4().hex
+        else:
+            self.delete(analysis_id)
+        self._insert(analysis_id, {
+            'analysis_id': analysis_id,
+            'file_name': file_name,
+            'file_type': document['file_type'],
+            'document': document,
+            'upload_id': upload_id,
+            'sections': sections,
+            'image_key': image_key,
+            'size': len(document['text']),
+            'created_at': time.time()
+        })
+        return analysis_id
+
+
+# Shared store used by server.py
+analysis_store = AnalysisStore()
@@ -12,7 +12,9 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # Import the Flask app from server.py
 try:
-    from server import app as flask_app, analyze_tokens
+    from server import app as flask_app, analyze_tokens, LEGACY_SYSTEM_PROMPT_VERSION
+    from prompt_registry import prompt_registry, render_prompt
+    from helper_function import cacheable_system
 except Exception as e:
     # Create a simple app to show the import error
     app = Flask(__name__)
@@ -453,15 +455,9 @@ def process_stream():
         client = Anthropic(api_key=api_key)
         
         # Prepare system prompt and user content
-        system_prompt = "I will provide you with a file or a content, analyze its content, and transform it into a visually appealing and well-structured webpage.### Content Requirements* Maintain the core information from the original file while presenting it in a clearer and more visually engaging format.⠀Design Style* Follow a modern and minimalistic design inspired by Linear App.* Use a clear visual hierarchy to emphasize important content.* Adopt a professional and harmonious color scheme that is easy on the eyes for extended reading.⠀Technical Specifications* Use HTML5, TailwindCSS 3.0+ (via CDN), and necessary JavaScript.* Implement a fully functional dark/light mode toggle, defaulting to the system setting.* Ensure clean, well-structured code with appropriate comments for easy understanding and maintenance.⠀Responsive Design* The page must be fully responsive, adapting seamlessly to mobile, tablet, and desktop screens.* Optimize layout and typography for different screen sizes.* Ensure a smooth and intuitive touch experience on mobile devices.⠀Icons & Visual Elements* Use professional icon libraries like Font Awesome or Material Icons (via CDN).* Integrate illustrations or charts that best represent the content.* Avoid using emojis as primary icons.* Check if any icons cannot be loaded.⠀User Interaction & ExperienceEnhance the user experience with subtle micro-interactions:* Buttons should have slight enlargement and color transitions on hover.* Cards should feature soft shadows and border effects on hover.* Implement smooth scrolling effects throughout the page.* Content blocks should have an elegant fade-in animation on load.⠀Performance Optimization* Ensure fast page loading by avoiding large, unnecessary resources.* Use modern image formats (WebP) with proper compression.* Implement lazy loading for content-heavy pages.⠀Output Requirements* Deliver a fully functional standalone HTML file, including all necessary CSS and JavaScript.* Ensure the code meets W3C standards with no errors or warnings.* Maintain consistent design and functionality across different browsers.⠀Create the most effective and visually appealing webpage based on the uploaded file's content type (document, data, images, etc.)."
+        system_prompt = prompt_registry.system_prompt(version=LEGACY_SYSTEM_PROMPT_VERSION)[0]
         
-        user_content = f"""
-        {format_prompt}
-        
-        Here is the content to transform into a website:
-        
-        {content}
-        """
+        user_content = render_prompt('webpage_user', format_prompt=format_prompt, content=content)
         
         # Define a streaming response generator using beta stream for Claude 3.7
         def generate():
@@ -477,7 +473,7 @@ def process_stream():
                     model="claude-3-7-sonnet-20250219",
                     max_tokens=max_tokens,
                     temperature=temperature,
-                    system=system_prompt,
+                    system=cacheable_system(system_prompt, "claude-3-7-sonnet-20250219"),
                     messages=[
                         {
                             "role": "user",
@@ -605,15 +601,9 @@ def process():
         client = Anthropic(api_key=api_key)
         
         # Prepare system prompt and user message
-        system_prompt = "I will provide you with a file or a content, analyze its content, and transform it into a visually appealing and well-structured webpage.### Content Requirements* Maintain the core information from the original file while presenting it in a clearer and more visually engaging format.⠀Design Style* Follow a modern and minimalistic design inspired by Linear App.* Use a clear visual hierarchy to emphasize important content.* Adopt a professional and harmonious color scheme that is easy on the eyes for extended reading.⠀Technical Specifications* Use HTML5, TailwindCSS 3.0+ (via CDN), and necessary JavaScript.* Implement a fully functional dark/light mode toggle, defaulting to the system setting.* Ensure clean, well-structured code with appropriate comments for easy understanding and maintenance.⠀Responsive Design* The page must be fully responsive, adapting seamlessly to mobile, tablet, and desktop screens.* Optimize layout and typography for different screen sizes.* Ensure a smooth and intuitive touch experience on mobile devices.⠀Icons & Visual Elements* Use professional icon libraries like Font Awesome or Material Icons (via CDN).* Integrate illustrations or charts that best represent the content.* Avoid using emojis as primary icons.* Check if any icons cannot be loaded.⠀User Interaction & ExperienceEnhance the user experience with subtle micro-interactions:* Buttons should have slight enlargement and color transitions on hover.* Cards should feature soft shadows and border effects on hover.* Implement smooth scrolling effects throughout the page.* Content blocks should have an elegant fade-in animation on load.⠀Performance Optimization* Ensure fast page loading by avoiding large, unnecessary resources.* Use modern image formats (WebP) with proper compression.* Implement lazy loading for content-heavy pages.⠀Output Requirements* Deliver a fully functional standalone HTML file, including all necessary CSS and JavaScript.* Ensure the code meets W3C standards with no errors or warnings.* Maintain consistent design and functionality across different browsers.⠀Create the most effective and visually appealing webpage based on the uploaded file's content type (document, data, images, etc.)."
-        
-        user_message = f"""
-        {format_prompt}
-        
-        Here is the content to transform into a website:
+        system_prompt = prompt_registry.system_prompt(version=LEGACY_SYSTEM_PROMPT_VERSION)[0]
         
-        {content}
-        """
+        user_message = render_prompt('webpage_user', format_prompt=format_prompt, content=content)
         
         # Set up parameters with beta access for Claude 3.7
         OUTPUT_128K_BETA = "output-128k-2025-02-19"
@@ -623,7 +613,7 @@ def process():
             model="claude-3-7-sonnet-20250219",
             max_tokens=max_tokens,
             temperature=temperature,
-            system=system_prompt,
+            system=cacheable_system(system_prompt, "claude-3-7-sonnet-20250219"),
             messages=[
                 {
                     "role": "user",
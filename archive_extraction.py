@@ -0,0 +1,301 @@
+# Multi-file ZIP bundles: members are read in memory and extracted in parallel
+import os
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import document_extraction
+from content_sniffing import sniff_upload
+from document_extraction import extract_document, iter_text_units, collect_units_within_budget
+from ingestion import open_buffer
+from token_estimation import estimate_tokens
+
+ARCHIVE_EXTENSIONS = ['zip']
+
+# Member extensions that have an extractor; everything else in the archive is skipped
+ARCHIVE_MEMBER_EXTENSIONS = [
+    'pdf', 'docx', 'csv', 'tsv', 'xlsx',
+    'txt', 'md', 'markdown', 'rst', 'log', 'html', 'htm', 'xml', 'css', 'js', 'ts', 'py',
+    'json', 'ndjson', 'jsonl', 'yaml', 'yml', 'toml', 'ini'
+]
+
+# Zip bomb guards: member count, uncompressed size per member and in total, and compression ratio
+ARCHIVE_MAX_MEMBERS = int(os.environ.get('ARCHIVE_MAX_MEMBERS', 1000))
+ARCHIVE_MAX_MEMBER_BYTES = int(os.environ.get('ARCHIVE_MAX_MEMBER_BYTES', 64 * 1024 * 1024))
+ARCHIVE_MAX_TOTAL_BYTES = int(os.environ.get('ARCHIVE_MAX_TOTAL_BYTES', 512 * 1024 * 1024))
+ARCHIVE_MAX_COMPRESSION_RATIO = 100
+
+# Members below this size are not checked against the compression ratio
+ARCHIVE_RATIO_MIN_BYTES = 1024 * 1024
+
+# Bytes read from a member at a time
+ARCHIVE_READ_STEP = 1024 * 1024
+
+# Appended to a file that is cut to fit the budget
+FILE_OMISSION_MARKER = "\n[... rest of this file omitted to fit the token budget ...]\n"
+
+# Text a cut file keeps at least besides its marker, in tokens; with less room files are left out whole
+ARCHIVE_MIN_FILE_TOKENS = 64
+
+# Stands in for the files left out whole; the report lists their names
+FILES_OMISSION_NOTE = "\n\n[... {count} more files omitted to fit the token budget ...]\n"
+
+
+class ArchiveError(Exception):
+    """Raised for archives that are rejected as a whole; status_code is the HTTP status to return."""
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _member_ext(name):
+    base = name.rsplit('/', 1)[-1]
+    return base.rsplit('.', 1)[-1].lower() if '.' in base else ''
+
+
+def _skip_reason(info, total_bytes):
+    """Return why a member is not extracted, or None if it should be."""
+    base = info.filename.rsplit('/', 1)[-1]
+    if info.is_dir():
+        return 'directory'
+    if info.filename.startswith('__MACOSX/') or base.startswith('.'):
+        return 'hidden file'
+    if info.flag_bits & 0x1:
+        return 'encrypted'
+    ext = _member_ext(info.filename)
+    if ext in ARCHIVE_EXTENSIONS:
+        return 'nested archive'
+    if ext not in ARCHIVE_MEMBER_EXTENSIONS:
+        return 'unsupported file type'
+    if info.file_size > ARCHIVE_MAX_MEMBER_BYTES:
+        return f"larger than {ARCHIVE_MAX_MEMBER_BYTES} bytes"
+    if info.file_size > ARCHIVE_RATIO_MIN_BYTES and info.file_size > ARCHIVE_MAX_COMPRESSION_RATIO * max(info.compress_size, 1):
+        return 'suspicious compression ratio'
+    if total_bytes + info.file_size > ARCHIVE_MAX_TOTAL_BYTES:
+        return f"archive total exceeds {ARCHIVE_MAX_TOTAL_BYTES} bytes"
+    return None
+
+
+def _read_member(archive, info):
+    """
+    Read a member into memory without trusting its declared size: reading stops as soon as
+    the data grows past what the central directory promised.
+    """
+    parts = []
+    size = 0
+    with archive.open(info) as member:
+        while True:
+            chunk = member.read(ARCHIVE_READ_STEP)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > info.file_size:
+                raise ArchiveError(f"{info.filename} is larger than its declared size")
+            parts.append(chunk)
+    return b"".join(parts)
+
+
+def _extract_member(name, data):
+    try:
+        entry = extract_document(data, sniff_upload(data, name)['file_type'])
+        return {'name': name, 'file_type': entry['file_type'], 'text': entry['text'], 'byte_count': len(data)}
+    except Exception as e:
+        return {'name': name, 'file_type': _member_ext(name), 'text': '', 'byte_count': len(data), 'error': str(e)}
+
+
+def _open_archive(archive_bytes):
+    try:
+        archive = zipfile.ZipFile(open_buffer(archive_bytes))
+    except zipfile.BadZipFile as e:
+        raise ArchiveError(f"Not a valid ZIP archive: {str(e)}")
+    if len(archive.infolist()) > ARCHIVE_MAX_MEMBERS:
+        archive.close()
+        raise ArchiveError(f"Archive has more than {ARCHIVE_MAX_MEMBERS} entries", 413)
+    return archive
+
+
+def inspect_archive(archive_bytes):
+    """
+    Check an archive against the limits using its central directory only, without decompressing.
+    Returns the members that would be extracted and those that would be skipped.
+    """
+    files = []
+    skipped = []
+    total_bytes = 0
+    with _open_archive(archive_bytes) as archive:
+        for info in archive.infolist():
+            reason = _skip_reason(info, total_bytes)
+            if reason is None:
+                files.append({'name': info.filename, 'size': info.file_size})
+                total_bytes += info.file_size
+            elif not info.is_dir():
+                skipped.append({'name': info.filename, 'reason': reason})
+    return {'files': files, 'skipped': skipped, 'uncompressed_bytes': total_bytes}
+
+
+def iter_archive_members(archive_bytes, skipped):
+    """
+    Yield (name, bytes) for the extractable members of a ZIP archive in archive order and
+    record every other member with the reason in skipped. Nothing is written to disk.
+    """
+    with _open_archive(archive_bytes) as archive:
+        total_bytes = 0
+        for info in archive.infolist():
+            reason = _skip_reason(info, total_bytes)
+            if reason is None:
+                try:
+                    data = _read_member(archive, info)
+                except (ArchiveError, zipfile.BadZipFile, NotImplementedError, RuntimeError) as e:
+                    reason = str(e)
+            if reason is not None:
+                if not info.is_dir():
+                    skipped.append({'name': info.filename, 'reason': reason})
+                continue
+            total_bytes += len(data)
+            yield info.filename, data
+
+
+def extract_archive(archive_bytes):
+    """
+    Extract every supported member of a ZIP archive with the regular extractors, several members
+    at a time, and join the results under per-file headers. The entry records where each file's
+    text starts so the text can later be fitted to a token budget file by file.
+    """
+    started = time.time()
+    files = []
+    skipped = []
+    pending = deque()
+    # Bound the members held in memory to what the workers can take on
+    workers = document_extraction.EXTRACTION_WORKERS
+    window = max(2, workers * 2)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for name, data in iter_archive_members(archive_bytes, skipped):
+            pending.append(executor.submit(_extract_member, name, data))
+            if len(pending) >= window:
+                files.append(pending.popleft().result())
+        while pending:
+            files.append(pending.popleft().result())
+
+    parts = []
+    offset = 0
+    manifest = []
+    for extracted in files:
+        header = ("\n\n" if parts else "") + f"## File: {extracted['name']}\n\n"
+        body = extracted['text'] or f"(could not extract text: {extracted.get('error', 'empty file')})\n"
+        manifest.append({
+            'name': extracted['name'],
+            'file_type': extracted['file_type'],
+            'byte_count': extracted['byte_count'],
+            'char_count': len(extracted['text']),
+            'offset': offset,
+            'length': len(header) + len(body),
+            'error': extracted.get('error')
+        })
+        parts.append(header)
+        parts.append(body)
+        offset += len(header) + len(body)
+
+    text = "".join(parts)
+    print(f"Extracted {len(files)} archive members ({len(skipped)} skipped) in {time.time() - started:.2f}s")
+    return {
+        'text': text,
+        'file_type': 'zip',
+        'page_count': None,
+        'char_count': len(text),
+        'byte_count': len(archive_bytes),
+        'boilerplate': None,
+        'archive': {'files': manifest, 'skipped': skipped}
+    }
+
+
+def _allocate_files(needs, token_budget, marker_tokens, note_tokens):
+    """
+    Water-filling: repeatedly give the smallest remaining file its full need if it is under the
+    fair share. The files left over are cut, so each share first pays for the file's omission
+    marker; once the shares cannot pay for a marker and ARCHIVE_MIN_FILE_TOKENS of text, the last
+    of those files in archive order is left out entirely. Returns (allocation, omitted indexes).
+    """
+    allocation = [0] * len(needs)
+    omitted = []
+    remaining = token_budget
+    open_files = sorted(range(len(needs)), key=lambda index: needs[index])
+    while open_files:
+        share = remaining // len(open_files)
+        index = open_files[0]
+        if needs[index] <= share:
+            allocation[index] = needs[index]
+            remaining -= needs[index]
+            open_files.pop(0)
+        elif share - marker_tokens < ARCHIVE_MIN_FILE_TOKENS:
+            if not omitted:
+                # One note stands in for all the files left out
+                remaining -= note_tokens
+            dropped = max(open_files)
+            open_files.remove(dropped)
+            omitted.append(dropped)
+        else:
+            for index in open_files:
+                allocation[index] = share - marker_tokens
+            break
+    return allocation, sorted(omitted)
+
+
+def fit_archive_to_budget(entry, token_budget):
+    """
+    Cut an extracted archive to token_budget so that every file gets a fair share: files
+    smaller than an equal split keep all their text and the rest is divided among the larger
+    ones, or left out when there are too many to share the budget. Returns the same report as
+    collect_units_within_budget, with files as units, plus the names of the files left out.
+    """
+    manifest = entry['archive']['files']
+    sections = [entry['text'][item['offset']:item['offset'] + item['length']] for item in manifest]
+    needs = [estimate_tokens(section) for section in sections]
+    marker_tokens = estimate_tokens(FILE_OMISSION_MARKER)
+    note_tokens = estimate_tokens(FILES_OMISSION_NOTE.format(count=len(sections)))
+
+    # Estimates are rounded down part by part, so the joined text is estimated again and the
+    # files are allocated again with less room until it fits
+    allowed_budget = token_budget
+    while True:
+        allocation, omitted = _allocate_files(needs, allowed_budget, marker_tokens, note_tokens)
+        omitted_set = set(omitted)
+        parts = []
+        included_units = 0
+        included = []
+        for index, (section, need, allowed) in enumerate(zip(sections, needs, allocation)):
+            if index in omitted_set:
+                continue
+            if need <= allowed:
+                parts.append(section)
+                included_units += 1
+                included.append({'start': index, 'end': index + 1, 'tokens': need, 'partial': False})
+                continue
+            cut = collect_units_within_budget(iter_text_units(section), allowed)
+            parts.append(cut['text'] + FILE_OMISSION_MARKER)
+            included.append({'start': index, 'end': index + 1, 'tokens': cut['estimated_tokens'], 'partial': True})
+        if omitted:
+            parts.append(FILES_OMISSION_NOTE.format(count=len(omitted)))
+        text = "".join(parts)
+        estimated = estimate_tokens(text)
+        if estimated <= token_budget:
+            break
+        if allowed_budget <= 0:
+            # Not even the note about the files left out fits
+            text, estimated = "", 0
+            break
+        allowed_budget = max(0, allowed_budget - (estimated - token_budget))
+
+    return {
+        'text': text,
+        'estimated_tokens': estimated,
+        'token_budget': token_budget,
+        'truncated': included_units < len(sections),
+        'unit_kind': 'file',
+        'included_units': included_units,
+        'total_units': len(sections),
+        'omitted_units': len(sections) - included_units,
+        'manifest': included,
+        'omitted_files': [manifest[index]['name'] for index in omitted]
+    }
@@ -0,0 +1,108 @@
+"""
+Benchmark the streaming DOCX extractor against the python-docx object model.
+
+Usage:
+    python benchmarks/bench_docx_extraction.py [--paragraphs 50000] [--rows 5000] [--file path.docx]
+"""
+import argparse
+import io
+import os
+import sys
+import time
+import tracemalloc
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from document_extraction import extract_docx_text
+
+W_NAMESPACE = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+
+CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>'
+)
+
+ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/>'
+    '</Relationships>'
+)
+
+
+def build_docx(paragraphs, rows):
+    """Build a synthetic DOCX with headings, body paragraphs and a table."""
+    body = []
+    for index in range(paragraphs):
+        if index % 50 == 0:
+            body.append(f'<w:p><w:pPr><w:pStyle w:val="Heading1"/></w:pPr><w:r><w:t>Section {index // 50}</w:t></w:r></w:p>')
+        body.append(f'<w:p><w:r><w:t>Paragraph {index} of the benchmark document with some filler text '
+                    f'to make it look like real prose.</w:t></w:r></w:p>')
+    body.append('<w:tbl>')
+    for row in range(rows):
+        cells = "".join(f'<w:tc><w:p><w:r><w:t>r{row}c{column}</w:t></w:r></w:p></w:tc>' for column in range(4))
+        body.append(f'<w:tr>{cells}</w:tr>')
+    body.append('</w:tbl>')
+
+    document_xml = (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                    f'<w:document xmlns:w="{W_NAMESPACE}"><w:body>{"".join(body)}<w:sectPr/></w:body></w:document>')
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', CONTENT_TYPES)
+        archive.writestr('_rels/.rels', ROOT_RELS)
+        archive.writestr('word/document.xml', document_xml)
+    return buffer.getvalue()
+
+
+def python_docx_text(docx_bytes):
+    """The extraction path server.py used before the streaming extractor."""
+    import docx
+    doc = docx.Document(io.BytesIO(docx_bytes))
+    return "\n".join([paragraph.text for paragraph in doc.paragraphs])
+
+
+def measure(label, function, docx_bytes):
+    # Time and memory are measured in separate runs because tracing slows allocation down
+    started = time.perf_counter()
+    text = function(docx_bytes)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    function(docx_bytes)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<12} {elapsed:8.3f}s  peak {peak / (1024 * 1024):8.1f} MB  {len(text):>10} chars")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare DOCX extraction paths")
+    parser.add_argument("--paragraphs", type=int, default=50000, help="Body paragraphs in the synthetic document")
+    parser.add_argument("--rows", type=int, default=5000, help="Table rows in the synthetic document")
+    parser.add_argument("--file", type=str, default=None, help="Benchmark an existing .docx instead")
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, 'rb') as f:
+            docx_bytes = f.read()
+    else:
+        docx_bytes = build_docx(args.paragraphs, args.rows)
+    print(f"Document size: {len(docx_bytes) / (1024 * 1024):.1f} MB compressed")
+
+    measure("streaming", extract_docx_text, docx_bytes)
+    try:
+        measure("python-docx", python_docx_text, docx_bytes)
+    except ImportError:
+        print("python-docx is not installed; skipping the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+# Output and thinking budgets for generation requests, learned from completed runs
+import json
+import os
+import threading
+from collections import deque
+
+# Whether requests that do not send "adaptive_budget" get planned budgets; the max_tokens and
+# thinking_budget they send are then upper bounds rather than the values used
+ADAPTIVE_BUDGET_BY_DEFAULT = os.environ.get('ADAPTIVE_BUDGET_BY_DEFAULT', 'true').lower() == 'true'
+
+# Input sizes in tokens (upper bounds, None for the rest) that observed outputs are grouped by
+INPUT_TOKEN_BUCKETS = [1000, 4000, 16000, 64000, None]
+
+# Tokens of a generated page per input bucket, used until enough runs of a bucket were observed
+PRIOR_OUTPUT_TOKENS = [8000, 12000, 20000, 32000, 48000]
+
+# Content types whose pages run longer than prose (charts, tables, per-file sections)
+CONTENT_TYPE_OUTPUT_FACTORS = {'table': 1.25, 'structured': 1.25, 'archive': 1.5}
+
+# Runs needed in a bucket before they replace the prior, and runs kept per bucket
+MIN_BUCKET_OBSERVATIONS = 5
+BUCKET_WINDOW = 100
+
+# The planned output covers this quantile of the observed page lengths with some headroom
+OUTPUT_QUANTILE = 0.95
+OUTPUT_HEADROOM = 1.25
+MIN_OUTPUT_TOKENS = 4096
+
+# A run that used up its max_tokens was cut short; its length is recorded this much longer
+TRUNCATED_OUTPUT_FACTOR = 1.5
+
+# Thinking budget as a share of the planned output, and the smallest budget the API accepts
+THINKING_SHARE = 0.25
+MIN_THINKING_TOKENS = 1024
+
+# Output throughput assumed per model until runs are observed, and the fixed latency of a request
+PRIOR_TOKENS_PER_SECOND = 60.0
+REQUEST_LATENCY_SECONDS = 5.0
+
+# Weight of the newest run in the smoothed throughput
+THROUGHPUT_SMOOTHING = 0.2
+
+# Where the observed runs are kept between restarts
+BUDGET_PLANNER_PATH = os.environ.get('BUDGET_PLANNER_PATH', '/tmp/file-visualizer-budget-planner.json')
+
+
+def _bucket(input_tokens):
+    for index, limit in enumerate(INPUT_TOKEN_BUCKETS):
+        if limit is None or input_tokens <= limit:
+            return index
+    return len(INPUT_TOKEN_BUCKETS) - 1
+
+
+def _quantile(values, quantile):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * quantile))]
+
+
+class BudgetPlanner:
+    """
+    Picks max_tokens and the thinking budget of a generation request from the size and type
+    of its input and an optional latency target. Page lengths of completed runs are kept per
+    content type and input-size bucket, and throughput per model, so plans follow what the
+    model actually produces. The requested values are never exceeded.
+    """
+    def __init__(self, path=BUDGET_PLANNER_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._outputs = {}
+        self._tokens_per_second = {}
+        self._load()
+
+    def _expected_output(self, content_type, bucket):
+        # Caller holds the lock. Runs of the same content type first, then runs of any type
+        for key in (f"{content_type}:{bucket}", f"*:{bucket}"):
+            outputs = self._outputs.get(key)
+            if outputs and len(outputs) >= MIN_BUCKET_OBSERVATIONS:
+                return _quantile(outputs, OUTPUT_QUANTILE), 'observed', len(outputs)
+        prior = PRIOR_OUTPUT_TOKENS[bucket] * CONTENT_TYPE_OUTPUT_FACTORS.get(content_type, 1.0)
+        return prior, 'prior', 0
+
+    def plan(self, content_type, input_tokens, model, max_tokens, thinking_budget, latency_target=None, adaptive=True):
+        """
+        Return the budgets for a request as a dict with max_tokens and thinking_budget, for the
+        stream_start report. max_tokens includes the thinking budget, as the API counts it.
+        """
+        plan = {
+            'adaptive': adaptive,
+            'model': model,
+            'content_type': content_type,
+            'input_tokens': input_tokens,
+            'latency_target': latency_target,
+            'requested_max_tokens': max_tokens,
+            'requested_thinking_budget': thinking_budget,
+            'max_tokens': max_tokens,
+            'thinking_budget': thinking_budget
+        }
+        if not adaptive:
+            return plan
+
+        with self._lock:
+            expected, basis, observations = self._expected_output(content_type, _bucket(input_tokens))
+            tokens_per_second = self._tokens_per_second.get(model, PRIOR_TOKENS_PER_SECOND)
+
+        output = max(MIN_OUTPUT_TOKENS, int(expected * OUTPUT_HEADROOM))
+        thinking = 0
+        if thinking_budget > 0:
+            thinking = min(thinking_budget, max(MIN_THINKING_TOKENS, int(output * THINKING_SHARE)))
+
+        if latency_target:
+            affordable = int((float(latency_target) - REQUEST_LATENCY_SECONDS) * tokens_per_second)
+            if output + thinking > affordable:
+                # Thinking gives way first; the page itself is not planned below MIN_OUTPUT_TOKENS
+                if thinking:
+                    thinking = max(MIN_THINKING_TOKENS, min(thinking, affordable - output))
+                output = max(MIN_OUTPUT_TOKENS, min(output, affordable - thinking))
+
+        planned_max_tokens = min(max_tokens, output + thinking)
+        if thinking and thinking >= planned_max_tokens:
+            # The API needs room for the answer after thinking
+            thinking = max(MIN_THINKING_TOKENS, planned_max_tokens // 2) if planned_max_tokens > MIN_THINKING_TOKENS else 0
+        plan.update({
+            'max_tokens': planned_max_tokens,
+            'thinking_budget': thinking,
+            'expected_output_tokens': int(expected),
+            'expected_seconds': round(REQUEST_LATENCY_SECONDS + planned_max_tokens / tokens_per_second, 1),
+            'basis': basis,
+            'observations': observations
+        })
+        return plan
+
+    def observe(self, plan, page_tokens, output_tokens, elapsed):
+        """
+        Record a completed run: page_tokens of generated page, output_tokens reported in
+        total (thinking included) and the elapsed seconds of generation.
+        """
+        if page_tokens <= 0:
+            return
+        if output_tokens >= plan['max_tokens'] * 0.98:
+            page_tokens = int(page_tokens * TRUNCATED_OUTPUT_FACTOR)
+        bucket = _bucket(plan['input_tokens'])
+        model = plan.get('model')
+        with self._lock:
+            for key in (f"{plan['content_type']}:{bucket}", f"*:{bucket}"):
+                self._outputs.setdefault(key, deque(maxlen=BUCKET_WINDOW)).append(page_tokens)
+            if model and elapsed > REQUEST_LATENCY_SECONDS and output_tokens > 0:
+                observed = output_tokens / (elapsed - REQUEST_LATENCY_SECONDS)
+                previous = self._tokens_per_second.get(model, observed)
+                self._tokens_per_second[model] = previous + THROUGHPUT_SMOOTHING * (observed - previous)
+            state = self._state()
+        self._save(state)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'runs': {key: len(outputs) for key, outputs in self._outputs.items() if key.startswith('*:')},
+                'tokens_per_second': {model: round(value, 1) for model, value in self._tokens_per_second.items()}
+            }
+
+    def _state(self):
+        # Caller holds the lock
+        return {
+            'buckets': INPUT_TOKEN_BUCKETS,
+            'outputs': {key: list(outputs) for key, outputs in self._outputs.items()},
+            'tokens_per_second': dict(self._tokens_per_second)
+        }
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        if state.get('buckets') != INPUT_TOKEN_BUCKETS:
+            # Runs grouped by different buckets cannot be reused
+            return
+        with self._lock:
+            self._outputs = {key: deque(outputs, maxlen=BUCKET_WINDOW) for key, outputs in state['outputs'].items()}
+            self._tokens_per_second = state['tokens_per_second']
+
+    def _save(self, state):
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Write to a unique temporary name and rename so a crash never leaves a partial file
+            temp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Failed to save budget planner state: {str(e)}")
+
+
+# Shared planner used by server.py
+budget_planner = BudgetPlanner()
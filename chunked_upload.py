@@ -0,0 +1,267 @@
+# Resumable chunked uploads written straight to a preallocated file
+import hashlib
+import json
+import mmap
+import os
+import threading
+import time
+import uuid
+
+# Where partially uploaded files and their state live
+CHUNKED_UPLOAD_DIR = os.environ.get('CHUNKED_UPLOAD_DIR', '/tmp/file-visualizer-chunked-uploads')
+
+# Default and maximum chunk size in bytes
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+MAX_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Unfinished uploads are discarded after this many seconds without activity
+CHUNKED_UPLOAD_TTL = int(os.environ.get('CHUNKED_UPLOAD_TTL', 24 * 3600))
+
+# Unfinished uploads kept at once, and the bytes preallocated for them; init is refused beyond either
+CHUNKED_UPLOAD_MAX_PENDING = int(os.environ.get('CHUNKED_UPLOAD_MAX_PENDING', 256))
+CHUNKED_UPLOAD_MAX_PENDING_BYTES = int(os.environ.get('CHUNKED_UPLOAD_MAX_PENDING_BYTES', 8 * 1024 * 1024 * 1024))
+
+# Minimum seconds between scans of the upload directory for expired uploads
+CLEANUP_INTERVAL = 60
+
+
+class ChunkedUploadError(Exception):
+    """Raised for invalid chunked upload requests; status_code is the HTTP status to return."""
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _check_sha256(value):
+    """Reject a client-supplied digest that is not a hex SHA-256."""
+    if value is None or value == '':
+        return
+    if not isinstance(value, str) or len(value) != 64 or any(c not in '0123456789abcdefABCDEF' for c in value):
+        raise ChunkedUploadError("sha256 must be a 64-character hex digest")
+
+
+class ChunkedUploadStore:
+    """
+    Tracks resumable uploads. Each upload is a preallocated file that chunks are written into
+    with pwrite at their offset, plus a small JSON state file so an interrupted upload can be
+    resumed (even after a server restart) by asking which chunks are still missing.
+    """
+    def __init__(self, upload_dir=CHUNKED_UPLOAD_DIR, ttl=CHUNKED_UPLOAD_TTL,
+                 max_pending=CHUNKED_UPLOAD_MAX_PENDING, max_pending_bytes=CHUNKED_UPLOAD_MAX_PENDING_BYTES):
+        self.upload_dir = upload_dir
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self.max_pending_bytes = max_pending_bytes
+        self._lock = threading.Lock()
+        self._last_cleanup = 0
+
+    def init(self, file_name, size, chunk_size=DEFAULT_CHUNK_SIZE, sha256=None, max_size=None):
+        """Start an upload and preallocate its file. Returns the upload state."""
+        if size <= 0:
+            raise ChunkedUploadError("size must be positive")
+        if max_size is not None and size > max_size:
+            raise ChunkedUploadError(f"File of {size} bytes exceeds the limit of {max_size} bytes", 413)
+        if chunk_size <= 0 or chunk_size > MAX_CHUNK_SIZE:
+            raise ChunkedUploadError(f"chunk_size must be between 1 and {MAX_CHUNK_SIZE} bytes")
+        _check_sha256(sha256)
+
+        os.makedirs(self.upload_dir, exist_ok=True)
+        upload_id = uuid.uuid4().hex
+        state = {
+            'upload_id': upload_id,
+            'file_name': file_name,
+            'size': size,
+            'chunk_size': chunk_size,
+            'chunk_count': -(-size // chunk_size),
+            'sha256': sha256.lower() if sha256 else None,
+            'received': [],
+            'created_at': time.time(),
+            'updated_at': time.time()
+        }
+
+        self.cleanup_expired()
+        with self._lock:
+            # Every upload preallocates its whole file, so the unfinished ones are bounded
+            pending, pending_bytes = self._pending()
+            if pending >= self.max_pending or pending_bytes + size > self.max_pending_bytes:
+                raise ChunkedUploadError("Too many unfinished uploads; finish or resume one before starting another", 429)
+
+            data_path = self._data_path(upload_id)
+            fd = os.open(data_path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+            try:
+                if hasattr(os, 'posix_fallocate'):
+                    os.posix_fallocate(fd, 0, size)
+                else:
+                    os.ftruncate(fd, size)
+            except OSError as e:
+                os.close(fd)
+                os.remove(data_path)
+                raise ChunkedUploadError(f"Cannot reserve {size} bytes for the upload: {e.strerror}", 507)
+            os.close(fd)
+            self._save_state(state)
+        return self._public_state(state)
+
+    def put_chunk(self, upload_id, offset, data, chunk_sha256=None):
+        """Verify a chunk and write it at offset. Returns the updated upload state."""
+        state = self._load_state(upload_id)
+        chunk_size = state['chunk_size']
+        if offset < 0 or offset % chunk_size != 0 or offset >= state['size']:
+            raise ChunkedUploadError(f"offset must be a multiple of {chunk_size} within the file")
+
+        index = offset // chunk_size
+        expected_length = min(chunk_size, state['size'] - offset)
+        if len(data) != expected_length:
+            raise ChunkedUploadError(f"Chunk {index} must be {expected_length} bytes, got {len(data)}")
+        if chunk_sha256 and hashlib.sha256(data).hexdigest() != chunk_sha256.lower():
+            raise ChunkedUploadError(f"Chunk {index} failed its SHA-256 check", 422)
+
+        try:
+            fd = os.open(self._data_path(upload_id), os.O_WRONLY)
+        except FileNotFoundError:
+            # A finalize claimed or removed the file after the state was read
+            if os.path.exists(self._finalizing_path(upload_id)):
+                raise ChunkedUploadError(f"Upload {upload_id} is being finalized", 409)
+            raise ChunkedUploadError(f"Unknown or expired upload_id: {upload_id}", 404)
+        try:
+            written = 0
+            while written < len(data):
+                written += os.pwrite(fd, data[written:], offset + written)
+        finally:
+            os.close(fd)
+
+        with self._lock:
+            # Reload so concurrent chunk writers do not lose each other's updates
+            state = self._load_state(upload_id)
+            if index not in state['received']:
+                state['received'].append(index)
+            state['updated_at'] = time.time()
+            self._save_state(state)
+        return self._public_state(state)
+
+    def status(self, upload_id):
+        """Return the upload state, including the chunks still missing."""
+        return self._public_state(self._load_state(upload_id))
+
+    def finalize(self, upload_id, sha256=None):
+        """
+        Check that every chunk arrived and that the whole file matches its SHA-256.
+        Returns (state, data) where data is a read-only memory map of the completed file.
+        """
+        _check_sha256(sha256)
+        finalizing_path = self._finalizing_path(upload_id)
+        with self._lock:
+            state = self._load_state(upload_id)
+            public_state = self._public_state(state)
+            if public_state['missing']:
+                raise ChunkedUploadError(f"{len(public_state['missing'])} chunks are still missing", 409)
+            # Claim the file, so a concurrent finalize or a late chunk is refused instead of
+            # finding it gone; the file is hashed outside the lock
+            try:
+                os.rename(self._data_path(upload_id), finalizing_path)
+            except FileNotFoundError:
+                raise ChunkedUploadError(f"Upload {upload_id} is already being finalized", 409)
+
+        with open(finalizing_path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        expected = (sha256 or state['sha256'] or '').lower()
+        actual = hashlib.sha256(data).hexdigest()
+        if expected and actual != expected:
+            data.close()
+            # Hand the file back so the damaged chunks can be sent again
+            try:
+                os.rename(finalizing_path, self._data_path(upload_id))
+            except FileNotFoundError:
+                pass
+            raise ChunkedUploadError("The assembled file failed its SHA-256 check", 422)
+
+        # The mapping keeps the data alive, so the files can go right away
+        with self._lock:
+            self._remove_files(upload_id)
+        return dict(public_state, sha256=actual), data
+
+    def cleanup_expired(self):
+        """Remove uploads that have been idle for longer than the TTL (at most once per CLEANUP_INTERVAL)."""
+        if time.time() - self._last_cleanup < CLEANUP_INTERVAL or not os.path.isdir(self.upload_dir):
+            return 0
+        self._last_cleanup = time.time()
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for name in os.listdir(self.upload_dir):
+            if not name.endswith('.json'):
+                continue
+            upload_id = name[:-len('.json')]
+            try:
+                if os.stat(os.path.join(self.upload_dir, name)).st_mtime < cutoff:
+                    self._remove_files(upload_id)
+                    removed += 1
+            except OSError:
+                continue
+        return removed
+
+    def _public_state(self, state):
+        received = set(state['received'])
+        return {
+            'upload_id': state['upload_id'],
+            'file_name': state['file_name'],
+            'size': state['size'],
+            'chunk_size': state['chunk_size'],
+            'chunk_count': state['chunk_count'],
+            'received_chunks': len(received),
+            'missing': [index for index in range(state['chunk_count']) if index not in received]
+        }
+
+    def _data_path(self, upload_id):
+        return os.path.join(self.upload_dir, f"{upload_id}.part")
+
+    def _finalizing_path(self, upload_id):
+        return os.path.join(self.upload_dir, f"{upload_id}.finalizing")
+
+    def _pending(self):
+        """Count the unfinished uploads and the bytes preallocated for them. Caller holds the lock."""
+        pending = 0
+        pending_bytes = 0
+        try:
+            names = os.listdir(self.upload_dir)
+        except FileNotFoundError:
+            return 0, 0
+        for name in names:
+            if not name.endswith(('.part', '.finalizing')):
+                continue
+            try:
+                pending_bytes += os.stat(os.path.join(self.upload_dir, name)).st_size
+            except OSError:
+                continue
+            pending += 1
+        return pending, pending_bytes
+
+    def _state_path(self, upload_id):
+        return os.path.join(self.upload_dir, f"{upload_id}.json")
+
+    def _load_state(self, upload_id):
+        # Upload ids are hex strings; reject anything that could escape the directory
+        if not upload_id or not all(c in '0123456789abcdef' for c in upload_id):
+            raise ChunkedUploadError("Invalid upload_id")
+        try:
+            with open(self._state_path(upload_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise ChunkedUploadError(f"Unknown or expired upload_id: {upload_id}", 404)
+
+    def _save_state(self, state):
+        path = self._state_path(state['upload_id'])
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(temp_path, path)
+
+    def _remove_files(self, upload_id):
+        for path in (self._data_path(upload_id), self._finalizing_path(upload_id), self._state_path(upload_id)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+# Shared store used by server.py
+chunked_upload_store = ChunkedUploadStore()
@@ -0,0 +1,257 @@
+# Cleanup stages applied to extracted text before it is sent to the model
+import math
+import os
+import random
+import re
+import zlib
+
+from token_estimation import estimate_tokens
+
+# NumPy speeds up MinHash signatures but is optional
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# A line is boilerplate when it recurs on at least this fraction of pages
+BOILERPLATE_MIN_PAGE_FRACTION = float(os.environ.get('BOILERPLATE_MIN_PAGE_FRACTION', 0.5))
+
+# Documents with fewer pages are left alone; there is not enough evidence of repetition
+BOILERPLATE_MIN_PAGES = 3
+
+# Only this many non-empty lines at the top and bottom of each page are header/footer candidates
+BOILERPLATE_EDGE_LINES = int(os.environ.get('BOILERPLATE_EDGE_LINES', 4))
+
+# Number of leading pages used to learn the repeated lines, so streaming extraction can strip as it goes
+BOILERPLATE_SAMPLE_PAGES = 20
+
+# Lines longer than this are real content, not running headers
+BOILERPLATE_MAX_LINE_LENGTH = 200
+
+_DIGITS = re.compile(r'\d+')
+_WHITESPACE = re.compile(r'\s+')
+
+# Page numbers once their digits are masked: '7', '- 7 -', 'Page 7', 'page 7 of 40', '7/40'
+_PAGE_NUMBER = re.compile(r'^[\s\-–]*(page\s*)?#(\s*(of|/)\s*#)?[\s\-–]*$')
+
+
+def _normalize_line(line):
+    """
+    Normalize a line for comparison across pages. Returns (normalized, page_number): page-number
+    lines ('Page 3 of 40', '- 7 -') compare equal regardless of their digits and carry the first
+    number as page_number; every other line must match exactly and has page_number None.
+    """
+    normalized = _WHITESPACE.sub(' ', line.strip()).lower()
+    masked = _DIGITS.sub('#', normalized)
+    if _PAGE_NUMBER.match(masked):
+        return masked, int(_DIGITS.search(normalized).group())
+    return normalized, None
+
+
+def _edge_line_indexes(lines, edge_lines):
+    """Return the indexes of the first and last edge_lines non-empty lines of a page."""
+    non_empty = [index for index, line in enumerate(lines) if line.strip()]
+    return set(non_empty[:edge_lines]) | set(non_empty[-edge_lines:])
+
+
+class BoilerplateStripper:
+    """
+    Finds running headers, footers, page numbers and notices that repeat across the pages
+    of a document and removes them. Patterns are learned from the leading pages and then
+    applied to every page, counting the characters removed.
+    """
+    def __init__(self, min_fraction=BOILERPLATE_MIN_PAGE_FRACTION, edge_lines=BOILERPLATE_EDGE_LINES):
+        self.min_fraction = min_fraction
+        self.edge_lines = edge_lines
+        self.patterns = set()
+        # Page-number patterns mapped to the offset between the printed number and the page index
+        self.page_numbers = {}
+        self.lines_removed = 0
+        self.chars_saved = 0
+        self.tokens_saved = 0
+
+    def learn(self, pages):
+        """
+        Learn the repeated edge lines of a sample of page texts, starting at the first page.
+        A page-number pattern is only learned when its number goes up with the page, i.e. it
+        stays the same distance from the page index, so numeric body lines (totals, years,
+        table cells) at the edge of a page are not mistaken for page numbers.
+        """
+        if len(pages) < BOILERPLATE_MIN_PAGES:
+            return
+        counts = {}
+        for page_index, page_text in enumerate(pages):
+            lines = page_text.split("\n")
+            seen = set()
+            for index in _edge_line_indexes(lines, self.edge_lines):
+                line = lines[index]
+                if len(line) > BOILERPLATE_MAX_LINE_LENGTH:
+                    continue
+                normalized, page_number = _normalize_line(line)
+                seen.add((normalized, None if page_number is None else page_number - page_index))
+            for key in seen:
+                counts[key] = counts.get(key, 0) + 1
+
+        threshold = max(BOILERPLATE_MIN_PAGES, math.ceil(self.min_fraction * len(pages)))
+        self.patterns = {normalized for (normalized, offset), count in counts.items()
+                         if offset is None and count >= threshold}
+        self.page_numbers = {normalized: offset for (normalized, offset), count in counts.items()
+                             if offset is not None and count >= threshold}
+
+    def _is_boilerplate(self, line, page_index):
+        normalized, page_number = _normalize_line(line)
+        if page_number is None:
+            return normalized in self.patterns
+        return self.page_numbers.get(normalized) == page_number - page_index
+
+    def strip(self, page_text, page_index):
+        """Remove learned boilerplate lines from the top and bottom of the page at page_index."""
+        if not (self.patterns or self.page_numbers):
+            return page_text
+        lines = page_text.split("\n")
+        remove = {index for index in _edge_line_indexes(lines, self.edge_lines)
+                  if self._is_boilerplate(lines[index], page_index)}
+        if not remove:
+            return page_text
+
+        removed_text = "\n".join(lines[index] for index in remove)
+        self.lines_removed += len(remove)
+        self.chars_saved += len(removed_text) + len(remove)
+        self.tokens_saved += estimate_tokens(removed_text) + 1
+        return "\n".join(line for index, line in enumerate(lines) if index not in remove)
+
+    def strip_pages(self, pages):
+        """Learn from the leading pages of a fully extracted document and strip all of them."""
+        self.learn(pages[:BOILERPLATE_SAMPLE_PAGES])
+        return [self.strip(page_text, page_index) for page_index, page_text in enumerate(pages)]
+
+    def report(self):
+        return {
+            'lines_removed': self.lines_removed,
+            'chars_saved': self.chars_saved,
+            'estimated_tokens_saved': self.tokens_saved
+        }
+
+
+def iter_stripped_pages(page_units, stripper):
+    """
+    Strip boilerplate from a stream of page units without parsing the whole document first.
+    The first BOILERPLATE_SAMPLE_PAGES pages are buffered to learn the patterns.
+    """
+    sample = []
+    for unit in page_units:
+        if len(sample) >= BOILERPLATE_SAMPLE_PAGES:
+            yield dict(unit, text=stripper.strip(unit['text'], unit['index']))
+            continue
+        sample.append(unit)
+        if len(sample) == BOILERPLATE_SAMPLE_PAGES:
+            stripper.learn([buffered['text'] for buffered in sample])
+            for buffered in sample:
+                yield dict(buffered, text=stripper.strip(buffered['text'], buffered['index']))
+
+    # Short documents end before the sample fills up
+    if len(sample) < BOILERPLATE_SAMPLE_PAGES:
+        stripper.learn([buffered['text'] for buffered in sample])
+        for buffered in sample:
+            yield dict(buffered, text=stripper.strip(buffered['text'], buffered['index']))
+
+
+# Near-duplicate detection: paragraphs are compared as sets of word shingles
+DEDUP_SHINGLE_WORDS = 5
+DEDUP_SHINGLE_CHARS = 5
+DEDUP_MIN_PARAGRAPH_CHARS = 200
+DEDUP_SIMILARITY = float(os.environ.get('DEDUP_SIMILARITY', 0.8))
+
+# MinHash signature length and LSH banding; 8 bands of 8 rows catch pairs above ~0.77 similarity
+DEDUP_NUM_HASHES = 64
+DEDUP_BANDS = 8
+
+_HASH_MASK = (1 << 64) - 1
+_hash_seeds = random.Random(1)
+_MINHASH_PARAMS = [(_hash_seeds.getrandbits(64) | 1, _hash_seeds.getrandbits(64)) for _ in range(DEDUP_NUM_HASHES)]
+_WORD = re.compile(r'\w+')
+
+
+def _shingle_hashes(paragraph):
+    """
+    Hash the overlapping word n-grams of a paragraph. Paragraphs with too few words (rules,
+    symbol art, punctuation) use character n-grams instead, so they are only matched with
+    paragraphs that look like them rather than with every other word-less paragraph.
+    """
+    words = _WORD.findall(paragraph.lower())
+    if len(words) <= DEDUP_SHINGLE_WORDS:
+        text = _WHITESPACE.sub(' ', paragraph.strip().lower())
+        if len(text) <= DEDUP_SHINGLE_CHARS:
+            return {zlib.crc32(text.encode('utf-8', 'surrogatepass'))}
+        return {zlib.crc32(text[i:i + DEDUP_SHINGLE_CHARS].encode('utf-8', 'surrogatepass'))
+                for i in range(len(text) - DEDUP_SHINGLE_CHARS + 1)}
+    return {zlib.crc32(" ".join(words[i:i + DEDUP_SHINGLE_WORDS]).encode('utf-8'))
+            for i in range(len(words) - DEDUP_SHINGLE_WORDS + 1)}
+
+
+def _minhash_signature(shingles):
+    """Return the MinHash signature of a set of shingle hashes as a tuple."""
+    if NUMPY_AVAILABLE:
+        values = np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+        multipliers = np.array([a for a, _ in _MINHASH_PARAMS], dtype=np.uint64)[:, None]
+        offsets = np.array([b for _, b in _MINHASH_PARAMS], dtype=np.uint64)[:, None]
+        # uint64 arithmetic wraps around, which is the modulus we want
+        return tuple((multipliers * values + offsets).min(axis=1).tolist())
+    return tuple(min((a * value + b) & _HASH_MASK for value in shingles) for a, b in _MINHASH_PARAMS)
+
+
+def dedupe_paragraphs(text, similarity=DEDUP_SIMILARITY):
+    """
+    Collapse near-duplicate paragraphs (quoted replies, repeated blocks) to their first occurrence.
+    Paragraphs are MinHashed and bucketed with LSH, so only paragraphs sharing a bucket are compared
+    and the pass stays roughly linear. Returns the new text and a report of what was removed.
+    """
+    paragraphs = re.split(r'(\n[ \t]*\n)', text)
+    rows_per_band = DEDUP_NUM_HASHES // DEDUP_BANDS
+    buckets = {}
+    signatures = {}
+    duplicates = 0
+    chars_saved = 0
+    tokens_saved = 0
+
+    # Even indexes hold paragraphs, odd indexes the blank-line separators between them
+    for index in range(0, len(paragraphs), 2):
+        paragraph = paragraphs[index]
+        if len(paragraph) < DEDUP_MIN_PARAGRAPH_CHARS:
+            continue
+
+        signature = _minhash_signature(_shingle_hashes(paragraph))
+        band_keys = [(band, signature[band * rows_per_band:(band + 1) * rows_per_band]) for band in range(DEDUP_BANDS)]
+
+        original = None
+        candidates = {candidate for key in band_keys for candidate in buckets.get(key, ())}
+        for candidate in sorted(candidates):
+            matching = sum(1 for x, y in zip(signature, signatures[candidate]) if x == y)
+            if matching / DEDUP_NUM_HASHES >= similarity:
+                original = candidate
+                break
+
+        if original is None:
+            signatures[index] = signature
+            for key in band_keys:
+                buckets.setdefault(key, []).append(index)
+            continue
+
+        # Keep a short pointer to the first occurrence instead of the repeated block
+        first_words = " ".join(paragraphs[original].split()[:8])
+        reference = f"[Repeated content omitted: near-duplicate of the paragraph starting \"{first_words}...\"]"
+        if len(reference) >= len(paragraph):
+            # A pointer to a short word-less paragraph would be longer than the paragraph itself
+            continue
+        duplicates += 1
+        chars_saved += len(paragraph) - len(reference)
+        tokens_saved += estimate_tokens(paragraph) - estimate_tokens(reference)
+        paragraphs[index] = reference
+
+    report = {
+        'duplicates_removed': duplicates,
+        'chars_saved': chars_saved,
+        'estimated_tokens_saved': tokens_saved
+    }
+    return "".join(paragraphs), report
@@ -0,0 +1,123 @@
+# Fit long inputs into a token budget along page, section and paragraph boundaries
+import os
+
+from document_extraction import collect_units_within_budget
+from token_estimation import estimate_tokens
+
+# How content that exceeds the budget is cut: 'head' keeps the beginning, 'spread' keeps the
+# beginning, the end and evenly sampled units of the middle
+PACKING_STRATEGIES = ['head', 'spread']
+DEFAULT_PACKING_STRATEGY = os.environ.get('DEFAULT_PACKING_STRATEGY', 'head')
+
+# Shares of the budget kept for the beginning and the end with 'spread'; the rest samples the middle
+SPREAD_HEAD_SHARE = 0.4
+SPREAD_TAIL_SHARE = 0.2
+
+# Written where units were left out, so the model knows the content is not contiguous
+OMISSION_MARKER = "\n[... {count} {kind}(s) omitted to fit the token budget ...]\n\n"
+
+
+def _spread_indices(tokens, token_budget, marker_tokens):
+    """
+    Choose the units to keep: a run from the start within SPREAD_HEAD_SHARE of the budget,
+    a run from the end within SPREAD_TAIL_SHARE, and middle units at even intervals in what
+    is left. Each kept middle unit is charged for the omission marker it may add.
+    Returns the head, middle and tail indices as three lists.
+    """
+    count = len(tokens)
+    used = marker_tokens
+    head_end = 0
+    while head_end < count and used + tokens[head_end] <= token_budget * SPREAD_HEAD_SHARE:
+        used += tokens[head_end]
+        head_end += 1
+
+    tail_start = count
+    tail_used = 0
+    while tail_start - 1 > head_end and tail_used + tokens[tail_start - 1] <= token_budget * SPREAD_TAIL_SHARE:
+        tail_start -= 1
+        tail_used += tokens[tail_start]
+    used += tail_used
+
+    middle = range(head_end, tail_start)
+    remaining = token_budget - used
+    chosen = []
+    if middle and remaining > 0:
+        average = sum(tokens[index] for index in middle) / len(middle)
+        samples = max(1, min(len(middle), int(remaining / (average + marker_tokens))))
+        for sample in range(samples):
+            index = middle[(2 * sample + 1) * len(middle) // (2 * samples)]
+            cost = tokens[index] + marker_tokens
+            if cost <= remaining:
+                chosen.append(index)
+                remaining -= cost
+
+    return list(range(head_end)), chosen, list(range(tail_start, count))
+
+
+def _join_spread(units, tokens, indices, unit_kind):
+    """Join the kept units in order with a marker for each gap. Returns (text, manifest)."""
+    parts = []
+    manifest = []
+    previous = -1
+    for index in indices:
+        if index > previous + 1:
+            parts.append(OMISSION_MARKER.format(count=index - previous - 1, kind=unit_kind))
+        if manifest and manifest[-1]['end'] == index:
+            manifest[-1]['end'] = index + 1
+            manifest[-1]['tokens'] += tokens[index]
+        else:
+            manifest.append({'start': index, 'end': index + 1, 'tokens': tokens[index], 'partial': False})
+        parts.append(units[index]['text'])
+        previous = index
+    if previous < len(units) - 1:
+        parts.append(OMISSION_MARKER.format(count=len(units) - previous - 1, kind=unit_kind))
+    return "".join(parts), manifest
+
+
+def pack_units(units, token_budget, strategy=DEFAULT_PACKING_STRATEGY):
+    """
+    Fit units (pages, paragraphs) into token_budget. 'head' keeps units from the start and
+    stops parsing once the budget is reached; 'spread' needs every unit and keeps the start,
+    the end and a sample of the middle, with a marker for each gap. Returns the report of
+    collect_units_within_budget with the strategy that was applied.
+    """
+    if strategy != 'spread':
+        result = collect_units_within_budget(units, token_budget)
+        result['strategy'] = 'head'
+        return result
+
+    units = list(units)
+    tokens = [estimate_tokens(unit['text']) for unit in units]
+    unit_kind = units[0]['kind'] if units else None
+    marker_tokens = estimate_tokens(OMISSION_MARKER.format(count=len(units), kind=unit_kind))
+    # Content that fits, or whose first unit alone fills the head share, is cut from the start
+    if sum(tokens) <= token_budget or not tokens or tokens[0] + marker_tokens > token_budget * SPREAD_HEAD_SHARE:
+        result = collect_units_within_budget(iter(units), token_budget)
+        result['strategy'] = 'head'
+        return result
+
+    # The selection adds up per-unit estimates; the joined text is estimated again and middle
+    # samples (then the last units of the head) are dropped until it fits
+    head, middle, tail = _spread_indices(tokens, token_budget, marker_tokens)
+    while True:
+        text, manifest = _join_spread(units, tokens, head + middle + tail, unit_kind)
+        estimated = estimate_tokens(text)
+        excess = estimated - token_budget
+        if excess <= 0 or len(head) + len(middle) <= 1:
+            break
+        while excess > 0 and len(head) + len(middle) > 1:
+            excess -= tokens[middle.pop() if middle else head.pop()]
+
+    included_units = sum(item['end'] - item['start'] for item in manifest)
+    return {
+        'text': text,
+        'estimated_tokens': estimated,
+        'token_budget': token_budget,
+        'truncated': True,
+        'unit_kind': unit_kind,
+        'included_units': included_units,
+        'total_units': len(units),
+        'omitted_units': len(units) - included_units,
+        'manifest': manifest,
+        'strategy': 'spread'
+    }
@@ -0,0 +1,163 @@
+# Decide how to extract an upload from its leading bytes rather than its file name
+import base64
+import binascii
+import codecs
+import re
+import zipfile
+
+from ingestion import open_buffer
+
+# Bytes inspected for magic numbers, binary content and the text encoding
+SNIFF_PREFIX_BYTES = 64 * 1024
+
+# Share of control characters above which undecodable content is treated as binary
+BINARY_CONTROL_RATIO = 0.1
+
+# Extensions whose content is text; a text file keeps its extension so the right text stage applies
+TEXT_EXTENSIONS = [
+    'txt', 'md', 'markdown', 'rst', 'log', 'html', 'htm', 'xml', 'css', 'js', 'ts', 'py',
+    'json', 'ndjson', 'jsonl', 'yaml', 'yml', 'toml', 'ini', 'csv', 'tsv'
+]
+
+# Byte order marks, longest first so UTF-32 is not taken for UTF-16
+_BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+# Formats that have no extractor, by magic number
+_UNSUPPORTED_MAGIC = [
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'legacy Microsoft Office (.doc/.xls/.ppt)'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG image'),
+    (b'\xff\xd8\xff', 'JPEG image'),
+    (b'GIF8', 'GIF image'),
+    (b'\x1f\x8b', 'gzip archive'),
+    (b'7z\xbc\xaf\x27\x1c', '7-Zip archive'),
+    (b'Rar!\x1a\x07', 'RAR archive'),
+    (b'\x7fELF', 'ELF executable'),
+]
+
+# Base64 after whitespace is removed: '=' padding only at the end
+_BASE64 = re.compile(r'[A-Za-z0-9+/]*={0,2}')
+_WHITESPACE = re.compile(r'\s+')
+
+# Characters decoded to confirm the data is base64
+BASE64_CHECK_CHARS = 4096
+_CONTROL_BYTES = bytes(range(0, 9)) + bytes(range(14, 32))
+
+
+class UnsupportedContentError(ValueError):
+    """Raised for uploads whose content has no extractor, whatever their file name says."""
+
+
+def file_name_ext(file_name):
+    return file_name.rsplit('.', 1)[-1].lower() if file_name and '.' in file_name else 'txt'
+
+
+def looks_like_base64(file_content):
+    """
+    Whether a string field holds base64 (possibly a data URL) rather than raw text. Without a
+    data URL the whole field, whitespace removed, must be a multiple of 4 characters with
+    padding only at the end, its start must decode strictly, and the decoded bytes must start
+    like a PDF or ZIP package or be UTF-8 text. Words and digits that happen to pass as base64
+    decode to neither; clients that know the encoding should still state it.
+    """
+    if ';base64,' in file_content[:256]:
+        return True
+    compact = _WHITESPACE.sub('', file_content)
+    if not compact or len(compact) % 4 != 0 or not _BASE64.fullmatch(compact):
+        return False
+    try:
+        decoded = base64.b64decode(compact[:BASE64_CHECK_CHARS], validate=True)
+    except (binascii.Error, ValueError):
+        return False
+    if b'%PDF-' in decoded[:1024] or decoded.startswith((b'PK\x03\x04', b'PK\x05\x06')):
+        return True
+    if any(byte in _CONTROL_BYTES for byte in decoded):
+        return False
+    try:
+        # The decoded prefix may end inside a multi-byte character unless it is the whole field
+        codecs.getincrementaldecoder('utf-8')().decode(decoded, final=len(compact) <= BASE64_CHECK_CHARS)
+        return True
+    except UnicodeDecodeError:
+        return False
+
+
+def _zip_file_type(buffer):
+    """Tell DOCX and XLSX packages from plain ZIP archives by their central directory."""
+    try:
+        with zipfile.ZipFile(open_buffer(buffer)) as archive:
+            names = set(archive.namelist())
+    except zipfile.BadZipFile:
+        return None
+    if 'word/document.xml' in names:
+        return 'docx'
+    if 'xl/workbook.xml' in names:
+        return 'xlsx'
+    return 'zip'
+
+
+def detect_text_encoding(prefix):
+    """
+    Detect the encoding of text from its first bytes: a BOM, then UTF-16 without a BOM
+    (every other byte zero), then UTF-8, then Windows-1252. Returns None for binary data,
+    including an empty prefix.
+    """
+    for bom, encoding in _BOMS:
+        if prefix.startswith(bom):
+            return encoding
+
+    sample = prefix[:4096]
+    if len(sample) >= 4:
+        even_zeros = sample[0::2].count(0)
+        odd_zeros = sample[1::2].count(0)
+        if odd_zeros > len(sample) * 0.4 and even_zeros == 0:
+            return 'utf-16-le'
+        if even_zeros > len(sample) * 0.4 and odd_zeros == 0:
+            return 'utf-16-be'
+
+    controls = sum(sample.count(byte) for byte in _CONTROL_BYTES)
+    if not sample or controls / len(sample) > BINARY_CONTROL_RATIO:
+        return None
+
+    try:
+        # A multi-byte character may be cut at the end of the prefix unless the prefix is the whole file
+        codecs.getincrementaldecoder('utf-8')().decode(prefix, final=len(prefix) < SNIFF_PREFIX_BYTES)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'cp1252'
+
+
+def sniff_upload(buffer, file_name):
+    """
+    Work out how to extract an upload from its first SNIFF_PREFIX_BYTES bytes.
+    Returns {'file_type', 'encoding', 'declared_type'}; file_type is the extension whose
+    extractor should be used, which may differ from the one in the file name.
+    Raises UnsupportedContentError for binary content that has no extractor.
+    """
+    declared_type = file_name_ext(file_name)
+    prefix = bytes(buffer[:SNIFF_PREFIX_BYTES])
+
+    # PDF readers accept the header anywhere in the first kilobyte, after binary junk but not after text
+    pdf_header = prefix.find(b'%PDF-', 0, 1024)
+    if pdf_header == 0 or (pdf_header > 0 and detect_text_encoding(prefix[:pdf_header]) is None):
+        file_type = 'pdf'
+        encoding = None
+    elif prefix.startswith(b'PK\x03\x04') or prefix.startswith(b'PK\x05\x06'):
+        file_type = _zip_file_type(buffer) or declared_type
+        encoding = None
+    else:
+        for magic, description in _UNSUPPORTED_MAGIC:
+            if prefix.startswith(magic):
+                raise UnsupportedContentError(f"{file_name} is a {description}, which cannot be extracted")
+        encoding = detect_text_encoding(prefix)
+        if encoding is None and prefix:
+            raise UnsupportedContentError(f"{file_name} is binary data in an unknown format")
+        file_type = declared_type if declared_type in TEXT_EXTENSIONS else 'txt'
+
+    if file_type != declared_type:
+        print(f"Content of {file_name} sniffed as {file_type} (declared {declared_type}), encoding {encoding}")
+    return {'file_type': file_type, 'encoding': encoding, 'declared_type': declared_type}
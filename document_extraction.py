@@ -0,0 +1,551 @@
+# Document extraction helpers for server.py
+import io
+import os
+import re
+import threading
+import time
+import zipfile
+import multiprocessing
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+# Worker memory limits need the resource module, which Windows does not have
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import PyPDF2
+
+from content_cleanup import BoilerplateStripper, iter_stripped_pages
+from content_sniffing import SNIFF_PREFIX_BYTES, detect_text_encoding
+from ingestion import open_buffer
+from tabular_profile import TABULAR_EXTENSIONS, profile_table
+from token_estimation import estimate_tokens
+
+# Number of worker processes used for page-parallel PDF extraction.
+# Can be overridden with the EXTRACTION_WORKERS environment variable or --extraction-workers
+EXTRACTION_WORKERS = int(os.environ.get('EXTRACTION_WORKERS', min(4, os.cpu_count() or 1)))
+
+# Number of pages handed to a worker in one task
+PDF_PAGES_PER_TASK = int(os.environ.get('PDF_PAGES_PER_TASK', 25))
+
+# Below this page count the worker overhead outweighs the gain, so the PDF is extracted in one task
+PARALLEL_PDF_MIN_PAGES = 40
+
+# Formats whose parsers run in the isolated workers; plain text is decoded in the server process
+ISOLATED_EXTENSIONS = ['pdf', 'docx', 'doc']
+
+# Wall-clock seconds an extraction job may run, from the moment it starts, before its worker is killed
+EXTRACTION_TIMEOUT = float(os.environ.get('EXTRACTION_TIMEOUT', 120))
+
+# Address space limit of each worker process in MB (0 disables the limit)
+EXTRACTION_MEMORY_LIMIT_MB = int(os.environ.get('EXTRACTION_MEMORY_LIMIT_MB', 2048))
+
+# Worker processes running at once, shared by all requests. A job waits for a slot before its
+# process starts, so time spent queued behind other requests does not count against its deadline
+_worker_slots = threading.BoundedSemaphore(EXTRACTION_WORKERS)
+
+# How often a running job checks whether a sibling job of the same call already failed
+_CANCEL_POLL_SECONDS = 0.5
+
+
+class ExtractionError(Exception):
+    """
+    Raised when an isolated extraction is stopped by its deadline or memory limit, or its worker dies.
+    code identifies the failure for the client; status_code is the HTTP status to return.
+    """
+    def __init__(self, message, code, status_code=422):
+        super().__init__(message)
+        self.code = code
+        self.status_code = status_code
+
+
+def _address_space_bytes():
+    """Current address space of this process, or 0 where /proc is not available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+def _limit_worker_memory(limit_bytes):
+    """
+    Cap the address space of the worker so runaway parsing raises MemoryError. A forked worker
+    starts with the server's mappings, so the limit is counted on top of those.
+    """
+    if resource is not None and limit_bytes > 0:
+        limit = _address_space_bytes() + limit_bytes
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def configure_extraction_pool(max_workers):
+    """Set the number of extraction workers that may run at once."""
+    global EXTRACTION_WORKERS, _worker_slots
+    EXTRACTION_WORKERS = max(1, int(max_workers))
+    _worker_slots = threading.BoundedSemaphore(EXTRACTION_WORKERS)
+
+
+class _WorkersUnavailable(Exception):
+    """Worker processes cannot be started in this runtime."""
+
+
+def _isolated_entry(connection, limit_bytes, function, args):
+    """Body of a worker process: run one job under the memory limit and send back its outcome."""
+    try:
+        _limit_worker_memory(limit_bytes)
+        outcome = ('ok', function(*args))
+    except MemoryError:
+        outcome = ('memory', None)
+    except Exception as e:
+        outcome = ('error', e)
+    try:
+        connection.send(outcome)
+    except Exception as e:
+        # Results or exceptions that cannot be pickled are reported by message
+        connection.send(('error', RuntimeError(f"{type(outcome[1]).__name__}: {outcome[1]}" if outcome[0] == 'error'
+                                               else f"Unpicklable extraction result: {str(e)}")))
+    finally:
+        connection.close()
+
+
+def _run_in_worker(function, args, timeout, cancelled):
+    """
+    Run one job in its own worker process once a worker slot is free. The deadline starts when
+    the process starts; a job that overruns it, or whose sibling failed, has only its own
+    process killed, so jobs of other requests are never affected.
+    """
+    with _worker_slots:
+        if cancelled.is_set():
+            return None
+        try:
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=_isolated_entry,
+                                              args=(sender, EXTRACTION_MEMORY_LIMIT_MB * 1024 * 1024, function, args))
+            process.start()
+        except (OSError, NotImplementedError) as e:
+            raise _WorkersUnavailable(str(e))
+        sender.close()
+        try:
+            deadline = time.time() + timeout
+            while not receiver.poll(max(0, min(_CANCEL_POLL_SECONDS, deadline - time.time()))):
+                if cancelled.is_set():
+                    return None
+                if time.time() >= deadline:
+                    raise ExtractionError(f"Extraction did not finish within {timeout:.0f} seconds", 'extraction_timeout')
+            try:
+                status, value = receiver.recv()
+            except EOFError:
+                # The process died without reporting, e.g. killed by the kernel or a crashing parser
+                raise ExtractionError("The extraction worker crashed while processing this file", 'extraction_crashed')
+        finally:
+            receiver.close()
+            if process.is_alive():
+                process.kill()
+            process.join()
+
+    if status == 'memory':
+        raise ExtractionError(f"Extraction exceeded the {EXTRACTION_MEMORY_LIMIT_MB} MB memory limit",
+                              'extraction_memory_limit', 413)
+    if status == 'error':
+        raise value
+    return value
+
+
+def run_isolated_many(calls, timeout=None):
+    """
+    Run (function, args) calls in isolated worker processes, at most EXTRACTION_WORKERS at a
+    time across the server, and return their results in order. Each call gets its own process
+    and its own wall-clock deadline from the moment it starts running; a call that runs past
+    it, hits its memory limit or crashes raises ExtractionError instead of blocking the server,
+    and the remaining calls of the same batch are stopped. Where processes cannot be started
+    (e.g. some serverless runtimes) the calls run inline.
+    """
+    timeout = EXTRACTION_TIMEOUT if timeout is None else timeout
+    cancelled = threading.Event()
+
+    def run(call):
+        function, args = call
+        try:
+            return _run_in_worker(function, args, timeout, cancelled)
+        except BaseException:
+            cancelled.set()
+            raise
+
+    try:
+        if len(calls) == 1:
+            return [run(calls[0])]
+        with ThreadPoolExecutor(max_workers=max(1, min(EXTRACTION_WORKERS, len(calls)))) as executor:
+            futures = [executor.submit(run, call) for call in calls]
+            return [future.result() for future in futures]
+    except _WorkersUnavailable as e:
+        print(f"Extraction workers unavailable ({str(e)}), extracting inline without isolation")
+        return [function(*args) for function, args in calls]
+
+
+def run_isolated(function, *args, timeout=None):
+    """Run function(*args) in an extraction worker under a deadline and memory limit."""
+    return run_isolated_many([(function, args)], timeout=timeout)[0]
+
+
+def picklable_bytes(file_bytes):
+    """Worker processes need a picklable copy of a memoryview or mmap."""
+    return file_bytes if isinstance(file_bytes, bytes) else bytes(file_bytes)
+
+
+def _count_pdf_pages(pdf_bytes):
+    return len(PyPDF2.PdfReader(io.BytesIO(pdf_bytes)).pages)
+
+
+def _extract_pdf_page_range(pdf_bytes, start, end):
+    """Extract the text of pages [start, end) in a worker process."""
+    started = time.time()
+    reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+    pages = [(reader.pages[page_num].extract_text() or "") for page_num in range(start, end)]
+    return start, pages, time.time() - started
+
+
+def _split_page_ranges(page_count, pages_per_task):
+    """Split page_count pages into consecutive (start, end) ranges."""
+    return [(start, min(start + pages_per_task, page_count))
+            for start in range(0, page_count, pages_per_task)]
+
+
+def extract_pdf_pages(pdf_bytes):
+    """
+    Extract the text of every page of a PDF, returning a list with one string per page.
+    Parsing runs in the isolated extraction workers; large documents are split into page ranges
+    that are extracted in parallel. Accepts bytes or a memoryview over an ingested upload.
+    """
+    started = time.time()
+    pdf_bytes = picklable_bytes(pdf_bytes)
+    page_count = run_isolated(_count_pdf_pages, pdf_bytes)
+
+    if page_count < PARALLEL_PDF_MIN_PAGES or EXTRACTION_WORKERS <= 1:
+        ranges = [(0, page_count)]
+    else:
+        # Keep each worker busy without making the tasks too small to amortize pickling
+        pages_per_task = max(1, min(PDF_PAGES_PER_TASK, -(-page_count // EXTRACTION_WORKERS)))
+        ranges = _split_page_ranges(page_count, pages_per_task)
+
+    pages = [None] * page_count
+    worker_seconds = 0.0
+    for start, range_pages, elapsed in run_isolated_many([(_extract_pdf_page_range, (pdf_bytes, start, end))
+                                                          for start, end in ranges]):
+        pages[start:start + len(range_pages)] = range_pages
+        worker_seconds += elapsed
+
+    wall_seconds = time.time() - started
+    speedup = worker_seconds / wall_seconds if wall_seconds > 0 else 1.0
+    print(f"Extracted {page_count} PDF pages in {len(ranges)} ranges on {EXTRACTION_WORKERS} workers: "
+          f"wall={wall_seconds:.2f}s, worker={worker_seconds:.2f}s, speedup={speedup:.2f}x")
+    return pages
+
+
+def extract_pdf_text(pdf_bytes):
+    """Extract the text of a PDF as a single string, one page per line block."""
+    return "".join(page_text + "\n" for page_text in extract_pdf_pages(pdf_bytes))
+
+
+# WordprocessingML namespace used by word/document.xml
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+
+def _docx_paragraph_text(paragraph):
+    """Collect the text runs, tabs and breaks of a w:p element."""
+    parts = []
+    for node in paragraph.iter():
+        if node.tag == _W + 't':
+            parts.append(node.text or "")
+        elif node.tag == _W + 'tab':
+            parts.append("\t")
+        elif node.tag in (_W + 'br', _W + 'cr'):
+            parts.append("\n")
+    return "".join(parts)
+
+
+def _docx_heading_level(paragraph):
+    """Return the heading level of a w:p element from its style, or 0 for body text."""
+    style = paragraph.find(f'{_W}pPr/{_W}pStyle')
+    if style is None:
+        return 0
+    style_name = style.get(_W + 'val', '')
+    if style_name == 'Title':
+        return 1
+    if style_name.startswith('Heading'):
+        level = style_name[len('Heading'):]
+        return int(level) if level.isdigit() else 1
+    return 0
+
+
+def iter_docx_blocks(docx_bytes):
+    """
+    Stream paragraphs, headings and table rows of a Word document in document order.
+    word/document.xml is read straight from the zip with iterparse and every finished
+    block is removed from the tree, so memory stays bounded regardless of document size.
+    """
+    with zipfile.ZipFile(open_buffer(docx_bytes)) as archive:
+        with archive.open('word/document.xml') as document_xml:
+            body = None
+            table_depth = 0
+            row_cells = []
+            cell_parts = []
+            for event, element in ET.iterparse(document_xml, events=('start', 'end')):
+                tag = element.tag
+                if event == 'start':
+                    if tag == _W + 'body':
+                        body = element
+                    elif tag == _W + 'tbl':
+                        table_depth += 1
+                    elif tag == _W + 'tr' and table_depth == 1:
+                        row_cells = []
+                    elif tag == _W + 'tc' and table_depth == 1:
+                        cell_parts = []
+                    continue
+
+                if tag == _W + 'p':
+                    text = _docx_paragraph_text(element)
+                    if table_depth:
+                        # Paragraphs inside a cell (including nested tables) become cell text
+                        if text:
+                            cell_parts.append(text)
+                    else:
+                        level = _docx_heading_level(element)
+                        if level:
+                            yield {'kind': 'heading', 'level': level, 'text': text}
+                        else:
+                            yield {'kind': 'paragraph', 'text': text}
+                    element.clear()
+                elif tag == _W + 'tc' and table_depth == 1:
+                    row_cells.append(" ".join(cell_parts))
+                elif tag == _W + 'tr' and table_depth == 1:
+                    yield {'kind': 'table_row', 'text': " | ".join(row_cells)}
+                    element.clear()
+                elif tag == _W + 'tbl':
+                    table_depth -= 1
+                    element.clear()
+
+                # Drop finished top-level blocks so the tree does not grow with the document
+                if body is not None and table_depth == 0 and tag in (_W + 'p', _W + 'tbl', _W + 'sectPr'):
+                    body.clear()
+
+
+def _format_docx_block(block):
+    """Render a DOCX block as a line of text, marking headings and table rows like Markdown."""
+    if block['kind'] == 'heading':
+        return "#" * min(block['level'], 6) + " " + block['text']
+    if block['kind'] == 'table_row':
+        return "| " + block['text'] + " |"
+    return block['text']
+
+
+def extract_docx_text(docx_bytes):
+    """Extract the paragraphs, headings and tables of a Word document."""
+    return "\n".join(_format_docx_block(block) for block in iter_docx_blocks(docx_bytes))
+
+
+def decode_text_file(file_bytes, encoding=None):
+    """
+    Decode a text-based upload. The encoding is detected from a bounded prefix unless given;
+    undecodable bytes show up as U+FFFD instead of being dropped silently.
+    """
+    if encoding is None:
+        encoding = detect_text_encoding(bytes(file_bytes[:SNIFF_PREFIX_BYTES])) or 'utf-8'
+    return io.TextIOWrapper(open_buffer(file_bytes), encoding=encoding, errors='replace').read()
+
+
+def extract_document(file_bytes, file_ext):
+    """
+    Extract the text of an uploaded document based on its extension.
+    Returns a dict with the text and metadata about the document.
+    """
+    page_count = None
+    page_lengths = None
+    boilerplate = None
+    table = None
+    if file_ext == 'pdf':
+        # Drop running headers, footers and page numbers repeated across pages
+        stripper = BoilerplateStripper()
+        pages = stripper.strip_pages(extract_pdf_pages(file_bytes))
+        text = "".join(page_text + "\n" for page_text in pages)
+        page_count = len(pages)
+        # Characters of text per page, so the text can be split back into pages
+        page_lengths = [len(page_text) + 1 for page_text in pages]
+        boilerplate = stripper.report()
+    elif file_ext in ['docx', 'doc']:
+        text = run_isolated(extract_docx_text, picklable_bytes(file_bytes))
+    elif file_ext in TABULAR_EXTENSIONS:
+        # Send a data profile and a row sample instead of the raw rows
+        table = run_isolated(profile_table, picklable_bytes(file_bytes), file_ext)
+        text = table.pop('text')
+    else:
+        text = decode_text_file(file_bytes)
+
+    return {
+        'text': text,
+        'file_type': file_ext,
+        'page_count': page_count,
+        'page_lengths': page_lengths,
+        'char_count': len(text),
+        'byte_count': len(file_bytes),
+        'boilerplate': boilerplate,
+        'table': table
+    }
+
+
+# Blank lines separate paragraphs in text-based files
+_PARAGRAPH_BREAK = re.compile(r'\n[ \t]*\n')
+
+
+def iter_pdf_pages(pdf_bytes):
+    """Yield the text of each PDF page as it is parsed, so callers can stop early."""
+    reader = PyPDF2.PdfReader(open_buffer(pdf_bytes))
+    page_count = len(reader.pages)
+    for page_num in range(page_count):
+        page_text = reader.pages[page_num].extract_text() or ""
+        yield {'kind': 'page', 'index': page_num, 'total': page_count, 'text': page_text + "\n"}
+
+
+def iter_docx_paragraphs(docx_bytes):
+    """Yield the blocks of a Word document one at a time; the total is unknown until the end."""
+    for index, block in enumerate(iter_docx_blocks(docx_bytes)):
+        separator = "\n" if index else ""
+        yield {'kind': 'paragraph', 'index': index, 'total': None, 'text': separator + _format_docx_block(block)}
+
+
+def iter_text_units(text):
+    """Yield blank-line separated paragraphs of text; joining the units gives back the text."""
+    breaks = list(_PARAGRAPH_BREAK.finditer(text))
+    # Text ending in a blank line has no unit after its last break
+    total = len(breaks) + (1 if text[breaks[-1].end() if breaks else 0:] else 0)
+    start = 0
+    index = 0
+    for match in breaks:
+        yield {'kind': 'paragraph', 'index': index, 'total': total, 'text': text[start:match.end()]}
+        start = match.end()
+        index += 1
+    if start < len(text):
+        yield {'kind': 'paragraph', 'index': index, 'total': total, 'text': text[start:]}
+
+
+def iter_document_units(file_bytes, file_ext, stripper=None):
+    """
+    Yield the pages or paragraphs of an uploaded document in order.
+    PDF pages are passed through stripper, if given, to drop repeated headers and footers.
+    """
+    if file_ext == 'pdf':
+        if stripper is not None:
+            return iter_stripped_pages(iter_pdf_pages(file_bytes), stripper)
+        return iter_pdf_pages(file_bytes)
+    if file_ext in ['docx', 'doc']:
+        return iter_docx_paragraphs(file_bytes)
+    if file_ext in TABULAR_EXTENSIONS:
+        return iter_text_units(profile_table(file_bytes, file_ext)['text'])
+    return iter_text_units(decode_text_file(file_bytes))
+
+
+def collect_document_within_budget(file_bytes, file_ext, token_budget):
+    """
+    Parse a document lazily until token_budget is reached, stripping PDF boilerplate on the way.
+    Meant to run in an extraction worker through run_isolated.
+    """
+    stripper = BoilerplateStripper()
+    page_lengths = []
+
+    def record_pages(units):
+        for unit in units:
+            if unit['kind'] == 'page':
+                page_lengths.append(len(unit['text']))
+            yield unit
+
+    result = collect_units_within_budget(record_pages(iter_document_units(file_bytes, file_ext, stripper)), token_budget)
+    result['boilerplate'] = stripper.report() if file_ext == 'pdf' else None
+    result['page_lengths'] = page_lengths if file_ext == 'pdf' and not result['truncated'] else None
+    return result
+
+
+def _cut_at_boundary(text, max_chars):
+    """Cut text to at most max_chars, preferring a line break and then a space."""
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    for separator in ("\n", " "):
+        position = cut.rfind(separator)
+        if position > max_chars // 2:
+            return cut[:position + 1]
+    return cut
+
+
+def collect_units_within_budget(units, token_budget):
+    """
+    Pull units from an extraction generator until token_budget is reached, keeping a running estimate.
+    Parsing stops at the first unit that does not fit; that unit is cut at a line or word boundary.
+    Returns the included text together with a report of what was omitted; manifest lists the
+    included ranges of units as {'start', 'end', 'tokens', 'partial'}, end exclusive.
+    """
+    parts = []
+    estimated = 0
+    included_units = 0
+    unit_kind = None
+    total_units = None
+    truncated = False
+    partial = ""
+
+    for unit in units:
+        unit_kind = unit['kind']
+        total_units = unit.get('total')
+        unit_tokens = estimate_tokens(unit['text'])
+        if estimated + unit_tokens > token_budget:
+            # Convert the remaining tokens to characters at this unit's own density
+            chars_per_token = len(unit['text']) / max(unit_tokens, 1)
+            partial = _cut_at_boundary(unit['text'], int(max(0, token_budget - estimated) * chars_per_token))
+            if partial:
+                parts.append(partial)
+                estimated += estimate_tokens(partial)
+            truncated = True
+            break
+        parts.append(unit['text'])
+        estimated += unit_tokens
+        included_units += 1
+
+    # Stop the underlying parser
+    if hasattr(units, 'close'):
+        units.close()
+
+    # Estimates are rounded down unit by unit, so the joined text can come out a few tokens
+    # over; the end of the last included unit is cut until the joined text fits
+    text = "".join(parts)
+    estimated = estimate_tokens(text)
+    while estimated > token_budget and parts:
+        last = parts.pop()
+        if not partial:
+            included_units -= 1
+        chars_per_token = len(text) / max(estimated, 1)
+        partial = _cut_at_boundary(last, max(0, len(last) - int((estimated - token_budget) * chars_per_token) - 1))
+        if partial:
+            parts.append(partial)
+        truncated = True
+        text = "".join(parts)
+        estimated = estimate_tokens(text)
+
+    omitted_units = None
+    if total_units is not None:
+        omitted_units = total_units - included_units
+
+    manifest = []
+    if included_units or partial:
+        manifest.append({'start': 0, 'end': included_units + (1 if partial else 0),
+                         'tokens': estimated, 'partial': bool(partial)})
+
+    return {
+        'text': text,
+        'estimated_tokens': estimated,
+        'token_budget': token_budget,
+        'truncated': truncated,
+        'unit_kind': unit_kind,
+        'included_units': included_units,
+        'total_units': total_units,
+        'omitted_units': omitted_units,
+        'manifest': manifest
+    }
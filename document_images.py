@@ -0,0 +1,243 @@
+# Embedded image extraction and downscaling for multimodal requests
+import base64
+import hashlib
+import io
+import math
+import os
+import zipfile
+
+import PyPDF2
+
+from document_extraction import picklable_bytes, run_isolated, run_isolated_many
+from extraction_cache import ExtractionCache, content_digest
+from ingestion import open_buffer
+
+# Pillow is needed to downscale and re-encode; without it only small images are passed through
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+# Total bytes of image data attached to one request, and the number of images
+IMAGE_REQUEST_MAX_BYTES = int(os.environ.get('IMAGE_REQUEST_MAX_BYTES', 3 * 1024 * 1024))
+IMAGE_MAX_COUNT = int(os.environ.get('IMAGE_MAX_COUNT', 20))
+
+# Images are scaled to fit both limits; larger images are downscaled by the API anyway
+IMAGE_MAX_EDGE = 1568
+IMAGE_MAX_PIXELS = 1150000
+
+# Re-encoded images should be at most this size
+IMAGE_TARGET_BYTES = 300 * 1024
+IMAGE_JPEG_QUALITIES = (85, 70, 55, 40)
+
+# Smaller images are icons, bullets and spacers
+IMAGE_MIN_EDGE = 64
+
+# An image costs about width * height / 750 input tokens, capped by the resize above
+IMAGE_PIXELS_PER_TOKEN = 750
+IMAGE_MAX_TOKENS = 1600
+
+# Extensions whose embedded images can be extracted
+IMAGE_SOURCE_EXTENSIONS = ['pdf', 'docx']
+
+# Prepared images are kept by the SHA-256 of their document, in memory and on disk
+IMAGE_CACHE_DIR = os.environ.get('IMAGE_CACHE_DIR', '/tmp/file-visualizer-image-cache')
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get('IMAGE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+# Shared cache of prepared images; an entry's char_count is the size of its base64 image data
+image_cache = ExtractionCache(max_entries=32, max_chars=64 * 1024 * 1024,
+                              disk_dir=IMAGE_CACHE_DIR, disk_max_bytes=IMAGE_CACHE_MAX_BYTES)
+
+_MAGIC_NUMBERS = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+]
+
+
+def _sniff_media_type(data):
+    for magic, media_type in _MAGIC_NUMBERS:
+        if data.startswith(magic):
+            return media_type
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+def iter_pdf_images(pdf_bytes):
+    """Yield the embedded images of a PDF in page order."""
+    reader = PyPDF2.PdfReader(open_buffer(pdf_bytes))
+    for page_number, page in enumerate(reader.pages, 1):
+        try:
+            images = page.images
+        except Exception as e:
+            # Unsupported filters or color spaces; the page text is still extracted
+            print(f"Skipping images on page {page_number}: {str(e)}")
+            continue
+        for image in images:
+            yield {'data': image.data, 'source': f"page {page_number}"}
+
+
+def iter_docx_images(docx_bytes):
+    """Yield the images stored in word/media of a Word document."""
+    with zipfile.ZipFile(open_buffer(docx_bytes)) as archive:
+        for name in sorted(archive.namelist()):
+            if name.startswith('word/media/'):
+                yield {'data': archive.read(name), 'source': name[len('word/media/'):]}
+
+
+def _encode_image(image):
+    """Encode a PIL image as PNG (if it has transparency) or JPEG, stepping quality down to the target size."""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        output = io.BytesIO()
+        image.save(output, format='PNG', optimize=True)
+        if output.tell() <= IMAGE_TARGET_BYTES:
+            return 'image/png', output.getvalue()
+        image = image.convert('RGBA').convert('RGB')
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    for quality in IMAGE_JPEG_QUALITIES:
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=quality, optimize=True)
+        if output.tell() <= IMAGE_TARGET_BYTES:
+            break
+    return 'image/jpeg', output.getvalue()
+
+
+def prepare_image(data):
+    """
+    Downscale and re-encode one image to the pixel and byte targets. Runs in an extraction worker.
+    Returns a dict with media_type, data, width and height, or None if the image is unusable.
+    """
+    if not PIL_AVAILABLE:
+        media_type = _sniff_media_type(data)
+        if media_type is None or len(data) > IMAGE_TARGET_BYTES:
+            return None
+        return {'media_type': media_type, 'data': data, 'width': None, 'height': None}
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except Exception:
+        return None
+
+    width, height = image.size
+    if min(width, height) < IMAGE_MIN_EDGE:
+        return None
+
+    scale = min(1.0, IMAGE_MAX_EDGE / max(width, height), math.sqrt(IMAGE_MAX_PIXELS / (width * height)))
+    while True:
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        resized = image.resize(size, Image.LANCZOS) if size != image.size else image
+        media_type, encoded = _encode_image(resized)
+        # Shrink further if even the lowest quality is over the target
+        if len(encoded) <= IMAGE_TARGET_BYTES or min(size) <= IMAGE_MIN_EDGE:
+            return {'media_type': media_type, 'data': encoded, 'width': size[0], 'height': size[1]}
+        scale *= 0.75
+
+
+def estimate_image_tokens(image):
+    if not image.get('width'):
+        return IMAGE_MAX_TOKENS
+    return min(IMAGE_MAX_TOKENS, math.ceil(image['width'] * image['height'] / IMAGE_PIXELS_PER_TOKEN))
+
+
+def collect_image_candidates(file_bytes, file_ext, max_candidates):
+    """
+    Pull the embedded images out of a document, dropping exact duplicates (logos, repeated
+    figures) by hash. Runs in an extraction worker. Returns (candidates, images found).
+    """
+    raw_images = iter_pdf_images(file_bytes) if file_ext == 'pdf' else iter_docx_images(file_bytes)
+    seen = set()
+    candidates = []
+    found = 0
+    for raw in raw_images:
+        found += 1
+        digest = hashlib.sha256(raw['data']).hexdigest()
+        if digest in seen:
+            continue
+        seen.add(digest)
+        candidates.append(dict(raw, sha256=digest))
+        if len(candidates) >= max_candidates:
+            break
+    return candidates, found
+
+
+def image_cache_key(digest, file_ext, max_bytes=IMAGE_REQUEST_MAX_BYTES, max_count=IMAGE_MAX_COUNT):
+    """Cache key of the images prepared from a document: its SHA-256, its type and the attachment limits."""
+    # Without Pillow only small images pass, so those results are kept apart
+    encoder = 'pil' if PIL_AVAILABLE else 'raw'
+    return f"{digest}-{file_ext}-images-{max_count}-{max_bytes}-{encoder}"
+
+
+def cached_document_images(key):
+    """Return the (images, report) stored under an image cache key, or None."""
+    entry = image_cache.get(key)
+    if entry is None:
+        return None
+    images = [dict(image, data=base64.b64decode(image['data'])) for image in entry['images']]
+    return images, dict(entry['report'], cache_hit=True)
+
+
+def extract_document_images(file_bytes, file_ext, max_bytes=IMAGE_REQUEST_MAX_BYTES, max_count=IMAGE_MAX_COUNT,
+                            digest=None):
+    """
+    Extract the embedded images of a PDF or DOCX, deduplicate them and downscale them in the
+    isolated extraction workers. Images are attached in document order until max_count images
+    or max_bytes of image data. Results are cached by the SHA-256 of file_bytes (pass digest
+    if it is already known). Returns (images, report).
+    """
+    if file_ext not in IMAGE_SOURCE_EXTENSIONS:
+        return [], None
+
+    key = image_cache_key(digest or content_digest(file_bytes), file_ext, max_bytes, max_count)
+    cached = cached_document_images(key)
+    if cached is not None:
+        return cached
+
+    # Some candidates are rejected as icons, so prepare a few more than can be attached
+    candidates, found = run_isolated(collect_image_candidates, picklable_bytes(file_bytes), file_ext, max_count * 2)
+    prepared_images = run_isolated_many([(prepare_image, (candidate['data'],)) for candidate in candidates])
+
+    images = []
+    total_bytes = 0
+    for candidate, prepared in zip(candidates, prepared_images):
+        if prepared is None or len(images) >= max_count or total_bytes + len(prepared['data']) > max_bytes:
+            continue
+        prepared.update(source=candidate['source'], sha256=candidate['sha256'])
+        prepared['estimated_tokens'] = estimate_image_tokens(prepared)
+        images.append(prepared)
+        total_bytes += len(prepared['data'])
+
+    report = {
+        'found': found,
+        'duplicates': found - len(candidates),
+        'attached': len(images),
+        'skipped': len(candidates) - len(images),
+        'bytes': total_bytes,
+        'estimated_tokens': sum(image['estimated_tokens'] for image in images)
+    }
+    encoded = [dict(image, data=base64.b64encode(image['data']).decode('ascii')) for image in images]
+    image_cache.put(key, {'images': encoded, 'report': report,
+                          'char_count': sum(len(image['data']) for image in encoded)})
+    return images, dict(report, cache_hit=False)
+
+
+def claude_image_blocks(images):
+    """Image content blocks for an Anthropic messages payload."""
+    return [{
+        "type": "image",
+        "source": {
+            "type": "base64",
+            "media_type": image['media_type'],
+            "data": base64.b64encode(image['data']).decode('ascii')
+        }
+    } for image in images]
+
+
+def gemini_image_parts(images):
+    """Inline image parts for a Gemini generate_content request."""
+    return [{'mime_type': image['media_type'], 'data': image['data']} for image in images]
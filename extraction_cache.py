@@ -0,0 +1,264 @@
+# Content-addressed cache for extracted document text
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from archive_extraction import ARCHIVE_EXTENSIONS, extract_archive, fit_archive_to_budget
+from document_extraction import (ISOLATED_EXTENSIONS, TABULAR_EXTENSIONS, extract_document, iter_text_units,
+                                 collect_document_within_budget, run_isolated, picklable_bytes)
+from content_packer import DEFAULT_PACKING_STRATEGY, pack_units
+
+# Bump when the extractor output changes so stale disk entries are ignored
+EXTRACTION_CACHE_VERSION = 7
+
+# In-memory tier: number of documents kept and total characters of text held
+MEMORY_CACHE_MAX_ENTRIES = int(os.environ.get('EXTRACTION_CACHE_MAX_ENTRIES', 64))
+MEMORY_CACHE_MAX_CHARS = int(os.environ.get('EXTRACTION_CACHE_MAX_CHARS', 64 * 1024 * 1024))
+
+# On-disk tier: location and total size cap in bytes
+DISK_CACHE_DIR = os.environ.get('EXTRACTION_CACHE_DIR', '/tmp/file-visualizer-extraction-cache')
+DISK_CACHE_MAX_BYTES = int(os.environ.get('EXTRACTION_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+
+def content_digest(file_bytes):
+    """Return the SHA-256 hex digest of the raw upload bytes."""
+    return hashlib.sha256(file_bytes).hexdigest()
+
+
+class ExtractionCache:
+    """
+    Two-tier cache of extraction results keyed by the SHA-256 of the upload.
+    The memory tier is an LRU bounded by entry count and text size; the disk tier
+    stores one JSON file per document and evicts least recently used files past its size cap.
+    """
+    def __init__(self, max_entries=MEMORY_CACHE_MAX_ENTRIES, max_chars=MEMORY_CACHE_MAX_CHARS,
+                 disk_dir=DISK_CACHE_DIR, disk_max_bytes=DISK_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._memory = OrderedDict()
+        self._memory_chars = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached entry for key, or None."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        entry = self._read_disk(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, entry)
+        return entry
+
+    def put(self, key, entry):
+        """Store an entry in both tiers."""
+        with self._lock:
+            self._remember(key, entry)
+        self._write_disk(key, entry)
+
+    def stats(self):
+        """Return hit/miss counters and current tier sizes."""
+        with self._lock:
+            return {
+                'memory_entries': len(self._memory),
+                'memory_chars': self._memory_chars,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses
+            }
+
+    def _remember(self, key, entry):
+        # Caller holds the lock
+        if key in self._memory:
+            self._memory_chars -= self._memory.pop(key).get('char_count', 0)
+        self._memory[key] = entry
+        self._memory_chars += entry.get('char_count', 0)
+        while self._memory and (len(self._memory) > self.max_entries or self._memory_chars > self.max_chars):
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_chars -= evicted.get('char_count', 0)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _read_disk(self, key):
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            if entry.get('cache_version') != EXTRACTION_CACHE_VERSION:
+                return None
+            # Touch the file so eviction sees it as recently used
+            os.utime(path, None)
+            return entry
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key, entry):
+        if self.disk_max_bytes <= 0:
+            return
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            path = self._disk_path(key)
+            # Write to a unique temporary name and rename so readers never see partial files
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(dict(entry, cache_version=EXTRACTION_CACHE_VERSION), f)
+            os.replace(temp_path, path)
+            self._evict_disk()
+        except OSError as e:
+            print(f"Failed to write extraction cache entry {key}: {str(e)}")
+
+    def _evict_disk(self):
+        """Remove least recently used files until the disk tier is under its size cap."""
+        files = []
+        total_bytes = 0
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total_bytes += stat.st_size
+
+        if total_bytes <= self.disk_max_bytes:
+            return
+
+        files.sort()
+        for _, size, path in files:
+            if total_bytes <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+                total_bytes -= size
+            except OSError:
+                pass
+
+
+# Shared cache used by the upload handling code in server.py
+extraction_cache = ExtractionCache()
+
+
+def _cache_key(digest, file_ext):
+    # The same bytes are routed to a different extractor depending on the type
+    return f"{digest}-{file_ext}"
+
+
+def extract_document_cached(file_bytes, file_ext):
+    """
+    Extract a document through the extraction cache.
+    A repeat upload of the same bytes costs one hash and one lookup instead of a full parse.
+    """
+    started = time.time()
+    digest = content_digest(file_bytes)
+    key = _cache_key(digest, file_ext)
+
+    entry = extraction_cache.get(key)
+    if entry is not None:
+        print(f"Extraction cache hit for {digest[:12]} ({entry.get('char_count', 0)} chars) in {time.time() - started:.3f}s")
+        return dict(entry, cache_hit=True)
+
+    if file_ext in ARCHIVE_EXTENSIONS:
+        entry = extract_archive(file_bytes)
+    else:
+        entry = extract_document(file_bytes, file_ext)
+    entry['sha256'] = digest
+    extraction_cache.put(key, entry)
+    print(f"Extraction cache miss for {digest[:12]}, extracted {entry['char_count']} chars in {time.time() - started:.2f}s")
+    return dict(entry, cache_hit=False)
+
+
+def iter_entry_units(entry):
+    """Yield the pages of a complete PDF extraction, or the paragraphs of any other document."""
+    text = entry['text']
+    page_lengths = entry.get('page_lengths')
+    if not page_lengths:
+        yield from iter_text_units(text)
+        return
+    start = 0
+    for index, length in enumerate(page_lengths):
+        yield {'kind': 'page', 'index': index, 'total': len(page_lengths), 'text': text[start:start + length]}
+        start += length
+
+
+def fit_document_to_budget(entry, token_budget, strategy=DEFAULT_PACKING_STRATEGY):
+    """
+    Cut a complete extraction (a cache entry or a stored analysis) to token_budget.
+    Archives share the budget across their files; other documents are packed page by page
+    or paragraph by paragraph with the given packing strategy.
+    """
+    if entry.get('archive'):
+        result = fit_archive_to_budget(entry, token_budget)
+        result['boilerplate'] = None
+        result['archive'] = entry['archive']
+        result['strategy'] = None
+    else:
+        result = pack_units(iter_entry_units(entry), token_budget, strategy)
+        result['boilerplate'] = entry.get('boilerplate')
+        result['table'] = entry.get('table')
+    result['cache_hit'] = entry.get('cache_hit', True)
+    return result
+
+
+def extract_document_within_budget(file_bytes, file_ext, token_budget, strategy=DEFAULT_PACKING_STRATEGY):
+    """
+    Extract only as much of a document as fits in token_budget.
+    Cached documents are cut from the stored text; otherwise pages or paragraphs are parsed
+    lazily and parsing stops once the budget is reached. Complete extractions are cached.
+    The 'spread' packing strategy needs the end of the document, so it extracts all of it.
+    """
+    started = time.time()
+    digest = content_digest(file_bytes)
+    key = _cache_key(digest, file_ext)
+
+    entry = extraction_cache.get(key)
+    if entry is None and (file_ext in TABULAR_EXTENSIONS or file_ext in ARCHIVE_EXTENSIONS or strategy == 'spread'):
+        # A data profile needs every row, and an archive budget is shared across all files,
+        # so build and cache these in full
+        entry = extract_document_cached(file_bytes, file_ext)
+    if entry is not None:
+        result = fit_document_to_budget(entry, token_budget, strategy)
+    else:
+        if file_ext in ISOLATED_EXTENSIONS:
+            # Parse in an isolated worker so a hostile document cannot stall or exhaust the server
+            result = run_isolated(collect_document_within_budget, picklable_bytes(file_bytes), file_ext, token_budget)
+        else:
+            result = collect_document_within_budget(file_bytes, file_ext, token_budget)
+        result['cache_hit'] = False
+        result['strategy'] = 'head'
+        page_lengths = result.pop('page_lengths')
+        if not result['truncated']:
+            # The whole document was parsed, so keep it for the next request
+            extraction_cache.put(key, {
+                'text': result['text'],
+                'file_type': file_ext,
+                'page_count': result['total_units'] if result['unit_kind'] == 'page' else None,
+                'page_lengths': page_lengths,
+                'char_count': len(result['text']),
+                'byte_count': len(file_bytes),
+                'boilerplate': result['boilerplate'],
+                'sha256': digest
+            })
+
+    result['sha256'] = digest
+    print(f"Extracted {result['included_units']} {result['unit_kind'] or 'unit'}s "
+          f"(~{result['estimated_tokens']} tokens, budget {token_budget}) from {digest[:12]} in {time.time() - started:.2f}s; "
+          f"omitted units: {result['omitted_units']}")
+    return result
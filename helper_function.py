@@ -8,6 +8,8 @@ import uuid
 import base64
 import traceback
 
+from token_estimation import estimate_tokens
+
 # Import Google Generative AI package
 try:
     import google.generativeai as genai
@@ -16,6 +18,77 @@ except ImportError:
     GEMINI_AVAILABLE = False
     print("Google Generative AI package not available. Some features may be limited.")
 
+# Whether request prefixes long enough to be cached are marked for Anthropic prompt caching
+PROMPT_CACHING = os.environ.get('PROMPT_CACHING', 'true').lower() == 'true'
+
+# Shortest prefix in tokens that the API caches, 2048 for the Haiku models and 1024 for the others.
+# A cache_control marker after a shorter prefix has no effect, so none is added
+PROMPT_CACHE_MIN_TOKENS = int(os.environ.get('PROMPT_CACHE_MIN_TOKENS', 1024))
+PROMPT_CACHE_MIN_TOKENS_HAIKU = int(os.environ.get('PROMPT_CACHE_MIN_TOKENS_HAIKU', 2048))
+
+def prompt_cache_min_tokens(model):
+    """Shortest prefix in tokens that model caches."""
+    return PROMPT_CACHE_MIN_TOKENS_HAIKU if 'haiku' in (model or '') else PROMPT_CACHE_MIN_TOKENS
+
+def cache_breakpoint(blocks, prefix_tokens, model):
+    """
+    Return text blocks (or a string, as one block) with an ephemeral cache_control marker on the
+    last block when the request prefix up to and including it, estimated at prefix_tokens, is
+    long enough for model to cache it. Shorter prefixes are returned unchanged.
+    """
+    if not PROMPT_CACHING or not blocks or prefix_tokens < prompt_cache_min_tokens(model):
+        return blocks
+    if isinstance(blocks, str):
+        return [{"type": "text", "text": blocks, "cache_control": {"type": "ephemeral"}}]
+    blocks = [dict(block) for block in blocks]
+    blocks[-1]["cache_control"] = {"type": "ephemeral"}
+    return blocks
+
+def cacheable_system(system, model):
+    """
+    Mark the system prompt for prompt caching when it is long enough for model to cache on its
+    own. The page-generation and summary prompts are shorter than that; requests that share a
+    longer prefix mark it with cache_breakpoint instead.
+    """
+    if not system:
+        return system
+    text = system if isinstance(system, str) else "".join(block.get("text", "") for block in system)
+    return cache_breakpoint(system, estimate_tokens(text), model)
+
+def message_text(response):
+    """Join the text blocks of a messages.create response from the SDK or VercelCompatibleClient."""
+    parts = []
+    for block in getattr(response, 'content', None) or []:
+        if isinstance(block, dict):
+            if block.get('type', 'text') == 'text':
+                parts.append(block.get('text', ''))
+        elif getattr(block, 'type', 'text') == 'text':
+            parts.append(getattr(block, 'text', ''))
+    return "".join(parts)
+
+def api_content_blocks(content):
+    """
+    Convert a list of message content items to Messages API blocks for VercelCompatibleClient.
+    Text items become text blocks, keeping a prompt cache breakpoint; image blocks keep their
+    source, with raw bytes encoded as base64 so the payload serializes. Other items are dropped.
+    """
+    blocks = []
+    for item in content:
+        if not isinstance(item, dict):
+            continue
+        if item.get("type") == "image" and isinstance(item.get("source"), dict):
+            source = dict(item["source"])
+            if isinstance(source.get("data"), (bytes, bytearray)):
+                source["data"] = base64.b64encode(source["data"]).decode("ascii")
+                source.setdefault("type", "base64")
+            blocks.append({"type": "image", "source": source})
+        elif "text" in item:
+            block = {"type": "text", "text": item["text"]}
+            if "cache_control" in item:
+                block["cache_control"] = item["cache_control"]
+            blocks.append(block)
+    return blocks
+
 def create_anthropic_client(api_key):
     """Create an Anthropic client with the given API key."""
     print(f"Creating Anthropic client with API key: {api_key[:8]}...")
@@ -371,16 +444,7 @@ class VercelCompatibleClient:
                     
                     # Handle different content formats
                     if isinstance(msg["content"], list):
-                        formatted_content = []
-                        for content_item in msg["content"]:
-                            if isinstance(content_item, dict) and "text" in content_item:
-                                formatted_content.append({
-                                    "type": "text", 
-                                    "text": content_item["text"]
-                                })
-                            elif isinstance(content_item, dict) and "type" in content_item and "text" in content_item:
-                                formatted_content.append(content_item)
-                        formatted_message["content"] = formatted_content
+                        formatted_message["content"] = api_content_blocks(msg["content"])
                     else:
                         formatted_message["content"] = msg["content"]
                     
@@ -542,16 +606,7 @@ class VercelCompatibleClient:
                 
                 # Handle different content formats
                 if isinstance(msg["content"], list):
-                    formatted_content = []
-                    for content_item in msg["content"]:
-                        if isinstance(content_item, dict) and "text" in content_item:
-                            formatted_content.append({
-                                "type": "text", 
-                                "text": content_item["text"]
-                            })
-                        elif isinstance(content_item, dict) and "type" in content_item and "text" in content_item:
-                            formatted_content.append(content_item)
-                    formatted_message["content"] = formatted_content
+                    formatted_message["content"] = api_content_blocks(msg["content"])
                 else:
                     formatted_message["content"] = msg["content"]
                 
@@ -760,7 +815,9 @@ class VercelStreamingResponse:
                 usage_info = self._UsageInfo(
                     getattr(usage_obj, 'input_tokens', 0),
                     getattr(usage_obj, 'output_tokens', 0),
-                    getattr(usage_obj, 'thinking_tokens', 0)
+                    getattr(usage_obj, 'thinking_tokens', 0),
+                    getattr(usage_obj, 'cache_read_input_tokens', 0),
+                    getattr(usage_obj, 'cache_creation_input_tokens', 0)
                 )
             
             # Create a completion message
@@ -853,10 +910,13 @@ class VercelStreamingResponse:
             self.error = error_message
     
     class _UsageInfo:
-        def __init__(self, input_tokens, output_tokens, thinking_tokens):
+        def __init__(self, input_tokens, output_tokens, thinking_tokens,
+                     cache_read_input_tokens=0, cache_creation_input_tokens=0):
             self.input_tokens = input_tokens
             self.output_tokens = output_tokens
             self.thinking_tokens = thinking_tokens
+            self.cache_read_input_tokens = cache_read_input_tokens
+            self.cache_creation_input_tokens = cache_creation_input_tokens
 
 # Response object for non-streaming API calls
 class VercelMessageResponse:
@@ -868,7 +928,9 @@ class VercelMessageResponse:
         self.usage = self._UsageInfo(
             result.get('usage', {}).get('input_tokens', 0),
             result.get('usage', {}).get('output_tokens', 0),
-            result.get('usage', {}).get('thinking_tokens', 0)
+            result.get('usage', {}).get('thinking_tokens', 0),
+            result.get('usage', {}).get('cache_read_input_tokens', 0),
+            result.get('usage', {}).get('cache_creation_input_tokens', 0)
         )
     
     def _format_content(self, content):
@@ -888,7 +950,10 @@ class VercelMessageResponse:
             return [{'type': 'text', 'text': str(content) if content else ''}]
     
     class _UsageInfo:
-        def __init__(self, input_tokens, output_tokens, thinking_tokens):
+        def __init__(self, input_tokens, output_tokens, thinking_tokens,
+                     cache_read_input_tokens=0, cache_creation_input_tokens=0):
             self.input_tokens = input_tokens
             self.output_tokens = output_tokens
-            self.thinking_tokens = thinking_tokens 
\ No newline at end of file
+            self.thinking_tokens = thinking_tokens
+            self.cache_read_input_tokens = cache_read_input_tokens
+            self.cache_creation_input_tokens = cache_creation_input_tokens 
\ No newline at end of file
@@ -0,0 +1,143 @@
+# In-memory ingestion of uploaded files for the extractors
+import base64
+import binascii
+import io
+import mmap
+import os
+
+# Decoded uploads larger than this are placed in an anonymous memory map instead of a bytes object
+INGEST_MMAP_THRESHOLD = int(os.environ.get('INGEST_MMAP_THRESHOLD', 32 * 1024 * 1024))
+
+# Base64 characters decoded per step when filling a memory map (must be a multiple of 4)
+BASE64_DECODE_STEP = 4 * 1024 * 1024
+
+
+class BufferReader(io.RawIOBase):
+    """Read-only, seekable file object over a buffer that does not copy the underlying data."""
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast('B')
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, target):
+        remaining = len(self._view) - self._position
+        count = min(len(target), max(0, remaining))
+        target[:count] = self._view[self._position:self._position + count]
+        self._position += count
+        return count
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        elif whence == io.SEEK_END:
+            self._position = len(self._view) + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if self._position < 0:
+            raise ValueError("Negative seek position")
+        return self._position
+
+    def tell(self):
+        return self._position
+
+
+def open_buffer(buffer):
+    """Return a seekable binary stream over bytes, a bytearray or a memoryview."""
+    if isinstance(buffer, bytes):
+        return io.BytesIO(buffer)
+    return io.BufferedReader(BufferReader(buffer))
+
+
+class IngestedUpload:
+    """
+    Decoded upload held in memory. Small uploads are a bytes object; large ones live in an
+    anonymous mmap so they are paged by the kernel without ever being written to the filesystem.
+    """
+    def __init__(self, data, mapping=None):
+        self._data = data
+        self._mapping = mapping
+
+    @property
+    def buffer(self):
+        """The decoded bytes, or a memoryview over the memory map for large uploads."""
+        return self._data
+
+    @property
+    def size(self):
+        return len(self._data)
+
+    @property
+    def is_mapped(self):
+        return self._mapping is not None
+
+    def stream(self):
+        """Return a new seekable binary stream over the upload."""
+        return open_buffer(self._data)
+
+    def close(self):
+        if self._mapping is not None:
+            self._data.release()
+            try:
+                self._mapping.close()
+            except BufferError:
+                # A stream over the map is still alive; the map is freed when it is collected
+                pass
+            self._mapping = None
+        self._data = b''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+
+def _normalize_base64(file_content):
+    """Strip a data URL prefix and fix missing padding."""
+    if ';base64,' in file_content[:256]:
+        file_content = file_content.split(';base64,', 1)[1]
+    if len(file_content) % 4 != 0:
+        file_content += '=' * (4 - len(file_content) % 4)
+    return file_content
+
+
+def ingest_bytes(file_bytes):
+    """Wrap raw upload bytes that are already in memory."""
+    return IngestedUpload(file_bytes)
+
+
+def ingest_base64(file_content):
+    """
+    Decode a base64 upload without touching the filesystem.
+    Uploads above INGEST_MMAP_THRESHOLD are decoded step by step into an anonymous mmap.
+    """
+    file_content = _normalize_base64(file_content)
+    padding = len(file_content) - len(file_content.rstrip('='))
+    decoded_size = len(file_content) // 4 * 3 - padding
+
+    if decoded_size <= INGEST_MMAP_THRESHOLD:
+        return IngestedUpload(base64.b64decode(file_content))
+
+    mapping = mmap.mmap(-1, decoded_size)
+    try:
+        offset = 0
+        for start in range(0, len(file_content), BASE64_DECODE_STEP):
+            decoded = base64.b64decode(file_content[start:start + BASE64_DECODE_STEP])
+            mapping[offset:offset + len(decoded)] = decoded
+            offset += len(decoded)
+    except (binascii.Error, ValueError, IndexError):
+        mapping.close()
+        # Fall back to the lenient one-shot decoder (e.g. for embedded whitespace)
+        return IngestedUpload(base64.b64decode(file_content))
+
+    view = memoryview(mapping)[:offset]
+    print(f"Ingested {offset} byte upload into an anonymous memory map")
+    return IngestedUpload(view, mapping=mapping)
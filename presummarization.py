@@ -0,0 +1,201 @@
+# Hierarchical pre-summarization of documents that exceed the generation budget
+import hashlib
+import os
+import time
+import zlib
+
+from document_extraction import _cut_at_boundary, iter_text_units
+from extraction_cache import ExtractionCache
+from helper_function import cacheable_system, message_text
+from prompt_registry import prompt_registry, render_prompt
+from sectioned_generation import run_sections
+from token_estimation import estimate_tokens
+from usage_metrics import USAGE_FIELDS, usage_counts
+
+# Whether requests that do not send "presummarize" condense over-budget content instead of cutting it
+PRESUMMARIZE_BY_DEFAULT = os.environ.get('PRESUMMARIZE_BY_DEFAULT', 'false').lower() == 'true'
+
+# Small, fast model that writes the chunk summaries
+SUMMARY_MODEL = os.environ.get('SUMMARY_MODEL', 'claude-3-5-haiku-20241022')
+
+# Tokens of a document extracted for the pre-pass; content beyond this is cut before summarizing
+PRESUMMARIZE_MAX_INPUT_TOKENS = int(os.environ.get('PRESUMMARIZE_MAX_INPUT_TOKENS', 500000))
+
+# Chunk sizes in tokens. Chunks end where the content says so (a heading, or a paragraph whose
+# checksum is divisible by SUMMARY_BOUNDARY_DIVISOR) once they have SUMMARY_MIN_CHUNK_TOKENS, so
+# an edit moves the boundaries of the chunks around it only and the other summaries are reused
+SUMMARY_CHUNK_TOKENS = int(os.environ.get('SUMMARY_CHUNK_TOKENS', 8000))
+SUMMARY_MIN_CHUNK_TOKENS = 2000
+SUMMARY_BOUNDARY_DIVISOR = 8
+
+# Share of its tokens a chunk summary is asked for. Summaries do not depend on the budget, so a
+# chunk's summary is reused whatever the size of the document; bump the summary prompt version
+# when changing this, as cached summaries were written for the old share
+SUMMARY_RATIO = 0.25
+
+# Summaries of summaries taken at most before the result is cut to the budget
+SUMMARY_MAX_LEVELS = 3
+
+# Summary requests in flight at once for one document
+SUMMARY_CONCURRENCY = int(os.environ.get('SUMMARY_CONCURRENCY', 8))
+
+# Chunk summaries are kept by content hash, in memory and on disk
+SUMMARY_CACHE_DIR = os.environ.get('SUMMARY_CACHE_DIR', '/tmp/file-visualizer-summary-cache')
+SUMMARY_CACHE_MAX_BYTES = int(os.environ.get('SUMMARY_CACHE_MAX_BYTES', 128 * 1024 * 1024))
+
+# Shared cache of chunk summaries
+summary_cache = ExtractionCache(max_entries=4096, max_chars=32 * 1024 * 1024,
+                                disk_dir=SUMMARY_CACHE_DIR, disk_max_bytes=SUMMARY_CACHE_MAX_BYTES)
+
+
+def _split_long_unit(text, max_tokens):
+    """Cut a paragraph longer than a chunk at line breaks or spaces."""
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return [text]
+    max_chars = max(1, int(len(text) * max_tokens / tokens * 0.9))
+    pieces = []
+    while text:
+        pieces.append(_cut_at_boundary(text, max_chars))
+        text = text[len(pieces[-1]):]
+    return pieces
+
+
+def _is_boundary(text):
+    if text.lstrip().startswith('#'):
+        return True
+    return zlib.crc32(text.encode('utf-8', 'surrogatepass')) % SUMMARY_BOUNDARY_DIVISOR == 0
+
+
+def chunk_text(text, max_tokens=SUMMARY_CHUNK_TOKENS, min_tokens=SUMMARY_MIN_CHUNK_TOKENS):
+    """Split text into chunks of whole paragraphs at content-defined boundaries; joining them gives back the text."""
+    chunks = []
+    current = []
+    current_tokens = 0
+    for unit in iter_text_units(text):
+        for piece in _split_long_unit(unit['text'], max_tokens):
+            tokens = estimate_tokens(piece)
+            if current and (current_tokens + tokens > max_tokens or (current_tokens >= min_tokens and _is_boundary(piece))):
+                chunks.append("".join(current))
+                current = []
+                current_tokens = 0
+            current.append(piece)
+            current_tokens += tokens
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+def summary_key(model, text):
+    """Cache key of a chunk summary: the chunk's SHA-256, the model and the prompt versions."""
+    versions = f"{prompt_registry.get('summary_system').version}.{prompt_registry.get('summary_user').version}"
+    digest = hashlib.sha256(text.encode('utf-8', 'surrogatepass')).hexdigest()
+    return hashlib.sha256(f"{model}\0{versions}\0{digest}".encode('utf-8')).hexdigest()
+
+
+def _choose_chunks(chunks, excess):
+    """
+    Pick the chunks to replace by their summaries so the text shrinks by excess tokens: chunks
+    whose summary is cached first, then the ones that save the most. The rest stay verbatim.
+    """
+    def saving(chunk):
+        if chunk['summary'] is not None:
+            return chunk['tokens'] - estimate_tokens(chunk['summary'])
+        return int(chunk['tokens'] * (1 - SUMMARY_RATIO))
+
+    chosen = []
+    order = sorted(chunks, key=lambda chunk: (chunk['summary'] is None, -saving(chunk)))
+    for chunk in order:
+        if excess <= 0:
+            break
+        chosen.append(chunk)
+        excess -= saving(chunk)
+    return chosen
+
+
+def presummarize_text(client, text, token_budget, model=SUMMARY_MODEL, concurrency=SUMMARY_CONCURRENCY):
+    """
+    Condense text until it fits token_budget. The text is cut into chunks and each chunk is
+    summarized to SUMMARY_RATIO of its tokens by the summary model, in parallel; only as many
+    chunks as the budget requires are replaced by their summaries, the others stay verbatim.
+    The result is condensed the same way again for at most SUMMARY_MAX_LEVELS levels. Chunk
+    summaries are cached by content, so cached ones are used first and never requested again.
+    This is a generator: it yields a progress dict after every chunk summary (None while
+    waiting) and returns (condensed_text, report). Raises the error of the first failed request.
+    """
+    system_prompt = render_prompt('summary_system')
+    started = time.time()
+    original_tokens = tokens = estimate_tokens(text)
+    usage_data = dict.fromkeys(USAGE_FIELDS, 0)
+    levels = []
+
+    def summarize(chunk):
+        target_tokens = max(100, int(chunk['tokens'] * SUMMARY_RATIO))
+        response = client.messages.create(
+            model=model,
+            max_tokens=int(target_tokens * 1.5) + 256,
+            temperature=0,
+            system=cacheable_system(system_prompt, model),
+            messages=[{"role": "user", "content": render_prompt(
+                'summary_user', target_tokens=str(target_tokens), target_words=str(int(target_tokens * 0.75)),
+                content=chunk['text'])}]
+        )
+        return message_text(response).strip() + "\n\n", usage_counts(getattr(response, 'usage', None))
+
+    for level in range(1, SUMMARY_MAX_LEVELS + 1):
+        if tokens <= token_budget:
+            break
+        chunks = []
+        for index, piece in enumerate(chunk_text(text)):
+            key = summary_key(model, piece)
+            entry = summary_cache.get(key)
+            chunks.append({'index': index, 'text': piece, 'tokens': estimate_tokens(piece), 'key': key,
+                           'summary': entry['summary'] if entry is not None else None})
+
+        # The share of the text that has to go decides how many chunks are summarized
+        chosen = _choose_chunks(chunks, tokens - token_budget)
+        requested = [chunk for chunk in chosen if chunk['summary'] is None]
+        completed = 0
+        for result in run_sections(requested, summarize, concurrency=concurrency):
+            if result is None:
+                yield None
+                continue
+            chunk, summary, error = result
+            if error is not None:
+                raise error
+            summary_text, counts = summary
+            chunk['summary'] = summary_text
+            summary_cache.put(chunk['key'], {'summary': summary_text, 'char_count': len(summary_text)})
+            if counts is not None:
+                for name in USAGE_FIELDS:
+                    usage_data[name] += counts[name]
+            completed += 1
+            yield {'level': level, 'chunk': chunk['index'], 'completed': completed, 'total': len(requested),
+                   'chunks': len(chunks), 'cached_chunks': len(chosen) - len(requested)}
+
+        replaced = {chunk['index'] for chunk in chosen}
+        text = "".join(chunk['summary'] if chunk['index'] in replaced else chunk['text'] for chunk in chunks)
+        condensed_tokens = estimate_tokens(text)
+        levels.append({
+            'level': level,
+            'ratio': round(token_budget / tokens, 3),
+            'chunks': len(chunks),
+            'summarized_chunks': len(chosen),
+            'cached_chunks': len(chosen) - len(requested),
+            'input_tokens': tokens,
+            'output_tokens': condensed_tokens
+        })
+        previous_tokens, tokens = tokens, condensed_tokens
+        if tokens >= previous_tokens:
+            # The summaries did not get shorter; another level would not either
+            break
+
+    return text, {
+        'model': model,
+        'original_tokens': original_tokens,
+        'estimated_tokens': tokens,
+        'token_budget': token_budget,
+        'levels': levels,
+        'usage': usage_data,
+        'elapsed': round(time.time() - started, 2)
+    }
@@ -0,0 +1,184 @@
+# Named, versioned prompt templates shared by every generation endpoint
+import os
+import string
+
+from token_estimation import estimate_tokens, token_estimator
+
+# Page-generation system prompt, split where version 2 adds its guideline to the performance section
+_WEBPAGE_SYSTEM_HEAD = "I will provide you with a file or a content, analyze its content, and transform it into a visually appealing and well-structured webpage.### Content Requirements* Maintain the core information from the original file while presenting it in a clearer and more visually engaging format.⠀Design Style* Follow a modern and minimalistic design inspired by Linear App.* Use a clear visual hierarchy to emphasize important content.* Adopt a professional and harmonious color scheme that is easy on the eyes for extended reading.⠀Technical Specifications* Use HTML5, TailwindCSS 3.0+ (via CDN), and necessary JavaScript.* Implement a fully functional dark/light mode toggle, defaulting to the system setting.* Ensure clean, well-structured code with appropriate comments for easy understanding and maintenance.⠀Responsive Design* The page must be fully responsive, adapting seamlessly to mobile, tablet, and desktop screens.* Optimize layout and typography for different screen sizes.* Ensure a smooth and intuitive touch experience on mobile devices.⠀Icons & Visual Elements* Use professional icon libraries like Font Awesome or Material Icons (via CDN).* Integrate illustrations or charts that best represent the content.* Avoid using emojis as primary icons.* Check if any icons cannot be loaded.⠀User Interaction & ExperienceEnhance the user experience with subtle micro-interactions:* Buttons should have slight enlargement and color transitions on hover.* Cards should feature soft shadows and border effects on hover.* Implement smooth scrolling effects throughout the page.* Content blocks should have an elegant fade-in animation on load.⠀Performance Optimization* Ensure fast page loading by avoiding large, unnecessary resources.* Use modern image formats (WebP) with proper compression.* Implement lazy loading for content-heavy pages."
+_WEBPAGE_SYSTEM_TAIL = "⠀Output Requirements* Deliver a fully functional standalone HTML file, including all necessary CSS and JavaScript.* Ensure the code meets W3C standards with no errors or warnings.* Maintain consistent design and functionality across different browsers.* Your output is only one HTML file, do not present any other notes on the HTML. Also, try your best to visualize the whole content.⠀Create the most effective and visually appealing webpage based on the uploaded file's content type (document, data, images, etc.)."
+
+# Added by version 2 of the page-generation system prompt
+INCREMENTAL_RENDERING_GUIDELINE = "* For large outputs, make sure the HTML can be incrementally rendered and uses efficient DOM structures."
+
+WEBPAGE_SYSTEM_V1 = _WEBPAGE_SYSTEM_HEAD + _WEBPAGE_SYSTEM_TAIL
+WEBPAGE_SYSTEM_V2 = _WEBPAGE_SYSTEM_HEAD + INCREMENTAL_RENDERING_GUIDELINE + _WEBPAGE_SYSTEM_TAIL
+
+# Appended to the system prompt for large inputs
+LARGE_CONTENT_GUIDELINES_V1 = "\n\nIMPORTANT: This is a large document. To ensure the generated HTML can be efficiently processed and rendered by browsers, please follow these additional guidelines:\n1. Implement progressive rendering techniques\n2. Minimize deep DOM nesting - keep DOM depth under 20 levels\n3. Use document fragments and lazy loading where appropriate\n4. Break large content into smaller sections using pagination or tabs\n5. Break large tables into smaller sections with pagination\n6. Use efficient CSS selectors (avoid descendant selectors when possible)\n7. Minimize JavaScript interactions and DOM manipulations\n8. Avoid complex CSS animations and transitions\n9. Use lightweight, optimized SVG instead of heavy images\n10. Implement lazy-loaded images with low-resolution placeholders\n11. Break long sections of text into separate elements with reasonable length"
+EXTREMELY_LARGE_CONTENT_V1 = "\nEXTREMELY LARGE CONTENT DETECTED: Break the content into multiple pages and implement a navigation system. Do not use complex or heavy JavaScript frameworks. Keep CSS minimal and efficient."
+
+# System prompt of sectioned generation. The page shell (Tailwind, icons, navigation, dark mode) is
+# built by the server, so every section only returns its own fragment
+SECTION_SYSTEM_V1 = "I will provide you with one section of a long file or content. Other sections are transformed separately and all of them are placed into a shared webpage that already loads TailwindCSS 3.0+ (via CDN, with darkMode 'class') and Font Awesome 6, and provides the page header, the navigation and a dark/light mode toggle.### Content Requirements* Maintain the core information of this section while presenting it in a clearer and more visually engaging format.* Only cover the content of this section; the outline is given so the section fits into the whole.⠀Design Style* Follow a modern and minimalistic design inspired by Linear App.* Use a clear visual hierarchy, starting the section with an <h2> that titles it.* Style everything with Tailwind utility classes and provide dark: variants for colors.* Use cards, tables, lists, Font Awesome icons or inline SVG charts where they represent the content best. Avoid using emojis as primary icons.⠀Technical Specifications* The fragment must be responsive, adapting to mobile, tablet, and desktop screens.* Scripts, if any, must be inline and only touch elements inside the section.⠀Output Requirements* Your output is only one <section> element with the requested id. Do not output <html>, <head>, <body>, navigation, page headers, code fences or any notes outside the element."
+
+# Templates by name and version. Fields are written {field}; literal braces must be doubled
+PROMPT_TEMPLATES = {
+    'webpage_system': {1: WEBPAGE_SYSTEM_V1, 2: WEBPAGE_SYSTEM_V2},
+    'large_content_guidelines': {1: LARGE_CONTENT_GUIDELINES_V1},
+    'extremely_large_content': {1: EXTREMELY_LARGE_CONTENT_V1},
+    # User message of the Claude endpoints
+    'webpage_user': {1: "{format_prompt}\n\nHere is the content to transform into a website:\n\n{content}\n"},
+    # Gemini takes the instructions and the content as a single prompt
+    'gemini_webpage': {1: "{system}\n\nHere is the content to transform into a website:\n\n{content}\n\n{format_prompt}\n"},
+    # Sectioned mode: each section of a long document becomes a fragment of the shared page shell
+    'section_system': {1: SECTION_SYSTEM_V1},
+    # Opens the user turn of every section of a run, so the prompt cache can share it. Version 2
+    # of section_user leaves the format prompt and the outline to it
+    'section_outline': {1: "{format_prompt}\n\nA long document of {count} sections is transformed section by section. Its outline:\n{outline}\n"},
+    'section_user': {1: "{format_prompt}\n\nThis is section {number} of {count} of a long document, outlined as:\n{outline}\n\nReturn only the <section id=\"{section_id}\"> element for section {number}. Here is its content:\n\n{content}\n",
+                     2: "This is section {number} of {count}. Return only the <section id=\"{section_id}\"> element for section {number}. Here is its content:\n\n{content}\n"},
+    # Pre-summarization: chunks of an over-budget document are condensed by a small model
+    'summary_system': {1: "You condense one chunk of a long document so that the whole document fits into a later request that transforms it into a webpage. Keep the facts, figures, names, dates, definitions and conclusions, keep the order of the content and its Markdown headings (lines starting with #). Drop repetition, boilerplate and filler. Write plain Markdown, without an introduction or notes about the summary itself."},
+    'summary_user': {1: "Condense this chunk of a long document to at most {target_tokens} tokens (about {target_words} words):\n\n{content}\n"},
+    # Minimal generation used by /api/test to check a key end to end
+    'api_test_system': {1: "Generate minimal HTML to confirm the API integration works."},
+    'api_test_user': {1: "Generate a very simple HTML page that confirms the API works. The content is: {content}"},
+}
+
+# Versions pinned instead of the latest, as "name=version,name=version"
+PROMPT_VERSIONS = os.environ.get('PROMPT_VERSIONS', '')
+
+
+class _FittedTokens:
+    """Estimated tokens of a fixed text, recomputed only after the token estimator is refitted."""
+    def __init__(self, text):
+        self.text = text
+        self._cached = (None, 0)
+
+    def get(self):
+        version, tokens = self._cached
+        if version != token_estimator.fit_version:
+            version = token_estimator.fit_version
+            tokens = estimate_tokens(self.text)
+            self._cached = (version, tokens)
+        return tokens
+
+
+class PromptTemplate:
+    """
+    A template compiled once: its literal parts and field names, with the tokens of the
+    literal text kept until the token estimator's fit changes. Rendering is a single join of
+    the parts and the fields.
+    """
+    def __init__(self, name, version, template):
+        self.name = name
+        self.version = version
+        self._parts = []
+        for literal, field, format_spec, conversion in string.Formatter().parse(template):
+            if format_spec or conversion:
+                raise ValueError(f"Prompt {name} v{version}: only plain {{field}} substitutions are supported")
+            self._parts.append((literal, field))
+        self.fields = [field for _, field in self._parts if field is not None]
+        literal_text = "".join(literal for literal, _ in self._parts)
+        self.static_chars = len(literal_text)
+        self._static_tokens = _FittedTokens(literal_text)
+        # Templates without fields render to the same string every time
+        self.text = literal_text if not self.fields else None
+
+    @property
+    def static_tokens(self):
+        return self._static_tokens.get()
+
+    def render(self, **fields):
+        if self.text is not None:
+            return self.text
+        pieces = []
+        for literal, field in self._parts:
+            pieces.append(literal)
+            if field is not None:
+                pieces.append(fields.get(field) or "")
+        return "".join(pieces)
+
+    def tokens(self, **fields):
+        """Estimated tokens of the rendered prompt: the precomputed literal tokens plus the fields'."""
+        return self.static_tokens + sum(estimate_tokens(fields.get(field) or "") for field in self.fields)
+
+
+def _parse_pins(value):
+    pins = {}
+    for item in value.split(','):
+        if '=' in item:
+            name, version = item.split('=', 1)
+            pins[name.strip()] = int(version)
+    return pins
+
+
+class PromptRegistry:
+    """
+    Every prompt the server sends, compiled at startup. A name resolves to its latest version
+    unless PROMPT_VERSIONS pins another. The page-generation system prompt is also assembled
+    once for each combination of the large-content add-ons, so each request only picks one.
+    Token counts follow the token estimator's current fit.
+    """
+    def __init__(self, templates=PROMPT_TEMPLATES, pins=PROMPT_VERSIONS):
+        self._templates = {}
+        pinned = _parse_pins(pins)
+        self._current = {}
+        for name, versions in templates.items():
+            for version, template in versions.items():
+                self._templates[(name, version)] = PromptTemplate(name, version, template)
+            version = pinned.get(name, max(versions))
+            if (name, version) not in self._templates:
+                raise ValueError(f"Prompt {name} has no version {version}")
+            self._current[name] = self._templates[(name, version)]
+        self._system_prompts = {}
+        for version in templates['webpage_system']:
+            for large in (False, True):
+                for extremely_large in (False, True):
+                    text = self.get('webpage_system', version).render()
+                    if large:
+                        text += self.render('large_content_guidelines')
+                    if extremely_large:
+                        text += self.render('extremely_large_content')
+                    self._system_prompts[(version, large, extremely_large)] = _FittedTokens(text)
+
+    def get(self, name, version=None):
+        if version is None:
+            return self._current[name]
+        return self._templates[(name, version)]
+
+    def render(self, name, **fields):
+        return self._current[name].render(**fields)
+
+    def tokens(self, name, **fields):
+        return self._current[name].tokens(**fields)
+
+    def system_prompt(self, large=False, extremely_large=False, version=None):
+        """
+        Return (text, estimated_tokens) of the page-generation system prompt, in the current
+        version of webpage_system unless an endpoint asks for the version it was built with.
+        """
+        if version is None:
+            version = self._current['webpage_system'].version
+        prompt = self._system_prompts[(version, large, extremely_large)]
+        return prompt.text, prompt.get()
+
+    def max_system_prompt_tokens(self):
+        """Estimated tokens of the longest system prompt of any version, with every large-content add-on."""
+        return max(prompt.get() for (_, large, extremely_large), prompt in self._system_prompts.items()
+                   if large and extremely_large)
+
+    def manifest(self):
+        """The version and literal token count of every prompt in use."""
+        return {name: {'version': template.version, 'static_tokens': template.static_tokens}
+                for name, template in self._current.items()}
+
+
+# Shared registry used by server.py
+prompt_registry = PromptRegistry()
+
+
+def render_prompt(name, **fields):
+    """Render the current version of the named prompt."""
+    return prompt_registry.render(name, **fields)
@@ -0,0 +1,219 @@
+# Map-reduce generation: sections of a long document are generated in parallel and stitched into one page
+import html
+import os
+import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from document_extraction import iter_text_units
+from token_estimation import estimate_tokens
+from token_histogram import document_spans
+
+# Input tokens of one section; each section is generated by its own request
+SECTION_TOKENS = int(os.environ.get('SECTION_TOKENS', 24000))
+
+# Sections a document is split into at most, which bounds the input of a sectioned request
+MAX_SECTIONS = int(os.environ.get('MAX_SECTIONS', 16))
+
+# Section requests in flight at once for one generation
+SECTION_CONCURRENCY = int(os.environ.get('SECTION_CONCURRENCY', 4))
+
+# Output tokens of a section fragment
+SECTION_MAX_TOKENS = int(os.environ.get('SECTION_MAX_TOKENS', 16000))
+
+# Seconds to wait for a section before the stream sends a keepalive
+SECTION_HEARTBEAT_SECONDS = 10
+
+# Title of a fragment, used as its navigation label
+_FRAGMENT_TITLE = re.compile(r'<h[12][^>]*>(.*?)</h[12]>', re.S | re.I)
+_TAG = re.compile(r'<[^>]+>')
+_CODE_FENCE = re.compile(r'^```[a-zA-Z]*\s*\n?|\n?```\s*$')
+
+# Layout shared by all sections: the navigation, the dark/light toggle and the page styles.
+# Fragments are styled with Tailwind classes, so the shell only loads Tailwind and the icons
+PAGE_SHELL = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="UTF-8">
+<meta name="viewport" content="width=device-width, initial-scale=1.0">
+<title>{title}</title>
+<script src="https://cdn.tailwindcss.com"></script>
+<script>tailwind.config = {{ darkMode: 'class' }};</script>
+<link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.5.1/css/all.min.css">
+<script>
+  // Follow the system setting until the reader picks a mode
+  const stored = localStorage.getItem('theme');
+  if (stored === 'dark' || (!stored && window.matchMedia('(prefers-color-scheme: dark)').matches)) {{
+    document.documentElement.classList.add('dark');
+  }}
+</script>
+<style>html {{ scroll-behavior: smooth; }} main > section {{ scroll-margin-top: 5rem; }}</style>
+</head>
+<body class="bg-gray-50 text-gray-800 dark:bg-gray-900 dark:text-gray-100">
+<header class="sticky top-0 z-20 flex items-center justify-between px-6 py-4 border-b border-gray-200 dark:border-gray-800 bg-white/80 dark:bg-gray-900/80 backdrop-blur">
+  <h1 class="text-lg font-semibold truncate">{title}</h1>
+  <button id="theme-toggle" class="p-2 rounded-lg transition hover:scale-110 hover:bg-gray-100 dark:hover:bg-gray-800" aria-label="Toggle dark mode">
+    <i class="fa-solid fa-circle-half-stroke"></i>
+  </button>
+</header>
+<div class="max-w-7xl mx-auto flex flex-col lg:flex-row gap-8 px-6 py-8">
+  <nav class="lg:w-64 lg:shrink-0 lg:sticky lg:top-24 lg:self-start lg:max-h-[calc(100vh-7rem)] overflow-y-auto">
+    <ol class="space-y-1 text-sm">
+{nav}
+    </ol>
+  </nav>
+  <main class="flex-1 min-w-0 space-y-12">
+{sections}
+  </main>
+</div>
+<script>
+  document.getElementById('theme-toggle').addEventListener('click', () => {{
+    const dark = document.documentElement.classList.toggle('dark');
+    localStorage.setItem('theme', dark ? 'dark' : 'light');
+  }});
+</script>
+</body>
+</html>
+"""
+
+NAV_ITEM = ('      <li><a href="#{section_id}" class="block px-3 py-2 rounded-lg text-gray-600 dark:text-gray-400 '
+            'transition hover:bg-gray-100 hover:text-gray-900 dark:hover:bg-gray-800 dark:hover:text-white">{label}</a></li>')
+
+# Stands in for a section whose request failed, so the rest of the page is still delivered
+FAILED_SECTION = ('<section id="{section_id}" class="p-6 rounded-xl border border-red-200 dark:border-red-900 '
+                  'text-red-700 dark:text-red-300"><h2 class="text-xl font-semibold">{label}</h2>'
+                  '<p>This section could not be generated: {error}</p></section>')
+
+
+def section_id(index):
+    return f"section-{index + 1}"
+
+
+def _pieces(text, spans, section_tokens):
+    """Outline spans with their tokens; spans larger than a section are split into their paragraphs."""
+    pieces = []
+    for label, start, end in spans:
+        tokens = estimate_tokens(text[start:end])
+        if tokens <= section_tokens:
+            pieces.append((label, start, end, tokens))
+            continue
+        offset = start
+        for unit in iter_text_units(text[start:end]):
+            length = len(unit['text'])
+            pieces.append((label, offset, offset + length, estimate_tokens(unit['text'])))
+            offset += length
+    return pieces
+
+
+def _group_pieces(pieces, target, section_tokens):
+    """Group consecutive pieces, closing a group once it reaches target or the next piece would not fit."""
+    groups = []
+    for piece in pieces:
+        group = groups[-1] if groups else None
+        if group and group['tokens'] < target and group['tokens'] + piece[3] <= section_tokens:
+            group['pieces'].append(piece)
+            group['tokens'] += piece[3]
+        else:
+            groups.append({'pieces': [piece], 'tokens': piece[3]})
+    return groups
+
+
+def split_sections(text, section_tokens=SECTION_TOKENS, max_sections=MAX_SECTIONS):
+    """
+    Split text along its outline (headings, or paragraphs when it has none) into sections of
+    about the same size, each within section_tokens, so the slowest section is not much
+    slower than the rest. Sections beyond max_sections are left out and counted in the report.
+    """
+    unit_kind, spans = document_spans({'text': text})
+    pieces = _pieces(text, spans, section_tokens)
+    total_tokens = sum(piece[3] for piece in pieces)
+    count = min(max_sections, max(1, -(-total_tokens // section_tokens)))
+    groups = _group_pieces(pieces, -(-total_tokens // count), section_tokens)
+    if len(groups) > max_sections:
+        # Balanced sections need more requests than allowed; filling each section up uses the fewest
+        groups = _group_pieces(pieces, section_tokens, section_tokens)
+
+    sections = []
+    for index, group in enumerate(groups[:max_sections]):
+        labels = list(dict.fromkeys(piece[0] for piece in group['pieces']))
+        label = labels[0] if len(labels) == 1 else f"{labels[0]} – {labels[-1]}"
+        start, end = group['pieces'][0][1], group['pieces'][-1][2]
+        sections.append({'index': index, 'id': section_id(index), 'label': label,
+                         'start': start, 'end': end, 'tokens': group['tokens'], 'text': text[start:end]})
+    omitted = groups[max_sections:]
+    return {
+        'unit_kind': unit_kind,
+        'sections': sections,
+        'estimated_tokens': sum(section['tokens'] for section in sections),
+        'omitted_sections': len(omitted),
+        'omitted_tokens': sum(group['tokens'] for group in omitted)
+    }
+
+
+def outline_text(sections):
+    """The outline given to every section request, so sections know where they sit in the page."""
+    return "\n".join(f"{section['index'] + 1}. {section['label']}" for section in sections)
+
+
+def run_sections(sections, generate, concurrency=SECTION_CONCURRENCY, heartbeat=SECTION_HEARTBEAT_SECONDS):
+    """
+    Call generate(section) for every section on at most concurrency threads. Yields
+    (section, result, error) in the order the sections finish, and None whenever heartbeat
+    seconds pass without one finishing. Sections not yet started are cancelled if the
+    consumer stops early.
+    """
+    if not sections:
+        return
+    pool = ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(sections))))
+    pending = {pool.submit(generate, section): section for section in sections}
+    try:
+        while pending:
+            done, _ = wait(pending, timeout=heartbeat, return_when=FIRST_COMPLETED)
+            if not done:
+                yield None
+                continue
+            for future in done:
+                section = pending.pop(future)
+                try:
+                    yield section, future.result(), None
+                except Exception as e:
+                    yield section, None, e
+    finally:
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait=False)
+
+
+def clean_fragment(text, section):
+    """Strip code fences and anything outside the fragment, and wrap it in its <section> if the model did not."""
+    text = _CODE_FENCE.sub('', text.strip())
+    start = text.find('<')
+    end = text.rfind('>')
+    text = text[start:end + 1] if start != -1 and end > start else html.escape(text)
+    if not re.match(r'<section\b', text, re.I):
+        return f'<section id="{section["id"]}">\n{text}\n</section>'
+    # The navigation links to the id, so the opening tag gets it whatever the model wrote
+    opening_end = text.index('>') + 1
+    opening = re.sub(r'\s+id\s*=\s*("[^"]*"|\'[^\']*\'|\S+)', '', text[:opening_end].rstrip('>').rstrip('/'), flags=re.I)
+    return f'{opening} id="{section["id"]}">' + text[opening_end:]
+
+
+def failed_fragment(section, error):
+    return FAILED_SECTION.format(section_id=section['id'], label=html.escape(section['label']),
+                                 error=html.escape(str(error)))
+
+
+def stitch_page(title, sections, fragments):
+    """
+    Put the fragments into the shared shell in document order, with a navigation entry per
+    section labelled by the fragment's own title where it has one.
+    """
+    nav = []
+    for section in sections:
+        fragment = fragments.get(section['index'], '')
+        match = _FRAGMENT_TITLE.search(fragment)
+        label = html.unescape(_TAG.sub('', match.group(1))).strip() if match else ''
+        nav.append(NAV_ITEM.format(section_id=section['id'], label=html.escape(label or section['label'])))
+    return PAGE_SHELL.format(
+        title=html.escape(title or "Document"),
+        nav="\n".join(nav),
+        sections="\n".join(fragments.get(section['index'], '') for section in sections))
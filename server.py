@@ -1,9 +1,36 @@
 import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from flask import Flask, request, jsonify, Response, stream_with_context, send_from_directory
 from flask_cors import CORS
-from helper_function import create_anthropic_client, create_gemini_client, GeminiStreamingResponse
+from helper_function import create_anthropic_client, create_gemini_client, GeminiStreamingResponse, cache_breakpoint, cacheable_system, message_text
+import document_extraction
+from document_extraction import configure_extraction_pool, iter_text_units, ExtractionError
+from tabular_profile import TABULAR_EXTENSIONS
+from extraction_cache import extract_document_cached, extract_document_within_budget, fit_document_to_budget
+from token_estimation import estimate_tokens, input_token_budget, token_estimator
+from token_histogram import token_sections, token_histogram
+from prompt_registry import prompt_registry, render_prompt
+from content_packer import PACKING_STRATEGIES, DEFAULT_PACKING_STRATEGY, pack_units
+from budget_planner import ADAPTIVE_BUDGET_BY_DEFAULT, budget_planner
+from usage_metrics import USAGE_FIELDS, usage_counts, usage_cost, total_input_tokens, usage_metrics
+from sectioned_generation import (MAX_SECTIONS, SECTION_CONCURRENCY, SECTION_MAX_TOKENS, SECTION_TOKENS,
+                                  clean_fragment, failed_fragment, outline_text, run_sections, split_sections,
+                                  stitch_page)
+from presummarization import (PRESUMMARIZE_BY_DEFAULT, PRESUMMARIZE_MAX_INPUT_TOKENS, SUMMARY_MODEL, presummarize_text,
+                              summary_cache)
+from ingestion import ingest_base64, ingest_bytes
+from upload_store import upload_store
+from analysis_store import AnalysisError, analysis_store
+from chunked_upload import chunked_upload_store, ChunkedUploadError, DEFAULT_CHUNK_SIZE
+from content_cleanup import dedupe_paragraphs
+from archive_extraction import ARCHIVE_EXTENSIONS, ArchiveError, inspect_archive
+from document_images import (IMAGE_SOURCE_EXTENSIONS, extract_document_images, cached_document_images, image_cache_key,
+                             claude_image_blocks, gemini_image_parts, image_cache)
+from structured_summary import STRUCTURED_EXTENSIONS, sniff_structured_format, summarize_structured_text
+from content_sniffing import TEXT_EXTENSIONS, UnsupportedContentError, looks_like_base64, sniff_upload
 import anthropic
+import hashlib
 import json
 import os
 import re
@@ -62,9 +89,28 @@ SESSION_CACHE_EXPIRY = 3600  # 1 hour cache expiry
 # We'll use this constant when estimating token usage
 TOTAL_CONTEXT_WINDOW = 200000
 
-# Maximum allowed tokens for Claude API input (leaving room for output)
-# This should be dynamically adjusted based on requested max_tokens
-MAX_INPUT_TOKENS = 195000  # Setting a bit lower than the actual limit to account for system prompt and overhead
+# Maximum allowed tokens for Claude API input (MAX_INPUT_TOKENS in token_estimation.py)
+# is adjusted per request by input_token_budget() based on the requested max_tokens
+
+# Content sizes (in characters) above which the large-content guidelines are added to the system prompt
+LARGE_CONTENT_CHARS = 50000
+EXTREMELY_LARGE_CONTENT_CHARS = 100000
+
+# Version of the page-generation system prompt sent by /process, /api/process and the Gemini
+# endpoints and the Vercel entry point, which keep the prompt they were built with; /api/process-stream
+# sends the current version
+LEGACY_SYSTEM_PROMPT_VERSION = int(os.environ.get('LEGACY_SYSTEM_PROMPT_VERSION', 1))
+
+# Whether embedded PDF/DOCX images are attached when the request does not say
+INCLUDE_IMAGES_BY_DEFAULT = os.environ.get('INCLUDE_IMAGES_BY_DEFAULT', 'true').lower() == 'true'
+
+# Whether /api/process-stream collapses near-duplicate paragraphs when the request does not say
+DEDUPE_BY_DEFAULT = os.environ.get('DEDUPE_BY_DEFAULT', 'false').lower() == 'true'
+
+# Documents accepted by one /api/analyze-tokens/bulk request, and how many are analyzed at once
+# (0 means one per extraction worker)
+BULK_ANALYZE_MAX_DOCUMENTS = int(os.environ.get('BULK_ANALYZE_MAX_DOCUMENTS', 500))
+BULK_ANALYZE_CONCURRENCY = int(os.environ.get('BULK_ANALYZE_CONCURRENCY', 0))
 
 # Default settings
 DEFAULT_MAX_TOKENS = 128000
@@ -94,9 +140,6 @@ GEMINI_TEMPERATURE = 1.0
 GEMINI_TOP_P = 0.95
 GEMINI_TOP_K = 64
 
-# Same system instruction for both APIs
-SYSTEM_INSTRUCTION = """I will provide you with a file or a content, analyze its content, and transform it into a visually appealing and well-structured webpage.### Content Requirements* Maintain the core information from the original file while presenting it in a clearer and more visually engaging format.⠀Design Style* Follow a modern and minimalistic design inspired by Linear App.* Use a clear visual hierarchy to emphasize important content.* Adopt a professional and harmonious color scheme that is easy on the eyes for extended reading.⠀Technical Specifications* Use HTML5, TailwindCSS 3.0+ (via CDN), and necessary JavaScript.* Implement a fully functional dark/light mode toggle, defaulting to the system setting.* Ensure clean, well-structured code with appropriate comments for easy understanding and maintenance.⠀Responsive Design* The page must be fully responsive, adapting seamlessly to mobile, tablet, and desktop screens.* Optimize layout and typography for different screen sizes.* Ensure a smooth and intuitive touch experience on mobile devices.⠀Icons & Visual Elements* Use professional icon libraries like Font Awesome or Material Icons (via CDN).* Integrate illustrations or charts that best represent the content.* Avoid using emojis as primary icons.* Check if any icons cannot be loaded.⠀User Interaction & ExperienceEnhance the user experience with subtle micro-interactions:* Buttons should have slight enlargement and color transitions on hover.* Cards should feature soft shadows and border effects on hover.* Implement smooth scrolling effects throughout the page.* Content blocks should have an elegant fade-in animation on load.⠀Performance Optimization* Ensure fast page loading by avoiding large, unnecessary resources.* Use modern image formats (WebP) with proper compression.* Implement lazy loading for content-heavy pages.⠀Output Requirements* Deliver a fully functional standalone HTML file, including all necessary CSS and JavaScript.* Ensure the code meets W3C standards with no errors or warnings.* Maintain consistent design and functionality across different browsers.* Your output is only one HTML file, do not present any other notes on the HTML. Also, try your best to visualize the whole content.⠀Create the most effective and visually appealing webpage based on the uploaded file's content type (document, data, images, etc.)."""
-
 @app.route('/')
 def serve_index():
     """Serve the main index.html file with version information in headers."""
@@ -118,28 +161,290 @@ def upload():
         return jsonify({"error": "No file uploaded"}), 400
 
     try:
-        # Read the file content
+        # Read the file content and keep it on the server so it crosses the wire only once
         file_content = file.read()
-        # Convert the file content to base64
-        base64_file_content = base64.b64encode(file_content).decode('utf-8')
+        
+        # Reject zip bombs and oversized bundles before storing them
+        archive = None
+        try:
+            file_type = sniff_upload(file_content, file.filename)['file_type']
+        except UnsupportedContentError as e:
+            return unsupported_content_response(e)
+        if file_type in ARCHIVE_EXTENSIONS:
+            try:
+                archive = inspect_archive(file_content)
+            except ArchiveError as e:
+                return jsonify({"error": str(e)}), e.status_code
+        
+        upload_id = upload_store.put(file.filename, file_content)
         # Create a response object
         response = {
+            "upload_id": upload_id,
             "file_name": file.filename,
-            "file_content": base64_file_content
+            "size": len(file_content),
+            "expires_in": upload_store.ttl
         }
+        if archive is not None:
+            response["archive"] = archive
+        # Older clients can still ask for the base64 round-trip
+        if request.args.get('include_content') == 'true':
+            response["file_content"] = base64.b64encode(file_content).decode('utf-8')
         return jsonify(response)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 413
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/upload/chunked', methods=['POST'])
+def chunked_upload_init():
+    """Start a resumable chunked upload. Body: file_name, size, optional chunk_size and sha256."""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or 'file_name' not in data or 'size' not in data:
+        return jsonify({"error": "Missing file_name or size"}), 400
+    if not isinstance(data['file_name'], str) or not data['file_name']:
+        return jsonify({"error": "file_name must be a non-empty string"}), 400
+
+    # Malformed numbers are the client's error, not the server's
+    try:
+        size = int(data['size'])
+        chunk_size = int(data.get('chunk_size', DEFAULT_CHUNK_SIZE))
+    except (TypeError, ValueError, OverflowError):
+        return jsonify({"error": "size and chunk_size must be integers"}), 400
+
+    try:
+        state = chunked_upload_store.init(
+            data['file_name'],
+            size,
+            chunk_size=chunk_size,
+            sha256=data.get('sha256'),
+            max_size=app.config['MAX_CONTENT_LENGTH']
+        )
+        return jsonify(state)
+    except ChunkedUploadError as e:
+        return jsonify({"error": str(e)}), e.status_code
+
+@app.route('/upload/chunked/<upload_id>', methods=['PUT'])
+def chunked_upload_put(upload_id):
+    """Write one chunk (raw request body) at ?offset=N, verified against the X-Chunk-SHA256 header."""
+    offset = request.args.get('offset', type=int)
+    if offset is None:
+        return jsonify({"error": "Missing offset"}), 400
+
+    try:
+        state = chunked_upload_store.put_chunk(
+            upload_id,
+            offset,
+            request.get_data(cache=False),
+            chunk_sha256=request.headers.get('X-Chunk-SHA256')
+        )
+        return jsonify(state)
+    except ChunkedUploadError as e:
+        return jsonify({"error": str(e)}), e.status_code
+
+@app.route('/upload/chunked/<upload_id>', methods=['GET'])
+def chunked_upload_status(upload_id):
+    """Report which chunks have been received so an interrupted upload can resume."""
+    try:
+        return jsonify(chunked_upload_store.status(upload_id))
+    except ChunkedUploadError as e:
+        return jsonify({"error": str(e)}), e.status_code
+
+@app.route('/upload/chunked/<upload_id>/finalize', methods=['POST'])
+def chunked_upload_finalize(upload_id):
+    """
+    Verify the assembled file and hand it to the upload store.
+    The returned upload_id can be passed to the processing endpoints like one from /upload.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        state, file_data = chunked_upload_store.finalize(upload_id, sha256=data.get('sha256'))
+        stored_upload_id = upload_store.put(state['file_name'], file_data)
+    except ChunkedUploadError as e:
+        return jsonify({"error": str(e)}), e.status_code
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 413
+
+    return jsonify({
+        "upload_id": stored_upload_id,
+        "file_name": state['file_name'],
+        "size": state['size'],
+        "sha256": state['sha256'],
+        "expires_in": upload_store.ttl
+    })
+
+def open_request_upload(data, content_field='file_content'):
+    """
+    Return (file_name, IngestedUpload) for the file a request refers to, or (None, None).
+    Files are referenced by an upload_id from /upload or sent inline, as base64 or as raw text.
+    "file_encoding" ('base64' or 'text') says which; without it the content is sniffed.
+    Raises KeyError if the upload_id is unknown or has expired, ValueError for an unknown encoding.
+    """
+    upload_id = data.get('upload_id')
+    if upload_id:
+        entry = upload_store.get(upload_id)
+        if entry is None:
+            raise KeyError(f"Unknown or expired upload_id: {upload_id}")
+        return data.get('file_name') or entry['file_name'], ingest_bytes(entry['data'])
+
+    file_content = data.get(content_field)
+    if not file_content:
+        return None, None
+    encoding = data.get('file_encoding')
+    if encoding not in (None, 'base64', 'text'):
+        raise ValueError(f"Unknown file_encoding {encoding}; expected 'base64' or 'text'")
+    if encoding == 'text' or (encoding is None and not looks_like_base64(file_content)):
+        # Text files are read client-side and sent as they are
+        return data.get('file_name', ''), ingest_bytes(file_content.encode('utf-8'))
+    return data.get('file_name', ''), ingest_base64(file_content)
+
+def open_request_analysis(data):
+    """
+    Return the stored /api/analyze-tokens result a request refers to by analysis_id, or None.
+    An unknown or expired analysis_id falls back to the file or content sent with the request.
+    """
+    analysis_id = data.get('analysis_id')
+    if not analysis_id:
+        return None
+    analysis = analysis_store.get(analysis_id)
+    if analysis is None:
+        print(f"Analysis {analysis_id} is unknown or expired, extracting the request payload instead")
+    return analysis
+
+def system_prompt_token_reserve():
+    """
+    Tokens taken by the longest system prompt (with the large-content guidelines) and the
+    literal text of the user message, as the prompt registry counts them at the current fit.
+    """
+    return prompt_registry.max_system_prompt_tokens() + prompt_registry.tokens('webpage_user')
+
+def request_content_budget(model, max_tokens, format_prompt='', thinking_budget=0):
+    """
+    Tokens of user content that fit in a generation request: the model's input budget after
+    the output and thinking reservations, less the system prompt and the user instructions.
+    """
+    budget = input_token_budget(model, max_tokens, thinking_budget=thinking_budget)
+    return budget - system_prompt_token_reserve() - estimate_tokens(format_prompt)
+
+def request_packing_strategy(data):
+    """The packing strategy a request asks for; raises ValueError for an unknown one."""
+    strategy = data.get('packing') or DEFAULT_PACKING_STRATEGY
+    if strategy not in PACKING_STRATEGIES:
+        raise ValueError(f"Unknown packing strategy {strategy}; expected one of {', '.join(PACKING_STRATEGIES)}")
+    return strategy
+
+def content_category(file_ext, structured=False):
+    """The content type the budget planner groups runs by."""
+    if structured or file_ext in STRUCTURED_EXTENSIONS:
+        return 'structured'
+    if file_ext in ARCHIVE_EXTENSIONS:
+        return 'archive'
+    if file_ext in TABULAR_EXTENSIONS:
+        return 'table'
+    if file_ext in ['pdf', 'docx', 'doc']:
+        return 'document'
+    return 'text'
+
+def plan_request_budget(data, model, content_type, input_tokens, max_tokens, thinking_budget):
+    """
+    Plan max_tokens and the thinking budget of a generation request from its input and the
+    optional latency_target (seconds). The requested values are upper bounds; requests with
+    "adaptive_budget": false use them as they are.
+    """
+    latency_target = data.get('latency_target')
+    return budget_planner.plan(content_type, input_tokens, model, max_tokens, thinking_budget,
+                               latency_target=float(latency_target) if latency_target else None,
+                               adaptive=bool(data.get('adaptive_budget', ADAPTIVE_BUDGET_BY_DEFAULT)))
+
+def analysis_key(data, content, inline_name):
+    """
+    Content-derived analysis_id for an /api/analyze-tokens request: the SHA-256 of the file or
+    text, its extension (text formats are told apart by name) and the model and budget settings.
+    Repeat calls for the same input find the earlier analysis instead of decoding and extracting
+    again, whichever upload_id the file was stored under. Raises AnalysisError for an unknown upload.
+    """
+    if data.get('upload_id'):
+        entry = upload_store.get(data['upload_id'])
+        if entry is None:
+            raise AnalysisError(f"Unknown or expired upload_id: {data['upload_id']}", 404)
+        digest = upload_store.digest(entry)
+        name = data.get('file_name') or entry['file_name']
+    else:
+        digest = hashlib.sha256(content.encode('utf-8', 'surrogatepass')).hexdigest()
+        name = inline_name
+    extension = name.rsplit('.', 1)[-1].lower() if '.' in name else ''
+    settings = [data.get('model', 'claude-3-7-sonnet-20250219'), data.get('max_tokens', DEFAULT_MAX_TOKENS),
+                data.get('thinking_budget', DEFAULT_THINKING_BUDGET), data.get('format_prompt', '')]
+    source = "\0".join([digest, extension] + [str(value) for value in settings])
+    return hashlib.sha256(source.encode('utf-8', 'surrogatepass')).hexdigest()
+
+def open_analysis_upload(analysis):
+    """Return the original bytes of an analyzed file as an IngestedUpload, or None if they were not kept or have expired."""
+    entry = upload_store.get(analysis['upload_id']) if analysis['upload_id'] else None
+    return ingest_bytes(entry['data']) if entry is not None else None
+
+def retain_image_source(file_name, file_type, upload):
+    """
+    Keep the bytes of an inline PDF/DOCX in the upload store so a generation request that
+    reuses its analysis can still attach the embedded images. Returns the upload_id or None.
+    """
+    if file_type not in IMAGE_SOURCE_EXTENSIONS:
+        return None
+    try:
+        return upload_store.put(file_name, bytes(upload.buffer))
+    except ValueError as e:
+        print(f"Not keeping {file_name} for image extraction: {str(e)}")
+        return None
+
+def upload_file_type(file_name, upload):
+    """
+    The extractor to use for an upload, decided by its leading bytes; the file name only
+    tells text formats apart. Raises UnsupportedContentError for binary formats without an extractor.
+    """
+    return sniff_upload(upload.buffer, file_name)['file_type']
+
+def unsupported_content_response(e):
+    print(f"Rejected upload: {str(e)}")
+    return jsonify({"success": False, "error": str(e), "error_code": "unsupported_content"}), 415
+
+def extraction_error_response(e):
+    """Structured client error for an extraction stopped by its deadline or memory limit."""
+    print(f"Extraction failed ({e.code}): {str(e)}")
+    return jsonify({"success": False, "error": str(e), "error_code": e.code}), e.status_code
+
+def extract_request_images(upload, file_ext, digest=None):
+    """Extract the images of an uploaded document; images are optional, so failures only lose them."""
+    try:
+        images, image_report = extract_document_images(upload.buffer, file_ext, digest=digest)
+    except Exception as e:
+        print(f"Error extracting images from {file_ext.upper()}: {str(e)}")
+        return [], None
+    print(f"Attaching {image_report['attached']} of {image_report['found']} images "
+          f"({image_report['bytes']} bytes, ~{image_report['estimated_tokens']} tokens, "
+          f"{'cached' if image_report['cache_hit'] else 'extracted'})")
+    return images, image_report
+
+def analysis_images(analysis):
+    """
+    Images of an analyzed document: the prepared images cached under the analysis' image_key,
+    or on a cache miss the images extracted from the kept original bytes, which fills the cache again.
+    """
+    cached = cached_document_images(analysis['image_key']) if analysis['image_key'] else None
+    if cached is not None:
+        images, image_report = cached
+        print(f"Attaching {image_report['attached']} cached images of analysis {analysis['analysis_id']}")
+        return images, image_report
+    upload = open_analysis_upload(analysis)
+    if upload is None:
+        return [], None
+    with upload:
+        return extract_request_images(upload, analysis['file_type'], analysis['document'].get('sha256'))
+
 @app.route('/process', methods=['POST'])
 def process():
     data = request.get_json()
-    if not data or 'file_name' not in data or 'file_content' not in data:
-        return jsonify({"error": "Missing file_name or file_content"}), 400
+    if not data or ('upload_id' not in data and 'analysis_id' not in data and ('file_name' not in data or 'file_content' not in data)):
+        return jsonify({"error": "Missing upload_id, analysis_id or file_name and file_content"}), 400
 
-    file_name = data['file_name']
-    file_content = data['file_content']
-    
     # Get additional parameters from request or use defaults
     api_key = data.get('api_key', '')
     format_prompt = data.get('format_prompt', '')
@@ -149,40 +454,41 @@ def process():
     thinking_budget = int(data.get('thinking_budget', DEFAULT_THINKING_BUDGET))
 
     try:
-        # Convert base64 string back to bytes
-        file_content_bytes = base64.b64decode(file_content)
-        # Create a temporary file to save the uploaded file
-        temp_file_path = f"/tmp/{file_name}"
-        with open(temp_file_path, 'wb') as f:
-            f.write(file_content_bytes)
-            
-        # Determine file type and read content
-        file_ext = file_name.split('.')[-1].lower() if '.' in file_name else 'txt'
-        
-        # Process the file based on its type
-        file_text_content = ""
-        
-        if file_ext == 'pdf':
-            # Process PDF file
+        # Start from an earlier /api/analyze-tokens result, or look up the stored upload
+        # or decode the inline base64 in memory
+        analysis = open_request_analysis(data)
+        if analysis is None:
             try:
-                reader = PyPDF2.PdfReader(temp_file_path)
-                for page_num in range(len(reader.pages)):
-                    file_text_content += reader.pages[page_num].extract_text() + "\n"
-            except Exception as e:
+                file_name, upload = open_request_upload(data)
+            except KeyError as e:
+                return jsonify({"error": str(e)}), 404
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            if upload is None:
+                return jsonify({"error": f"Unknown or expired analysis_id: {data.get('analysis_id')}"}), 404
+        
+        # Process the file based on its content type, reusing earlier extractions of the same bytes
+        file_ext = None
+        try:
+            if analysis is not None:
+                extraction = analysis['document']
+            else:
+                with upload:
+                    file_ext = upload_file_type(file_name, upload)
+                    extraction = extract_document_cached(upload.buffer, file_ext)
+            file_text_content = extraction['text']
+            if extraction.get('boilerplate'):
+                print(f"Removed repeated headers/footers: {extraction['boilerplate']}")
+        except UnsupportedContentError as e:
+            return unsupported_content_response(e)
+        except ExtractionError as e:
+            return extraction_error_response(e)
+        except Exception as e:
+            if file_ext == 'pdf':
                 return jsonify({"error": f"Error processing PDF: {str(e)}"}), 500
-                
-        elif file_ext in ['docx', 'doc']:
-            # Process Word document
-            try:
-                doc = docx.Document(temp_file_path)
-                file_text_content = "\n".join([paragraph.text for paragraph in doc.paragraphs])
-            except Exception as e:
+            if file_ext in ['docx', 'doc']:
                 return jsonify({"error": f"Error processing Word document: {str(e)}"}), 500
-                
-        else:
-            # Process text-based file
-            with open(temp_file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                file_text_content = f.read()
+            raise
                 
         # Now process the file content with Claude
         if not api_key:
@@ -193,16 +499,20 @@ def process():
             client = create_anthropic_client(api_key)
             
             # Prepare user message with content and additional prompt
-            user_content = file_text_content
-            if format_prompt:
-                user_content = f"{user_content}\n\n{format_prompt}"
+            user_content = render_prompt('webpage_user', format_prompt=format_prompt, content=file_text_content)
+            
+            # Output and thinking budgets follow the input size, its type and the caller's latency target
+            budget_plan = plan_request_budget(data, model, content_category(extraction.get('file_type')),
+                                              estimate_tokens(file_text_content), max_tokens, thinking_budget)
+            max_tokens = budget_plan['max_tokens']
+            thinking_budget = budget_plan['thinking_budget']
             
             # Create parameters for the API call
             params = {
                 "model": model,
                 "max_tokens": max_tokens,
                 "temperature": temperature,
-                "system": "I will provide you with a file or a content, analyze its content, and transform it into a visually appealing and well-structured webpage.### Content Requirements* Maintain the core information from the original file while presenting it in a clearer and more visually engaging format.⠀Design Style* Follow a modern and minimalistic design inspired by Linear App.* Use a clear visual hierarchy to emphasize important content.* Adopt a professional and harmonious color scheme that is easy on the eyes for extended reading.⠀Technical Specifications* Use HTML5, TailwindCSS 3.0+ (via CDN), and necessary JavaScript.* Implement a fully functional dark/light mode toggle, defaulting to the system setting.* Ensure clean, well-structured code with appropriate comments for easy understanding and maintenance.⠀Responsive Design* The page must be fully responsive, adapting seamlessly to mobile, tablet, and desktop screens.* Optimize layout and typography for different screen sizes.* Ensure a smooth and intuitive touch experience on mobile devices.⠀Icons & Visual Elements* Use professional icon libraries like Font Awesome or Material Icons (via CDN).* Integrate illustrations or charts that best represent the content.* Avoid using emojis as primary icons.* Check if any icons cannot be loaded.⠀User Interaction & ExperienceEnhance the user experience with subtle micro-interactions:* Buttons should have slight enlargement and color transitions on hover.* Cards should feature soft shadows and border effects on hover.* Implement smooth scrolling effects throughout the page.* Content blocks should have an elegant fade-in animation on load.⠀Performance Optimization* Ensure fast page loading by avoiding large, unnecessary resources.* Use modern image formats (WebP) with proper compression.* Implement lazy loading for content-heavy pages.⠀Output Requirements* Deliver a fully functional standalone HTML file, including all necessary CSS and JavaScript.* Ensure the code meets W3C standards with no errors or warnings.* Maintain consistent design and functionality across different browsers.* Your output is only one HTML file, do not present any other notes on the HTML. Also, try your best to visualize the whole content.⠀Create the most effective and visually appealing webpage based on the uploaded file's content type (document, data, images, etc.).",
+                "system": cacheable_system(prompt_registry.system_prompt(version=LEGACY_SYSTEM_PROMPT_VERSION)[0], model),
                 "messages": [{"role": "user", "content": user_content}],
             }
             
@@ -215,6 +525,7 @@ def process():
                 params["betas"] = [OUTPUT_128K_BETA]
             
             # Create the message
+            started = time.time()
             response = client.messages.create(**params)
             
             # Extract the HTML from the response
@@ -259,35 +570,25 @@ def process():
                     print(f"Fallback extraction failed: {str(e)}")
                     html_content = "Error: Unable to extract HTML content from response."
                 
-            # Get usage stats
-            input_tokens = 0
-            output_tokens = 0
-            
-            if hasattr(response, 'usage'):
-                if hasattr(response.usage, 'input_tokens'):
-                    input_tokens = response.usage.input_tokens
-                if hasattr(response.usage, 'output_tokens'):
-                    output_tokens = response.usage.output_tokens
-            elif isinstance(response, dict) and 'usage' in response:
-                usage = response['usage']
-                if isinstance(usage, dict):
-                    input_tokens = usage.get('input_tokens', 0)
-                    output_tokens = usage.get('output_tokens', 0)
+            # Get usage stats, including the prefix tokens read from or written to the prompt cache
+            usage = getattr(response, 'usage', None)
+            if usage is None and isinstance(response, dict):
+                usage = response.get('usage')
+            usage_data = usage_counts(usage) or usage_counts({})
+            usage_metrics.record(usage_data)
+            budget_planner.observe(budget_plan, estimate_tokens(html_content), usage_data['output_tokens'], time.time() - started)
             
             # Calculate total cost based on token usage
             # Based on Anthropic documentation: Claude 3.7 Sonnet costs $3/MTok for input and $15/MTok for output
             # Thinking tokens are already included in output tokens
-            total_cost = (input_tokens / 1000000) * 3.0 + (output_tokens / 1000000) * 15.0
+            usage_data['total_cost'] = usage_cost(usage_data)
                 
             # Return the response
             return jsonify({
                 'html': html_content,
                 'model': model,
-                'usage': {
-                    'input_tokens': input_tokens,
-                    'output_tokens': output_tokens,
-                    'total_cost': total_cost
-                }
+                'usage': usage_data,
+                'budget': budget_plan
             })
             
         except Exception as e:
@@ -452,9 +753,13 @@ def process_file():
         client = create_anthropic_client(api_key)
         
         # Prepare user message with content and additional prompt
-        user_content = content
-        if format_prompt:
-            user_content = f"{user_content}\n\n{format_prompt}"
+        user_content = render_prompt('webpage_user', format_prompt=format_prompt, content=content)
+        
+        # Output and thinking budgets follow the input size and the caller's latency target
+        budget_plan = plan_request_budget(data, model, content_category(None), estimate_tokens(content),
+                                          max_tokens, thinking_budget)
+        max_tokens = budget_plan['max_tokens']
+        thinking_budget = budget_plan['thinking_budget']
         
         print("Creating message with thinking parameter...")
         
@@ -463,7 +768,7 @@ def process_file():
             "model": model,
             "max_tokens": max_tokens,
             "temperature": temperature,
-            "system": "I will provide you with a file or a content, analyze its content, and transform it into a visually appealing and well-structured webpage.### Content Requirements* Maintain the core information from the original file while presenting it in a clearer and more visually engaging format.⠀Design Style* Follow a modern and minimalistic design inspired by Linear App.* Use a clear visual hierarchy to emphasize important content.* Adopt a professional and harmonious color scheme that is easy on the eyes for extended reading.⠀Technical Specifications* Use HTML5, TailwindCSS 3.0+ (via CDN), and necessary JavaScript.* Implement a fully functional dark/light mode toggle, defaulting to the system setting.* Ensure clean, well-structured code with appropriate comments for easy understanding and maintenance.⠀Responsive Design* The page must be fully responsive, adapting seamlessly to mobile, tablet, and desktop screens.* Optimize layout and typography for different screen sizes.* Ensure a smooth and intuitive touch experience on mobile devices.⠀Icons & Visual Elements* Use professional icon libraries like Font Awesome or Material Icons (via CDN).* Integrate illustrations or charts that best represent the content.* Avoid using emojis as primary icons.* Check if any icons cannot be loaded.⠀User Interaction & ExperienceEnhance the user experience with subtle micro-interactions:* Buttons should have slight enlargement and color transitions on hover.* Cards should feature soft shadows and border effects on hover.* Implement smooth scrolling effects throughout the page.* Content blocks should have an elegant fade-in animation on load.⠀Performance Optimization* Ensure fast page loading by avoiding large, unnecessary resources.* Use modern image formats (WebP) with proper compression.* Implement lazy loading for content-heavy pages.⠀Output Requirements* Deliver a fully functional standalone HTML file, including all necessary CSS and JavaScript.* Ensure the code meets W3C standards with no errors or warnings.* Maintain consistent design and functionality across different browsers.⠀Create the most effective and visually appealing webpage based on the uploaded file's content type (document, data, images, etc.Your output is only one HTML file, do not present any other notes on the HTML.",
+            "system": cacheable_system(prompt_registry.system_prompt(version=LEGACY_SYSTEM_PROMPT_VERSION)[0], model),
             "messages": [{"role": "user", "content": user_content}],
         }
         
@@ -476,6 +781,7 @@ def process_file():
             params["betas"] = [OUTPUT_128K_BETA]
         
         # Create the message
+        started = time.time()
         response = client.messages.create(**params)
         
         # Extract the HTML from the response
@@ -520,20 +826,14 @@ def process_file():
                 print(f"Fallback extraction failed: {str(e)}")
                 html_content = "Error: Unable to extract HTML content from response."
             
-        # Get usage stats
-        input_tokens = 0
-        output_tokens = 0
-        
-        if hasattr(response, 'usage'):
-            if hasattr(response.usage, 'input_tokens'):
-                input_tokens = response.usage.input_tokens
-            if hasattr(response.usage, 'output_tokens'):
-                output_tokens = response.usage.output_tokens
-        elif isinstance(response, dict) and 'usage' in response:
-            usage = response['usage']
-            if isinstance(usage, dict):
-                input_tokens = usage.get('input_tokens', 0)
-                output_tokens = usage.get('output_tokens', 0)
+        # Get usage stats, including the prefix tokens read from or written to the prompt cache
+        usage = getattr(response, 'usage', None)
+        if usage is None and isinstance(response, dict):
+            usage = response.get('usage')
+        usage_data = usage_counts(usage) or usage_counts({})
+        usage_metrics.record(usage_data)
+        usage_data['total_cost'] = usage_cost(usage_data)
+        budget_planner.observe(budget_plan, estimate_tokens(html_content), usage_data['output_tokens'], time.time() - started)
                 
         # Log response structure for debugging
         print(f"Response type: {type(response)}")
@@ -544,11 +844,8 @@ def process_file():
         return jsonify({
             'html': html_content,
             'model': model,
-            'usage': {
-                'input_tokens': input_tokens,
-                'output_tokens': output_tokens,
-                'total_cost': (input_tokens / 1000000) * 3.0 + (output_tokens / 1000000) * 15.0
-            }
+            'usage': usage_data,
+            'budget': budget_plan
         })
     
     except Exception as e:
@@ -556,102 +853,201 @@ def process_file():
         print(f"Error in /api/process: {error_message}")
         return jsonify({'error': f'Server error: {error_message}'}), 500
 
+def analyze_input(data):
+    """
+    Extract and estimate one /api/analyze-tokens input: a file stored by /upload, an inline
+    base64 document or plain text. Returns the response body. Raises UnsupportedContentError,
+    ExtractionError, or AnalysisError for unknown uploads and unreadable or empty input.
+    """
+    content = data.get('content', '')
+    if not content:
+        content = data.get('source', '')
+        
+    file_type = data.get('file_type', 'txt')
+    # Inline files are still checked by content; the declared type only picks the branch
+    inline_name = data.get('file_name') or f"upload.{file_type}"
+    analysis_name = inline_name
+    source_upload_id = None
+    extraction = {}
+    
+    # Repeat calls for the same input (file select, paste, settings change) reuse the stored analysis
+    analysis_id = analysis_key(data, content, inline_name)
+    analysis = analysis_store.get(analysis_id)
+    if analysis is not None:
+        extraction = analysis['document']
+        content = extraction['text']
+    
+    # Handle files stored by /upload and referenced by upload_id
+    elif data.get('upload_id'):
+        try:
+            file_name, upload = open_request_upload(data)
+        except KeyError as e:
+            raise AnalysisError(e.args[0], 404)
+        analysis_name = file_name
+        source_upload_id = data['upload_id']
+        try:
+            with upload:
+                file_type = upload_file_type(file_name, upload)
+                extraction = extract_document_cached(upload.buffer, file_type)
+        except (UnsupportedContentError, ExtractionError):
+            raise
+        except Exception as e:
+            raise AnalysisError(f"Error processing {file_type.upper()}: {str(e)}")
+        content = extraction['text']
+    
+    # Handle PDF/DOCX documents, CSV/TSV/XLSX tables and ZIP bundles, which are sent as base64
+    # (could start with data:...;base64, or just be raw base64). Tables become a data profile,
+    # bundles the text of every supported member
+    elif file_type in ['pdf', 'docx', 'doc'] or file_type in TABULAR_EXTENSIONS or file_type in ARCHIVE_EXTENSIONS:
+        try:
+            # Decode in memory and extract (cached by content hash)
+            with ingest_base64(content) as upload:
+                inline_type = upload_file_type(inline_name, upload)
+                extraction = extract_document_cached(upload.buffer, inline_type)
+                source_upload_id = retain_image_source(inline_name, inline_type, upload)
+        except (UnsupportedContentError, ExtractionError):
+            raise
+        except Exception as e:
+            raise AnalysisError(f"Error processing {file_type.upper()}: {str(e)}")
+        content = extraction['text']
+    
+    # If no content after processing, return an error
+    if not content:
+        raise AnalysisError("No content to analyze")
+    
+    # Keep the extracted text and its per-page/section breakdown so the generation request and
+    # repeat analyses start from them instead of extracting again
+    if analysis is not None:
+        sections = analysis['sections']
+    else:
+        if not extraction:
+            extraction = {
+                'text': content,
+                'file_type': file_type if file_type in TEXT_EXTENSIONS else 'txt',
+                'char_count': len(content),
+                'boilerplate': None
+            }
+        sections = token_sections(extraction)
+        # Generation requests look the document's prepared images up by this key before extracting them
+        image_key = None
+        if extraction.get('sha256') and extraction['file_type'] in IMAGE_SOURCE_EXTENSIONS:
+            image_key = image_cache_key(extraction['sha256'], extraction['file_type'])
+        try:
+            analysis_store.put(analysis_name, extraction, upload_id=source_upload_id,
+                               analysis_id=analysis_id, sections=sections, image_key=image_key)
+        except ValueError as e:
+            print(f"Not storing analysis: {str(e)}")
+            analysis_id = None
+    
+    # Where the content budget of a generation request runs out, page by page or section by section
+    model = data.get('model', 'claude-3-7-sonnet-20250219')
+    max_tokens = int(data.get('max_tokens', DEFAULT_MAX_TOKENS))
+    thinking_budget = int(data.get('thinking_budget', DEFAULT_THINKING_BUDGET))
+    content_token_budget = request_content_budget(model, max_tokens, data.get('format_prompt', ''), thinking_budget)
+    histogram = token_histogram(sections, content_token_budget)
+    
+    # The system prompt and the user message template are counted once at startup; only the content is estimated here
+    _, system_prompt_tokens = prompt_registry.system_prompt(large=len(content) > LARGE_CONTENT_CHARS,
+                                                            extremely_large=len(content) > EXTREMELY_LARGE_CONTENT_CHARS
+                                                            or histogram['first_excluded'] is not None)
+    estimated_tokens = (system_prompt_tokens
+                        + prompt_registry.tokens('webpage_user', format_prompt=data.get('format_prompt', ''), content=content)
+                        + token_estimator.estimate_request())
+    estimated_low, estimated_high = token_estimator.bounds(estimated_tokens)
+    
+    # Calculate estimated cost (as of current pricing)
+    estimated_cost = (estimated_tokens / 1000000) * 3.0  # $3 per million tokens
+    
+    # Add thinking budget in cost estimate
+    if thinking_budget > 0:
+        estimated_cost += (thinking_budget / 1000000) * 3.0  # Add thinking cost
+    
+    # Calculate max safe input tokens
+    max_safe_input_tokens = 200000  # Claude 3.7 context window
+    
+    return {
+        'estimated_tokens': estimated_tokens,
+        # Range the actual count is expected to fall in, from the estimator's recent errors
+        'estimated_tokens_range': [estimated_low, estimated_high],
+        'estimator': token_estimator.stats(),
+        'estimated_cost': round(estimated_cost, 6),
+        'max_safe_input_tokens': max_safe_input_tokens,
+        # Characters and tokens saved by dropping repeated headers/footers
+        'boilerplate': extraction.get('boilerplate'),
+        # Tokens per page/section and the first one that would be cut
+        'token_histogram': histogram,
+        # Pass as analysis_id to the processing endpoints to skip decoding and extraction
+        'analysis_id': analysis_id,
+        'analysis_expires_in': analysis_store.ttl
+    }
+
+def analysis_error_body(e):
+    """Map an analyze_input failure to (response body, HTTP status)."""
+    if isinstance(e, UnsupportedContentError):
+        return {"success": False, "error": str(e), "error_code": "unsupported_content"}, 415
+    if isinstance(e, ExtractionError):
+        return {"success": False, "error": str(e), "error_code": e.code}, e.status_code
+    if isinstance(e, AnalysisError):
+        return {"error": str(e)}, e.status_code
+    return {"error": f"Error analyzing tokens: {str(e)}"}, 500
+
 @app.route('/api/analyze-tokens', methods=['POST'])
 def analyze_tokens():
+    data = request.get_json()
+    if not data:
+        return jsonify({"error": "No data provided"}), 400
+    
+    print(f"Analyzing tokens for data of size: {len(str(data))}")
+    
     try:
-        data = request.get_json()
-        if not data:
-            return jsonify({"error": "No data provided"}), 400
-        
-        print(f"Analyzing tokens for data of size: {len(str(data))}")
-        
-        content = data.get('content', '')
-        if not content:
-            content = data.get('source', '')
-            
-        file_type = data.get('file_type', 'txt')
-        
-        # Handle PDF files (which are sent as base64)
-        if file_type == 'pdf':
-            # Recognize base64 data (could start with data:application/pdf;base64, or just be raw base64)
-            if ';base64,' in content:
-                # Extract the base64 part
-                content = content.split(';base64,')[1]
-            
-            try:
-                # Decode base64
-                pdf_data = base64.b64decode(content)
-                
-                # Create a file-like object
-                pdf_file = io.BytesIO(pdf_data)
-                
-                # Extract text from the PDF
-                reader = PyPDF2.PdfReader(pdf_file)
-                text_content = ""
-                
-                # Extract text from each page
-                for page_num in range(len(reader.pages)):
-                    text_content += reader.pages[page_num].extract_text() + "\n"
-                
-                # Use the extracted text for token analysis
-                content = text_content
-                
-            except Exception as e:
-                return jsonify({"error": f"Error processing PDF: {str(e)}"}), 400
-        
-        # Handle DOCX files
-        elif file_type in ['docx', 'doc']:
-            try:
-                # Decode base64
-                docx_data = base64.b64decode(content)
-                
-                # Create a file-like object
-                docx_file = io.BytesIO(docx_data)
-                
-                # Extract text from the DOCX
-                doc = docx.Document(docx_file)
-                text_content = "\n".join([paragraph.text for paragraph in doc.paragraphs])
-                
-                # Use the extracted text for token analysis
-                content = text_content
-                
-            except Exception as e:
-                return jsonify({"error": f"Error processing DOCX: {str(e)}"}), 400
-        
-        # If no content after processing, return an error
-        if not content:
-            return jsonify({"error": "No content to analyze"}), 400
-        
-        # Define the system prompt to include in token estimation - Use the same detailed prompt as in process_file
-        system_prompt = "I will provide you with a file or a content, analyze its content, and transform it into a visually appealing and well-structured webpage.### Content Requirements* Maintain the core information from the original file while presenting it in a clearer and more visually engaging format.⠀Design Style* Follow a modern and minimalistic design inspired by Linear App.* Use a clear visual hierarchy to emphasize important content.* Adopt a professional and harmonious color scheme that is easy on the eyes for extended reading.⠀Technical Specifications* Use HTML5, TailwindCSS 3.0+ (via CDN), and necessary JavaScript.* Implement a fully functional dark/light mode toggle, defaulting to the system setting.* Ensure clean, well-structured code with appropriate comments for easy understanding and maintenance.⠀Responsive Design* The page must be fully responsive, adapting seamlessly to mobile, tablet, and desktop screens.* Optimize layout and typography for different screen sizes.* Ensure a smooth and intuitive touch experience on mobile devices.⠀Icons & Visual Elements* Use professional icon libraries like Font Awesome or Material Icons (via CDN).* Integrate illustrations or charts that best represent the content.* Avoid using emojis as primary icons.* Check if any icons cannot be loaded.⠀User Interaction & ExperienceEnhance the user experience with subtle micro-interactions:* Buttons should have slight enlargement and color transitions on hover.* Cards should feature soft shadows and border effects on hover.* Implement smooth scrolling effects throughout the page.* Content blocks should have an elegant fade-in animation on load.⠀Performance Optimization* Ensure fast page loading by avoiding large, unnecessary resources.* Use modern image formats (WebP) with proper compression.* Implement lazy loading for content-heavy pages.⠀Output Requirements* Deliver a fully functional standalone HTML file, including all necessary CSS and JavaScript.* Ensure the code meets W3C standards with no errors or warnings.* Maintain consistent design and functionality across different browsers.⠀Create the most effective and visually appealing webpage based on the uploaded file's content type (document, data, images, etc.).Your output is only one HTML file, do not present any other notes on the HTML."
-        
-        # Estimated system prompt tokens (if exact count not available)
-        system_prompt_tokens = len(system_prompt) // 3
-        
-        # Estimate tokens in content
-        content_tokens = len(content) // 4
-        
-        # Total estimated tokens
-        estimated_tokens = system_prompt_tokens + content_tokens
-        
-        # Calculate estimated cost (as of current pricing)
-        estimated_cost = (estimated_tokens / 1000000) * 3.0  # $3 per million tokens
-        
-        # Add thinking budget in cost estimate
-        thinking_budget = int(data.get('thinking_budget', DEFAULT_THINKING_BUDGET))
-        if thinking_budget > 0:
-            estimated_cost += (thinking_budget / 1000000) * 3.0  # Add thinking cost
-        
-        # Calculate max safe input tokens
-        max_safe_input_tokens = 200000  # Claude 3.7 context window
-        
-        return jsonify({
-            'estimated_tokens': estimated_tokens,
-            'estimated_cost': round(estimated_cost, 6),
-            'max_safe_input_tokens': max_safe_input_tokens
-        })
+        return jsonify(analyze_input(data))
     except Exception as e:
-        return jsonify({"error": f"Error analyzing tokens: {str(e)}"}), 500
+        body, status = analysis_error_body(e)
+        print(f"Token analysis failed ({status}): {body['error']}")
+        return jsonify(body), status
+
+@app.route('/api/analyze-tokens/bulk', methods=['POST'])
+def analyze_tokens_bulk():
+    """
+    Analyze many documents in one request. Body: documents, a list of /api/analyze-tokens inputs
+    (upload_id or inline content, each with an optional id), plus model, max_tokens and
+    format_prompt applied to all of them. Documents are extracted concurrently on the extraction
+    pool and one NDJSON line is streamed back per document as soon as it is done.
+    """
+    data = request.get_json()
+    if not data or not isinstance(data.get('documents'), list):
+        return jsonify({"error": "Missing documents list"}), 400
+    documents = data['documents']
+    if len(documents) > BULK_ANALYZE_MAX_DOCUMENTS:
+        return jsonify({"error": f"At most {BULK_ANALYZE_MAX_DOCUMENTS} documents can be analyzed per request"}), 413
+    
+    shared = {key: data[key] for key in ('model', 'max_tokens', 'format_prompt', 'thinking_budget') if key in data}
+    
+    def analyze_document(index, document):
+        started = time.time()
+        try:
+            result = analyze_input(dict(shared, **document))
+            status = 200
+        except Exception as e:
+            result, status = analysis_error_body(e)
+        result.update(index=index, id=document.get('id'), status=status, seconds=round(time.time() - started, 3))
+        return result
+    
+    def generate():
+        # The threads mostly wait: PDF, DOCX and table parsing runs in the isolated extraction workers
+        workers = max(1, min(BULK_ANALYZE_CONCURRENCY or document_extraction.EXTRACTION_WORKERS, len(documents)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(analyze_document, index, document if isinstance(document, dict) else {})
+                       for index, document in enumerate(documents)]
+            try:
+                for future in as_completed(futures):
+                    yield json.dumps(future.result()) + "\n"
+            finally:
+                # A client that disconnects should not keep the remaining documents queued
+                for future in futures:
+                    future.cancel()
+    
+    return Response(generate(), mimetype='application/x-ndjson')
 
 # Define helper functions for streaming
 def format_stream_event(event_type, data=None):
@@ -689,6 +1085,15 @@ def format_stream_event(event_type, data=None):
     buffer += "\n"
     return buffer
 
+def start_event(started, data):
+    """
+    The first event of a generation: stream_start, or a generation_start content event with the
+    same data when a pre-summarization pass has already started the stream.
+    """
+    if started:
+        return format_stream_event("content", dict(data, type="generation_start"))
+    return format_stream_event("stream_start", data)
+
 def create_stream_generator(client, system_prompt, user_message, model, max_tokens, temperature, thinking_budget=None):
     """Create a generator that yields SSE events for streaming Claude responses"""
     try:
@@ -697,7 +1102,7 @@ def create_stream_generator(client, system_prompt, user_message, model, max_toke
             "model": model,
             "max_tokens": max_tokens,
             "temperature": temperature,
-            "system": system_prompt,
+            "system": cacheable_system(system_prompt, model),
             "messages": [
                 {
                     "role": "user",
@@ -758,10 +1163,7 @@ def create_stream_generator(client, system_prompt, user_message, model, max_toke
                 elif chunk.type == "message_complete":
                     usage_data = None
                     if hasattr(stream.message, "usage"):
-                        usage_data = {
-                            "input_tokens": stream.message.usage.input_tokens,
-                            "output_tokens": stream.message.usage.output_tokens
-                        }
+                        usage_data = usage_counts(stream.message.usage)
                         
                         # Add thinking tokens if available
                         if hasattr(stream.message.usage, "thinking_tokens"):
@@ -785,6 +1187,134 @@ def create_stream_generator(client, system_prompt, user_message, model, max_toke
         }
         yield format_stream_event("error", error_data)
 
+def sectioned_stream_generator(client, model, temperature, format_prompt, sections_report,
+                               extraction_report, title, session_id, started=False):
+    """
+    Generate every section of a sectioned request as its own Claude request, at most
+    SECTION_CONCURRENCY at a time, and stream each fragment as soon as it finishes. The
+    fragments are then stitched into the shared page shell, so the whole run takes about as
+    long as its slowest section. Each section carries its own budget plan.
+    """
+    sections = sections_report['sections']
+    system_prompt = render_prompt('section_system')
+    # The format prompt and the outline are the same for every section, so they open the user
+    # turn; the prompt cache breakpoint goes after them when the shared prefix is long enough
+    outline_fields = {'format_prompt': format_prompt, 'count': str(len(sections)), 'outline': outline_text(sections)}
+    outline_turn = render_prompt('section_outline', **outline_fields)
+    shared_blocks = cache_breakpoint([{"type": "text", "text": outline_turn}],
+                                     prompt_registry.tokens('section_system')
+                                     + prompt_registry.tokens('section_outline', **outline_fields), model)
+
+    def generate(section):
+        user_content = render_prompt('section_user', number=str(section['index'] + 1), count=str(len(sections)),
+                                     section_id=section['id'], content=section['text'])
+        params = {
+            "model": model,
+            "max_tokens": section['budget']['max_tokens'],
+            "temperature": temperature,
+            "system": system_prompt,
+            "messages": [{"role": "user", "content": shared_blocks + [{"type": "text", "text": user_content}]}]
+        }
+        if section['budget']['thinking_budget'] > 0:
+            params["thinking"] = {"type": "enabled", "budget_tokens": section['budget']['thinking_budget']}
+        started = time.time()
+        response = client.messages.create(**params)
+        usage_data = usage_counts(getattr(response, 'usage', None))
+        if usage_data is not None:
+            usage_metrics.record(usage_data)
+            token_estimator.observe(system_prompt + outline_turn + user_content, total_input_tokens(usage_data))
+        return {
+            'html': clean_fragment(message_text(response), section),
+            'usage': usage_data,
+            'elapsed': round(time.time() - started, 2)
+        }
+
+    try:
+        start_time = time.time()
+        yield start_event(started, {
+            "message": "Stream starting",
+            "session_id": session_id,
+            "input": extraction_report,
+            "sections": [{key: section[key] for key in ('index', 'id', 'label', 'tokens', 'budget')} for section in sections],
+            "omitted_sections": sections_report['omitted_sections'],
+            "concurrency": min(SECTION_CONCURRENCY, len(sections))
+        })
+
+        fragments = {}
+        failed_sections = 0
+        usage_data = dict.fromkeys(USAGE_FIELDS, 0)
+        for result in run_sections(sections, generate):
+            if result is None:
+                yield format_stream_event("keepalive", {
+                    "timestamp": time.time(),
+                    "session_id": session_id,
+                    "completed_sections": len(fragments)
+                })
+                continue
+
+            section, fragment, error = result
+            if error is not None:
+                # A failed section becomes a notice in the page instead of failing the whole run
+                app.logger.error(f"Section {section['index'] + 1} of session {session_id} failed: {str(error)}")
+                failed_sections += 1
+                fragments[section['index']] = failed_fragment(section, error)
+                yield format_stream_event("content", {
+                    "type": "section_error",
+                    "index": section['index'],
+                    "id": section['id'],
+                    "label": section['label'],
+                    "error": str(error),
+                    "session_id": session_id
+                })
+                continue
+
+            fragments[section['index']] = fragment['html']
+            if fragment['usage'] is not None:
+                for name in USAGE_FIELDS:
+                    usage_data[name] += fragment['usage'][name]
+            yield format_stream_event("content", {
+                "type": "section_complete",
+                "index": section['index'],
+                "id": section['id'],
+                "label": section['label'],
+                "html": fragment['html'],
+                "usage": fragment['usage'],
+                "elapsed": fragment['elapsed'],
+                "completed_sections": len(fragments),
+                "total_sections": len(sections),
+                "session_id": session_id
+            })
+
+        if failed_sections == len(sections):
+            yield format_stream_event("error", {
+                "type": "error",
+                "error": "None of the sections could be generated.",
+                "session_id": session_id
+            })
+            return
+
+        usage_data["total_cost"] = usage_cost(usage_data)
+        usage_data["time_elapsed"] = round(time.time() - start_time, 2)
+        yield format_stream_event("content", {
+            "type": "message_complete",
+            "message_id": str(uuid.uuid4()),
+            "usage": usage_data,
+            "html": stitch_page(title, sections, fragments),
+            "session_id": session_id,
+            "section_count": len(sections),
+            "failed_sections": failed_sections
+        })
+        yield format_stream_event("stream_end", {"message": "Stream complete", "session_id": session_id})
+    except Exception as e:
+        app.logger.error(f"Unexpected error in sectioned stream: {str(e)}")
+        app.logger.error(traceback.format_exc())
+        yield format_stream_event("error", {
+            "type": "error",
+            "error": str(e),
+            "details": traceback.format_exc(),
+            "session_id": session_id
+        })
+
 
 
 @app.route('/api/process-stream', methods=['POST'])
@@ -805,58 +1335,102 @@ def process_stream():
     if not content:
         content = data.get('source', '')  # Fallback to 'source' if 'content' is empty
     
-    # Handle file content if provided
-    if file_name and file_content:
+    format_prompt = data.get('format_prompt', '')
+    model = data.get('model', 'claude-3-7-sonnet-20250219')  # Updated to Claude 3.7
+    max_tokens = int(data.get('max_tokens', DEFAULT_MAX_TOKENS))
+    temperature = float(data.get('temperature', 0.5))
+    thinking_budget = int(data.get('thinking_budget', DEFAULT_THINKING_BUDGET))
+    
+    # Sectioned mode splits the input along its outline and generates the sections in parallel,
+    # so it takes up to MAX_SECTIONS sections instead of what fits a single request
+    sectioned = bool(data.get('sectioned', False))
+    
+    # Tokens of user content that fit next to the system prompt, the requested output and thinking
+    if sectioned:
+        content_token_budget = SECTION_TOKENS * MAX_SECTIONS
+    else:
+        content_token_budget = request_content_budget(model, max_tokens, format_prompt, thinking_budget)
+    extraction_report = None
+    
+    # With "presummarize", content over the budget is condensed by a small model instead of cut,
+    # so up to PRESUMMARIZE_MAX_INPUT_TOKENS are extracted and the budget is applied afterwards
+    presummarize = bool(data.get('presummarize', PRESUMMARIZE_BY_DEFAULT))
+    generation_budget = content_token_budget
+    if presummarize:
+        content_token_budget = max(content_token_budget, PRESUMMARIZE_MAX_INPUT_TOKENS)
+    
+    # Content over the budget keeps its beginning, or with 'spread' its beginning, end and a sample of the middle
+    try:
+        packing = request_packing_strategy(data)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    # Optionally collapse near-duplicate paragraphs (quoted replies, repeated blocks) before budgeting
+    dedupe_content = bool(data.get('dedupe', DEDUPE_BY_DEFAULT))
+    document = None
+    file_ext = None
+    structure_format = None
+    
+    # Embedded images of PDF/DOCX uploads are attached as image blocks, within a per-request byte cap.
+    # Sections are text only, as an image cannot be assigned to the section it belongs to
+    include_images = bool(data.get('include_images', INCLUDE_IMAGES_BY_DEFAULT)) and not sectioned
+    images = []
+    image_report = None
+    
+    # Start from an earlier /api/analyze-tokens result when the request refers to one
+    analysis = open_request_analysis(data)
+    if analysis is not None:
+        file_name = analysis['file_name']
+        file_ext = analysis['file_type']
+        document = analysis['document']
+        content = document['text']
+        print(f"Reusing analysis {analysis['analysis_id']} of {file_name} ({len(content)} characters)")
+        
+        if include_images and file_ext in IMAGE_SOURCE_EXTENSIONS:
+            images, image_report = analysis_images(analysis)
+            if image_report:
+                content_token_budget -= image_report['estimated_tokens']
+        
+        structure_format = STRUCTURED_EXTENSIONS.get(file_ext)
+        if not (dedupe_content or structure_format):
+            extraction_report = fit_document_to_budget(document, content_token_budget, packing)
+            content = extraction_report.pop('text')
+    
+    # Handle file content if provided, either inline or as an upload_id from /upload
+    elif data.get('upload_id') or (file_name and file_content):
         try:
-            # Extract file extension
-            file_ext = file_name.split('.')[-1].lower() if '.' in file_name else 'txt'
-            print(f"Processing uploaded file: {file_name} with extension {file_ext}")
-            
-            # Create a temporary file
-            temp_file_path = f"/tmp/{file_name}"
-            
-            # For binary files (PDF, DOCX, etc.), decode base64
-            try:
-                file_content_bytes = base64.b64decode(file_content)
-                print(f"Successfully decoded base64 content, size: {len(file_content_bytes)} bytes")
-            except Exception as decode_error:
-                print(f"Error decoding base64 content: {str(decode_error)}")
-                # Try to fix padding if that's the issue
-                padded_content = file_content + '=' * (4 - len(file_content) % 4) if len(file_content) % 4 != 0 else file_content
-                file_content_bytes = base64.b64decode(padded_content)
-                print(f"Successfully decoded base64 content after padding fix, size: {len(file_content_bytes)} bytes")
-            
-            with open(temp_file_path, 'wb') as f:
-                f.write(file_content_bytes)
-            print(f"Wrote temporary file to {temp_file_path}")
+            # Look up the stored upload or decode base64 in memory (padding is fixed if needed)
+            file_name, upload = open_request_upload(data)
             
-            # Process the file based on type
-            if file_ext == 'pdf':
-                # Process PDF
-                print(f"Processing PDF file")
-                reader = PyPDF2.PdfReader(temp_file_path)
-                text_content = ""
-                for page_num in range(len(reader.pages)):
-                    text_content += reader.pages[page_num].extract_text() + "\n"
-                content = text_content
-                print(f"Extracted {len(content)} characters from PDF")
+            with upload:
+                print(f"Successfully decoded upload, size: {upload.size} bytes (memory mapped: {upload.is_mapped})")
                 
-            elif file_ext in ['docx', 'doc']:
-                # Process Word document
-                print(f"Processing Word document")
-                doc = docx.Document(temp_file_path)
-                content = "\n".join([paragraph.text for paragraph in doc.paragraphs])
-                print(f"Extracted {len(content)} characters from Word document")
+                # Pick the extractor from the content, not the extension
+                file_ext = upload_file_type(file_name, upload)
+                print(f"Processing uploaded file: {file_name} as {file_ext}")
                 
-            else:
-                # For text-based files, assume it's already decoded properly
-                print(f"Processing text-based file")
-                with open(temp_file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
-                print(f"Read {len(content)} characters from text file")
+                if include_images and file_ext in IMAGE_SOURCE_EXTENSIONS:
+                    # Images take their share of the input budget before the text is cut
+                    images, image_report = extract_request_images(upload, file_ext)
+                    if image_report:
+                        content_token_budget -= image_report['estimated_tokens']
+                
+                structure_format = STRUCTURED_EXTENSIONS.get(file_ext)
+                if dedupe_content or structure_format:
+                    # Deduplication and structural digests need the whole document, so extract all of it (cached)
+                    document = extract_document_cached(upload.buffer, file_ext)
+                    content = document['text']
+                else:
+                    # Parse pages/paragraphs lazily and stop once the token budget is reached
+                    extraction_report = extract_document_within_budget(upload.buffer, file_ext, content_token_budget, packing)
+                    content = extraction_report.pop('text')
                 
             print(f"Successfully processed uploaded file: {file_name}, extracted {len(content)} characters")
             
+        except UnsupportedContentError as e:
+            return unsupported_content_response(e)
+        except ExtractionError as e:
+            return extraction_error_response(e)
         except Exception as e:
             error_msg = f"Error processing file upload: {str(e)}"
             print(error_msg)
@@ -868,11 +1442,26 @@ def process_stream():
     if not content:
         return jsonify({"success": False, "error": "Source code or text is required"}), 400
     
-    format_prompt = data.get('format_prompt', '')
-    model = data.get('model', 'claude-3-7-sonnet-20250219')  # Updated to Claude 3.7
-    max_tokens = int(data.get('max_tokens', DEFAULT_MAX_TOKENS))
-    temperature = float(data.get('temperature', 0.5))
-    thinking_budget = int(data.get('thinking_budget', DEFAULT_THINKING_BUDGET))
+    if presummarize:
+        # The whole document was extracted for the pre-pass; from here on the generation budget applies
+        content_token_budget = generation_budget - (image_report['estimated_tokens'] if image_report else 0)
+    
+    # JSON/NDJSON/YAML that does not fit is replaced by a structural digest instead of being cut mid-object
+    structure_report = None
+    if extraction_report is None and estimate_tokens(content) > content_token_budget:
+        structure_format = structure_format or sniff_structured_format(content)
+        if structure_format:
+            structure_report = summarize_structured_text(content, structure_format, content_token_budget)
+        if structure_report is not None:
+            content = structure_report.pop('text')
+            print(f"Summarized {structure_report['records']} {structure_format} records into a structural digest "
+                  f"of ~{structure_report['estimated_tokens']} tokens")
+    
+    dedup_report = None
+    if dedupe_content and structure_report is None:
+        content, dedup_report = dedupe_paragraphs(content)
+        print(f"Collapsed {dedup_report['duplicates_removed']} near-duplicate paragraphs, "
+              f"saving ~{dedup_report['estimated_tokens_saved']} tokens")
     
     # Reconnection support
     session_id = data.get('session_id', str(uuid.uuid4()))
@@ -902,45 +1491,125 @@ def process_stream():
             "error": f"API key validation failed: {str(e)}"
         })
     
-    # Initialize session cache for this request
-    session_cache[session_id] = {
-        'created_at': time.time(),
-        'last_updated': time.time(),
-        'html_segments': [],
-        'generated_text': '',
-        'chunk_count': 0,
-        'user_content': content[:100000],  # Store for potential reconnection
-        'format_prompt': format_prompt,
-        'model': model,
-        'max_tokens': max_tokens,
-        'temperature': temperature
-    }
-    
-    # Prepare system prompt
-    system_prompt = "I will provide you with a file or a content, analyze its content, and transform it into a visually appealing and well-structured webpage.### Content Requirements* Maintain the core information from the original file while presenting it in a clearer and more visually engaging format.⠀Design Style* Follow a modern and minimalistic design inspired by Linear App.* Use a clear visual hierarchy to emphasize important content.* Adopt a professional and harmonious color scheme that is easy on the eyes for extended reading.⠀Technical Specifications* Use HTML5, TailwindCSS 3.0+ (via CDN), and necessary JavaScript.* Implement a fully functional dark/light mode toggle, defaulting to the system setting.* Ensure clean, well-structured code with appropriate comments for easy understanding and maintenance.⠀Responsive Design* The page must be fully responsive, adapting seamlessly to mobile, tablet, and desktop screens.* Optimize layout and typography for different screen sizes.* Ensure a smooth and intuitive touch experience on mobile devices.⠀Icons & Visual Elements* Use professional icon libraries like Font Awesome or Material Icons (via CDN).* Integrate illustrations or charts that best represent the content.* Avoid using emojis as primary icons.* Check if any icons cannot be loaded.⠀User Interaction & ExperienceEnhance the user experience with subtle micro-interactions:* Buttons should have slight enlargement and color transitions on hover.* Cards should feature soft shadows and border effects on hover.* Implement smooth scrolling effects throughout the page.* Content blocks should have an elegant fade-in animation on load.⠀Performance Optimization* Ensure fast page loading by avoiding large, unnecessary resources.* Use modern image formats (WebP) with proper compression.* Implement lazy loading for content-heavy pages.* For large outputs, make sure the HTML can be incrementally rendered and uses efficient DOM structures.⠀Output Requirements* Deliver a fully functional standalone HTML file, including all necessary CSS and JavaScript.* Ensure the code meets W3C standards with no errors or warnings.* Maintain consistent design and functionality across different browsers.* Your output is only one HTML file, do not present any other notes on the HTML. Also, try your best to visualize the whole content.⠀Create the most effective and visually appealing webpage based on the uploaded file's content type (document, data, images, etc.)."
-    
-    # Enhanced system prompt for large content handling
-    if len(content) > 50000:  # If content is large
-        system_prompt += "\n\nIMPORTANT: This is a large document. To ensure the generated HTML can be efficiently processed and rendered by browsers, please follow these additional guidelines:\n1. Implement progressive rendering techniques\n2. Minimize deep DOM nesting - keep DOM depth under 20 levels\n3. Use document fragments and lazy loading where appropriate\n4. Break large content into smaller sections using pagination or tabs\n5. Break large tables into smaller sections with pagination\n6. Use efficient CSS selectors (avoid descendant selectors when possible)\n7. Minimize JavaScript interactions and DOM manipulations\n8. Avoid complex CSS animations and transitions\n9. Use lightweight, optimized SVG instead of heavy images\n10. Implement lazy-loaded images with low-resolution placeholders\n11. Break long sections of text into separate elements with reasonable length"
-
-    # If the content is extremely large, add even more constraints
-    if len(content) > 100000:
-        system_prompt += "\nEXTREMELY LARGE CONTENT DETECTED: Break the content into multiple pages and implement a navigation system. Do not use complex or heavy JavaScript frameworks. Keep CSS minimal and efficient."
-    
-    # Prepare user prompt - limit content size to avoid timeouts
-    content_limit = min(len(content), 100000)  # Limit to 100k characters
-    user_content = f"""
-    {format_prompt}
+    # Set by prepare_generation once the input is final, and read by stream_generator
+    budget_plan = None
+    system_prompt = system_prompt_tokens = user_content = None
+    stream_started = False
     
-    Here is the content to transform into a website:
+    def prepare_generation(content, summary_report):
+        """
+        Cut the final content to the budget, plan the output and build the prompts. Returns the
+        generator of the generation events: the sectioned stream or stream_generator.
+        """
+        nonlocal extraction_report, max_tokens, thinking_budget, budget_plan, system_prompt, system_prompt_tokens, user_content
+        
+        # Enforce the same token budget on pasted (or deduplicated, or condensed) content
+        if extraction_report is None:
+            extraction_report = pack_units(iter_text_units(content), content_token_budget, packing)
+            content = extraction_report.pop('text')
+            if document is not None:
+                extraction_report.update(cache_hit=document.get('cache_hit'), boilerplate=document.get('boilerplate'))
+        extraction_report['dedup'] = dedup_report
+        extraction_report['structure'] = structure_report
+        extraction_report['images'] = image_report
+        extraction_report['summary'] = summary_report
+        if extraction_report['truncated']:
+            print(f"Input exceeds the token budget of {content_token_budget}: "
+                  f"omitted {extraction_report['omitted_units']} of {extraction_report['total_units']} {extraction_report['unit_kind']}s")
+        
+        if sectioned:
+            sections_report = split_sections(content)
+            # Every section is planned from its own input, within the section output cap
+            section_type = content_category(file_ext, structure_report is not None)
+            for section in sections_report['sections']:
+                section['budget'] = plan_request_budget(data, model, section_type, section['tokens'],
+                                                        min(max_tokens, SECTION_MAX_TOKENS), thinking_budget)
+            print(f"Generating {len(sections_report['sections'])} sections of ~{SECTION_TOKENS} tokens at most, "
+                  f"{SECTION_CONCURRENCY} at a time")
+            return sectioned_stream_generator(client, model, temperature, format_prompt, sections_report,
+                                              extraction_report, file_name, session_id, started=stream_started)
+        
+        # Output and thinking budgets follow the packed input, its type and the caller's latency target
+        input_tokens = extraction_report['estimated_tokens'] + (image_report['estimated_tokens'] if image_report else 0)
+        budget_plan = plan_request_budget(data, model, content_category(file_ext, structure_report is not None),
+                                          input_tokens, max_tokens, thinking_budget)
+        max_tokens = budget_plan['max_tokens']
+        thinking_budget = budget_plan['thinking_budget']
+        
+        # Initialize session cache for this request
+        session_cache[session_id] = {
+            'created_at': time.time(),
+            'last_updated': time.time(),
+            'html_segments': [],
+            'generated_text': '',
+            'chunk_count': 0,
+            'user_content': content,  # Store for potential reconnection
+            'format_prompt': format_prompt,
+            'model': model,
+            'max_tokens': max_tokens,
+            'temperature': temperature
+        }
+        
+        # Prepare the prompts; the system prompt gets the large-content guidelines for large inputs
+        system_prompt, system_prompt_tokens = prompt_registry.system_prompt(
+            large=len(content) > LARGE_CONTENT_CHARS,
+            extremely_large=len(content) > EXTREMELY_LARGE_CONTENT_CHARS or extraction_report['truncated'])
+        
+        # Content has already been cut to the token budget
+        user_content = render_prompt('webpage_user', format_prompt=format_prompt, content=content)
+        return stream_generator()
     
-    {content[:content_limit]}
-    """
+    def presummarized_stream(content):
+        """
+        Condense content over the budget chunk by chunk, then summary by summary, before generating.
+        stream_start goes out first and every chunk summary sends a progress event, so the client
+        sees the pre-pass working; summaries of unchanged chunks come from the summary cache.
+        If the pre-pass fails the content is cut to the budget as usual.
+        """
+        nonlocal extraction_report, stream_started
+        yield format_stream_event("stream_start", {
+            "message": "Stream starting",
+            "session_id": session_id,
+            "phase": "summarizing",
+            "summary": {"model": SUMMARY_MODEL, "input_tokens": estimate_tokens(content), "token_budget": content_token_budget}
+        })
+        stream_started = True
+        
+        summary_report = None
+        try:
+            summarizing = presummarize_text(client, content, content_token_budget)
+            while True:
+                try:
+                    progress = next(summarizing)
+                except StopIteration as done:
+                    content, summary_report = done.value
+                    break
+                if progress is None:
+                    yield format_stream_event("keepalive", {"timestamp": time.time(), "session_id": session_id})
+                else:
+                    yield format_stream_event("content", dict(progress, type="summary_progress", session_id=session_id))
+            if extraction_report is not None:
+                # Pack the condensed text; the report of the original extraction is kept with the summary
+                summary_report['source'] = extraction_report
+                extraction_report = None
+            print(f"Condensed ~{summary_report['original_tokens']} tokens to ~{summary_report['estimated_tokens']} "
+                  f"in {len(summary_report['levels'])} level(s) with {summary_report['model']}")
+        except Exception as e:
+            print(f"Pre-summarization failed, cutting the content to the budget instead: {str(e)}")
+            summary_report = {'error': str(e)}
+            extraction_report = None
+        
+        yield from prepare_generation(content, summary_report)
     
     # Define a streaming response generator with specific Claude 3.7 implementation
     def stream_generator():
         try:
-            yield format_stream_event("stream_start", {"message": "Stream starting", "session_id": session_id})
+            yield start_event(stream_started, {
+                "message": "Stream starting",
+                "session_id": session_id,
+                "input": extraction_report,
+                "budget": budget_plan
+            })
             
             # Add retry logic with exponential backoff
             max_retries = MAX_RETRIES
@@ -950,12 +1619,12 @@ def process_stream():
             while retry_count <= max_retries:
                 try:
                     # Use the Claude 3.7 specific implementation with beta parameter
-                    with client.beta.messages.stream(
-                        model="claude-3-7-sonnet-20250219",
-                        max_tokens=max_tokens,
-                        temperature=temperature,
-                        system=system_prompt,
-                        messages=[
+                    stream_params = {
+                        "model": "claude-3-7-sonnet-20250219",
+                        "max_tokens": max_tokens,
+                        "temperature": temperature,
+                        "system": cacheable_system(system_prompt, "claude-3-7-sonnet-20250219"),
+                        "messages": [
                             {
                                 "role": "user",
                                 "content": [
@@ -963,15 +1632,18 @@ def process_stream():
                                         "type": "text",
                                         "text": user_content
                                     }
-                                ]
+                                ] + claude_image_blocks(images)
                             }
                         ],
-                        thinking={
+                        "betas": [OUTPUT_128K_BETA],  # Using betas parameter instead of headers
+                    }
+                    # The planner turns thinking off (0) when the budget has no room for it
+                    if thinking_budget > 0:
+                        stream_params["thinking"] = {
                             "type": "enabled",
                             "budget_tokens": thinking_budget
-                        },
-                        betas=[OUTPUT_128K_BETA],  # Using betas parameter instead of headers
-                    ) as stream:
+                        }
+                    with client.beta.messages.stream(**stream_params) as stream:
                         message_id = str(uuid.uuid4())
                         generated_text = ""
                         start_time = time.time()
@@ -1221,18 +1893,25 @@ def process_stream():
             # Send message complete event with usage statistics when available
             try:
                 usage_data = None
-                if hasattr(stream, "usage"):
-                    usage_data = {
-                        "input_tokens": stream.usage.input_tokens if hasattr(stream.usage, "input_tokens") else 0,
-                        "output_tokens": stream.usage.output_tokens if hasattr(stream.usage, "output_tokens") else 0
-                    }
+                # The SDK stream keeps usage on the final message snapshot, the fallback client on the stream
+                usage = getattr(stream, "usage", None) or getattr(getattr(stream, "current_message_snapshot", None), "usage", None)
+                if usage is not None:
+                    # input_tokens excludes the prefix that was read from or written to the prompt cache
+                    usage_data = usage_counts(usage)
+                    usage_metrics.record(usage_data)
+                    budget_planner.observe(budget_plan, estimate_tokens(generated_text), usage_data["output_tokens"],
+                                           time.time() - start_time)
+                    
                     # Calculate cost according to Anthropic pricing
-                    usage_data["total_cost"] = (usage_data["input_tokens"] / 1000000 * 3.0) + (usage_data["output_tokens"] / 1000000 * 15.0)
+                    usage_data["total_cost"] = usage_cost(usage_data)
+                    
+                    # Calibrate the local estimator on text-only requests; image tokens are not modelled
+                    if not images:
+                        token_estimator.observe(system_prompt + user_content, total_input_tokens(usage_data))
                 else:
-                    # If usage is not available from stream, calculate manually
-                    system_prompt_tokens = len(system_prompt) // 3
-                    content_tokens = len(user_content) // 4
-                    output_tokens = len(generated_text) // 4
+                    # If usage is not available from stream, estimate it locally
+                    content_tokens = estimate_tokens(user_content)
+                    output_tokens = estimate_tokens(generated_text)
                     
                     usage_data = {
                         "input_tokens": system_prompt_tokens + content_tokens,
@@ -1385,8 +2064,14 @@ def process_stream():
             
             yield from stream_generator()
     
+    # Content still over the budget is condensed by a small model once the stream has started
+    if presummarize and structure_report is None and estimate_tokens(content) > content_token_budget:
+        events = presummarized_stream(content)
+    else:
+        events = prepare_generation(content, None)
+    
     # Return streaming response
-    response = Response(stream_with_context(stream_generator()), 
+    response = Response(stream_with_context(events), 
                          content_type='text/event-stream')
     response.headers['X-Accel-Buffering'] = 'no'  # Disable nginx buffering
     response.headers['Cache-Control'] = 'no-cache, no-transform'
@@ -1399,6 +2084,11 @@ def process_stream():
 @app.before_request
 def cleanup_session_cache():
     current_time = time.time()
+    
+    # Drop uploads that have outlived their TTL
+    expired_uploads = upload_store.cleanup_expired() + chunked_upload_store.cleanup_expired()
+    if expired_uploads:
+        app.logger.info(f"Removed {expired_uploads} expired uploads from the upload store")
     expired_sessions = []
     
     for session_id, session_data in session_cache.items():
@@ -1466,10 +2156,10 @@ def test_generate():
             }), 400
         
         # Brief system prompt to minimize token usage
-        system_prompt = "Generate minimal HTML to confirm the API integration works."
+        system_prompt = render_prompt('api_test_system')
         
         # Minimal user prompt
-        user_content = f"Generate a very simple HTML page that confirms the API works. The content is: {truncated_content}"
+        user_content = render_prompt('api_test_user', content=truncated_content)
         
         # Record start time
         start_time = time.time()
@@ -1533,9 +2223,9 @@ def test_generate():
         # If successful, return the generated HTML
         if success and html_output:
             # Calculate token usage (estimates)
-            system_prompt_tokens = len(system_prompt) // 3
-            content_tokens = len(truncated_content) // 4
-            output_tokens = len(html_output) // 4
+            system_prompt_tokens = prompt_registry.tokens('api_test_system')
+            content_tokens = estimate_tokens(truncated_content)
+            output_tokens = estimate_tokens(html_output)
             
             # Return response with HTML and token usage statistics
             return jsonify({
@@ -1626,11 +2316,6 @@ def gemini_task(api_key, content, format_prompt, max_tokens, temperature,new_gui
         # Use our helper function to create a Gemini client
         client = create_gemini_client(api_key)
 
-        # Prepare user message with content and additional prompt
-        user_content = content
-        if format_prompt:
-            user_content = f"{user_content}\n\n{format_prompt}"
-
         print("Creating Gemini model...")
 
         # Get the model
@@ -1661,13 +2346,9 @@ def gemini_task(api_key, content, format_prompt, max_tokens, temperature,new_gui
         }
 
         # Create the prompt
-        prompt = f"""
-{SYSTEM_INSTRUCTION}
-
-Here is the content to transform into a website:
-
-{user_content}
-"""
+        prompt = render_prompt('gemini_webpage',
+                               system=prompt_registry.system_prompt(version=LEGACY_SYSTEM_PROMPT_VERSION)[0],
+                               content=content, format_prompt=format_prompt)
         # Generate content
         print(f"Generating content with {GEMINI_MODEL}, max_tokens={max_tokens}, temperature={temperature}")
 
@@ -1763,11 +2444,8 @@ Here is the content to transform into a website:
 """
 
         # Get usage stats (approximate since Gemini doesn't provide exact token counts)
-        input_tokens = len(prompt.split()) * 1.3  # Rough estimate: ~1.3 tokens per word
-        output_tokens = len(html_content.split()) * 1.3
-
-        # Ensure we don't have zero tokens (minimum of source length / 3)
-        input_tokens = max(len(content.split()) * 1.3, input_tokens)
+        input_tokens = token_estimator.estimate_request(prompt)
+        output_tokens = estimate_tokens(html_content)
 
         # Round to integers
         input_tokens = max(1, int(input_tokens))
@@ -1872,12 +2550,22 @@ def process_gemini():
     max_tokens = int(data.get('max_tokens', GEMINI_MAX_OUTPUT_TOKENS))
     temperature = float(data.get('temperature', GEMINI_TEMPERATURE))
 
-    print(f"Processing Gemini request with max_tokens={max_tokens}, content_length={len(content) if content else 0}")
+    # Prefer the text extracted by /api/analyze-tokens over the raw file content
+    analysis = open_request_analysis(data)
+    if analysis is not None:
+        content = analysis['document']['text']
 
     # Check if we have the required data
     if not api_key or not content:
         return jsonify({'error': 'API key and content are required'}), 400
 
+    # The output budget follows the input size and the caller's latency target
+    budget_plan = plan_request_budget(data, GEMINI_MODEL, content_category(analysis['file_type'] if analysis else None),
+                                      estimate_tokens(content), max_tokens, 0)
+    max_tokens = budget_plan['max_tokens']
+
+    print(f"Processing Gemini request with max_tokens={max_tokens}, content_length={len(content)}")
+
     # Check if Gemini is available
     if not GEMINI_AVAILABLE:
         return jsonify({
@@ -1895,7 +2583,7 @@ def process_gemini():
     #task_thread.join()
 
     # Return a response indicating the task has started
-    return jsonify({"status": "Task started","uuid":new_guid}), 202
+    return jsonify({"status": "Task started","uuid":new_guid, "budget": budget_plan}), 202
 
 
 # # Add a new route for Gemini API processing
@@ -1951,13 +2639,64 @@ def process_gemini_stream():
     if not content:
         content = data.get('source', '')  # Fallback to 'source' if 'content' is empty
     
+    format_prompt = data.get('format_prompt', '')
+    max_tokens = int(data.get('max_tokens', GEMINI_MAX_OUTPUT_TOKENS))
+    temperature = float(data.get('temperature', GEMINI_TEMPERATURE))
+    
+    # The content is packed into the model's input budget rather than cut at a fixed length
+    content_token_budget = request_content_budget(GEMINI_MODEL, max_tokens, format_prompt)
+    try:
+        packing = request_packing_strategy(data)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    extraction_report = None
+    
+    # Uploaded PDF/DOCX documents are extracted here too, and their embedded images become inline parts.
+    # Other inline files arrive as text in 'content' already
+    images = []
+    image_report = None
+    inline_ext = data.get('file_name', '').split('.')[-1].lower()
+    file_ext = None
+    analysis = open_request_analysis(data)
+    if analysis is not None:
+        file_ext = analysis['file_type']
+        if data.get('include_images', INCLUDE_IMAGES_BY_DEFAULT) and analysis['file_type'] in IMAGE_SOURCE_EXTENSIONS:
+            images, image_report = analysis_images(analysis)
+            if image_report:
+                content_token_budget -= image_report['estimated_tokens']
+        extraction_report = fit_document_to_budget(analysis['document'], content_token_budget, packing)
+    elif data.get('upload_id') or (data.get('file_content') and inline_ext in ['pdf', 'docx', 'doc']):
+        try:
+            file_name, upload = open_request_upload(data)
+            with upload:
+                file_ext = upload_file_type(file_name, upload)
+                if data.get('include_images', INCLUDE_IMAGES_BY_DEFAULT) and file_ext in IMAGE_SOURCE_EXTENSIONS:
+                    images, image_report = extract_request_images(upload, file_ext)
+                    if image_report:
+                        content_token_budget -= image_report['estimated_tokens']
+                extraction_report = extract_document_within_budget(upload.buffer, file_ext, content_token_budget, packing)
+        except UnsupportedContentError as e:
+            return unsupported_content_response(e)
+        except ExtractionError as e:
+            return extraction_error_response(e)
+        except Exception as e:
+            error_msg = f"Error processing file upload: {str(e)}"
+            print(error_msg)
+            return jsonify({"success": False, "error": error_msg}), 400
+    
+    if extraction_report is None:
+        extraction_report = pack_units(iter_text_units(content), content_token_budget, packing)
+    content = extraction_report.pop('text')
+    extraction_report['images'] = image_report
+    
     # If content is empty, return an error
     if not content:
         return jsonify({"success": False, "error": "Source code or text is required"}), 400
     
-    format_prompt = data.get('format_prompt', '')
-    max_tokens = int(data.get('max_tokens', GEMINI_MAX_OUTPUT_TOKENS))
-    temperature = float(data.get('temperature', GEMINI_TEMPERATURE))
+    # Gemini has no thinking budget to plan; the output budget follows the input and the latency target
+    budget_plan = plan_request_budget(data, GEMINI_MODEL, content_category(file_ext), extraction_report['estimated_tokens'],
+                                      max_tokens, 0)
+    max_tokens = budget_plan['max_tokens']
     
     # Reconnection support
     session_id = data.get('session_id', str(uuid.uuid4()))
@@ -1984,7 +2723,7 @@ def process_gemini_stream():
         'html_segments': [],
         'generated_text': '',
         'chunk_count': 0,
-        'user_content': content[:100000],  # Store for potential reconnection
+        'user_content': content,  # Store for potential reconnection
         'format_prompt': format_prompt,
         'model': GEMINI_MODEL,
         'max_tokens': max_tokens,
@@ -1992,21 +2731,19 @@ def process_gemini_stream():
     }
     
     # Prepare prompt
-    prompt = f"""
-{SYSTEM_INSTRUCTION}
-
-Here is the content to transform into a website:
-
-{content[:100000]}
-"""
-    
-    if format_prompt:
-        prompt += f"\n\n{format_prompt}"
+    prompt = render_prompt('gemini_webpage',
+                           system=prompt_registry.system_prompt(version=LEGACY_SYSTEM_PROMPT_VERSION)[0],
+                           content=content, format_prompt=format_prompt)
     
     # Define the streaming response generator
     def gemini_stream_generator():
         try:
-            yield format_stream_event("stream_start", {"message": "Stream starting", "session_id": session_id})
+            yield format_stream_event("stream_start", {
+                "message": "Stream starting",
+                "session_id": session_id,
+                "input": extraction_report,
+                "budget": budget_plan
+            })
             
             # Get the model
             model = client.get_model(GEMINI_MODEL)
@@ -2034,7 +2771,7 @@ Here is the content to transform into a website:
                 
                 # Generate content with the specified configurations
                 stream_response = model.generate_content(
-                    prompt,
+                    [prompt] + gemini_image_parts(images) if images else prompt,
                     generation_config=generation_config,
                     safety_settings=safety_settings,
                     stream=True
@@ -2088,6 +2825,18 @@ Here is the content to transform into a website:
         content_type='text/event-stream'
     )
 
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Return token usage and prompt-cache totals of the Claude requests served since startup."""
+    return jsonify({
+        'usage': usage_metrics.snapshot(),
+        'prompts': prompt_registry.manifest(),
+        'token_estimator': token_estimator.stats(),
+        'budget_planner': budget_planner.stats(),
+        'summary_cache': summary_cache.stats(),
+        'image_cache': image_cache.stats()
+    })
+
 @app.route('/api/version', methods=['GET'])
 def get_version():
     """Return the application version information."""
@@ -2109,6 +2858,7 @@ if __name__ == "__main__":
     parser.add_argument("--host", type=str, default="0.0.0.0", help="Host to run the server on (default: 0.0.0.0)")
     parser.add_argument("--debug", action="store_true", help="Run in debug mode")
     parser.add_argument("--no-reload", action="store_true", help="Disable auto-reload")
+    parser.add_argument("--extraction-workers", type=int, default=None, help="Number of processes used for PDF extraction")
     
     # Parse arguments
     args = parser.parse_args()
@@ -2119,6 +2869,10 @@ if __name__ == "__main__":
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
     
+    # Size the number of extraction workers if requested
+    if args.extraction_workers:
+        configure_extraction_pool(args.extraction_workers)
+    
     # Configure longer timeouts to handle large content
     from werkzeug.serving import run_simple
     
@@ -102,6 +102,8 @@ let state = {
     apiKeyValidated: false,
     file: null,
     fileContent: '',
+    fileEncoding: null,
+    analysisId: null, // Server-side extraction of the current file from /api/analyze-tokens
     textContent: '',
     temperature: 1.0,
     maxTokens: 128000,
@@ -567,7 +569,9 @@ function switchTab(tab) {
         // Clear file data when switching to text tab
         state.file = null;
         state.fileContent = '';
+        state.fileEncoding = null;
         state.fileName = '';
+        state.analysisId = null;
         
         // Also clear the file upload UI
         if (elements.fileInfo) {
@@ -653,6 +657,7 @@ function handleFile(file) {
     console.log('Processing file:', file.name);
     state.file = file;
     state.fileName = file.name;
+    state.analysisId = null;
     
     if (!elements.fileInfo) {
         console.error('File info element not found');
@@ -712,6 +717,7 @@ function handleFile(file) {
                 
                 // Store the base64 string
                 state.fileContent = base64String;
+                state.fileEncoding = 'base64';
                 
                 // Send to server for analysis, including file type
                 fetch('/api/analyze-tokens', {
@@ -721,11 +727,13 @@ function handleFile(file) {
                     },
                     body: JSON.stringify({ 
                         content: base64String,
-                        file_type: 'pdf'
+                        file_type: 'pdf',
+                        max_tokens: state.maxTokens
                     })
                 })
                 .then(response => response.json())
                 .then(data => {
+                    state.analysisId = data.analysis_id || null;
                     if (elements.tokenInfo) {
                         if (data.error) {
                             elements.tokenInfo.innerHTML = `
@@ -741,6 +749,7 @@ function handleFile(file) {
                                     <p>Estimated Input Tokens: ${data.estimated_tokens.toLocaleString()}</p>
                                     <p>Estimated Input Cost: $${data.estimated_cost.toFixed(4)}</p>
                                     <p>Maximum Safe Input Tokens: 200,000</p>
+                                    ${describeTokenHistogram(data.token_histogram)}
                                 </div>
                             `;
                         }
@@ -785,8 +794,9 @@ function handleFile(file) {
             updateGenerateButtonState();
         };
         reader.readAsArrayBuffer(file);
-    } else if (fileExt === 'docx' || fileExt === 'doc') {
-        // For Word documents, we also need to use base64 and special handling
+    } else if (['docx', 'doc', 'csv', 'tsv', 'xlsx', 'zip'].includes(fileExt)) {
+        // For Word documents, tables and zip bundles, we also need to use base64 and special handling
+        // (tables are profiled on the server instead of being sent as raw rows)
         const reader = new FileReader();
         reader.onload = function(e) {
             console.log('Word document content loaded as array buffer');
@@ -802,6 +812,7 @@ function handleFile(file) {
                 
                 // Store the base64 string
                 state.fileContent = base64String;
+                state.fileEncoding = 'base64';
                 
                 // Request token analysis from server
                 fetch('/api/analyze-tokens', {
@@ -811,11 +822,13 @@ function handleFile(file) {
                     },
                     body: JSON.stringify({ 
                         content: base64String,
-                        file_type: fileExt
+                        file_type: fileExt,
+                        max_tokens: state.maxTokens
                     })
                 })
                 .then(response => response.json())
                 .then(data => {
+                    state.analysisId = data.analysis_id || null;
                     updateTokenInfoUI(data);
                     updateGenerateButtonState();
                 })
@@ -837,6 +850,7 @@ function handleFile(file) {
         reader.onload = function(e) {
             console.log('Text file content loaded');
             state.fileContent = e.target.result;
+            state.fileEncoding = 'text';
             updateGenerateButtonState();
             analyzeTokens(state.fileContent);
         };
@@ -847,7 +861,9 @@ function handleFile(file) {
 function removeFile() {
     state.file = null;
     state.fileContent = '';
+    state.fileEncoding = null;
     state.fileName = '';
+    state.analysisId = null;
     
     if (elements.fileInfo) {
         elements.fileInfo.classList.add('hidden');
@@ -1174,6 +1190,11 @@ async function generateGeminiHTMLStream(apiKey, source, formatPrompt, maxTokens,
             console.log(`Adding file upload info: ${state.fileName} (${formatFileSize(state.file.size)})`);
             requestBody.file_name = state.fileName;
             requestBody.file_content = state.fileContent;
+            requestBody.file_encoding = state.fileEncoding;
+            // Lets the server skip extraction; the file content is the fallback if the analysis expired
+            if (state.analysisId) {
+                requestBody.analysis_id = state.analysisId;
+            }
         }
         
         // Start the streaming request
@@ -1494,6 +1515,11 @@ async function generateGeminiHTML(apiKey, source, formatPrompt, maxTokens, tempe
         if (state.activeTab === 'file' && state.file) {
             requestBody.file_name = state.fileName;
             requestBody.file_content = state.fileContent;
+            requestBody.file_encoding = state.fileEncoding;
+            // Lets the server skip extraction; the file content is the fallback if the analysis expired
+            if (state.analysisId) {
+                requestBody.analysis_id = state.analysisId;
+            }
         }
         
         // Make the non-streaming request
@@ -1640,6 +1666,10 @@ async function generateHTMLStreamWithReconnection(apiKey, source, formatPrompt,
                 console.log(`Adding file upload info: ${state.fileName} (${formatFileSize(state.file.size)})`);
                 requestBody.file_name = state.fileName;
                 requestBody.file_content = state.fileContent; // Use stored file content directly
+                requestBody.file_encoding = state.fileEncoding;
+                if (state.analysisId) {
+                    requestBody.analysis_id = state.analysisId; // Skips extraction on the server
+                }
                 
                 // Ensure file content is included in the source parameter too for compatibility
                 if (!requestBody.source || requestBody.source.trim() === '') {
@@ -2738,7 +2768,8 @@ async function analyzeTokens(content) {
             },
             body: JSON.stringify({ 
                 content,
-                file_type: state.activeTab === 'file' && state.file ? state.file.name.split('.').pop().toLowerCase() : 'txt'
+                file_type: state.activeTab === 'file' && state.file ? state.file.name.split('.').pop().toLowerCase() : 'txt',
+                max_tokens: state.maxTokens
             })
         });
         
@@ -2747,6 +2778,11 @@ async function analyzeTokens(content) {
             throw new Error(data.error);
         }
         
+        // Only a file's extraction is worth reusing; pasted text is sent with the request anyway
+        if (state.activeTab === 'file' && state.file) {
+            state.analysisId = data.analysis_id || null;
+        }
+        
         // Update token info display based on API provider
         if (elements.tokenInfo) {
             if (state.apiProvider === 'gemini') {
@@ -2755,6 +2791,7 @@ async function analyzeTokens(content) {
                     <div class="token-analysis">
                         <h3>Token Analysis</h3>
                         <p>Estimated Input Tokens: ${data.estimated_tokens.toLocaleString()}</p>
+                        ${describeTokenHistogram(data.token_histogram)}
                     </div>
                 `;
             } else {
@@ -2765,6 +2802,7 @@ async function analyzeTokens(content) {
                         <p>Estimated Input Tokens: ${data.estimated_tokens.toLocaleString()}</p>
                         <p>Estimated Input Cost: $${data.estimated_cost.toFixed(4)}</p>
                         <p>Maximum Safe Input Tokens: 200,000</p>
+                        ${describeTokenHistogram(data.token_histogram)}
                     </div>
                 `;
             }
@@ -2877,11 +2915,27 @@ function updateTokenInfoUI(data) {
                 <p>Estimated Input Tokens: ${data.estimated_tokens.toLocaleString()}</p>
                 <p>Estimated Input Cost: $${data.estimated_cost.toFixed(4)}</p>
                 <p>Maximum Safe Input Tokens: 200,000</p>
+                ${describeTokenHistogram(data.token_histogram)}
             </div>
         `;
     }
 }
 
+// Summarize where the input budget runs out, from the per-page/section breakdown of /api/analyze-tokens
+function describeTokenHistogram(histogram) {
+    if (!histogram || !histogram.sections || histogram.sections.length === 0) {
+        return '';
+    }
+    const budget = histogram.token_budget.toLocaleString();
+    if (histogram.first_excluded === null) {
+        return `<p>All ${histogram.unit_count.toLocaleString()} ${histogram.unit_kind}s fit in the input budget of ${budget} tokens</p>`;
+    }
+    const cut = histogram.sections[histogram.first_excluded];
+    const omitted = histogram.total_tokens - histogram.token_budget;
+    return `<p>The input budget of ${budget} tokens runs out at ${escapeHtml(cut.label)}; ` +
+        `about ${omitted.toLocaleString()} tokens from there on will be left out</p>`;
+}
+
 // Helper function to show token analysis errors
 function showTokenAnalysisError(message) {
     if (!elements.tokenInfo) return;
@@ -3082,8 +3136,12 @@ function resetTokenStats() {
 // Update the UI with token usage data
 function updateTokenStats(usage) {
     if (!usage) return;
-    
-    elements.inputTokens.textContent = usage.input_tokens.toLocaleString();
+
+    // input_tokens leaves out the prefix that was read from or written to the prompt cache
+    const cacheRead = usage.cache_read_input_tokens || 0;
+    const cacheWrite = usage.cache_creation_input_tokens || 0;
+    elements.inputTokens.textContent = (usage.input_tokens + cacheRead + cacheWrite).toLocaleString();
+    elements.inputTokens.title = cacheRead ? `${cacheRead.toLocaleString()} read from the prompt cache` : '';
     elements.outputTokens.textContent = usage.output_tokens.toLocaleString();
     elements.totalCost.textContent = formatCostDisplay(usage.total_cost);
 }
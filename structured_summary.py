@@ -0,0 +1,367 @@
+# Structural digests of large JSON, NDJSON and YAML inputs
+import json
+import random
+import re
+
+from token_estimation import estimate_tokens
+
+# YAML support is optional
+try:
+    import yaml
+    YAML_AVAILABLE = True
+except ImportError:
+    YAML_AVAILABLE = False
+
+# File extensions summarized structurally, mapped to their format
+STRUCTURED_EXTENSIONS = {'json': 'json', 'ndjson': 'ndjson', 'jsonl': 'ndjson', 'yaml': 'yaml', 'yml': 'yaml'}
+
+# Characters inspected when sniffing pasted text
+SNIFF_PREFIX_CHARS = 4096
+
+# Representative elements kept per array path (reservoir sampled over all elements)
+SAMPLES_PER_ARRAY = 3
+
+# Sample records are shortened to this many characters of compact JSON
+SAMPLE_MAX_CHARS = 600
+
+# Distinct string values counted per path before counting stops growing
+MAX_TRACKED_VALUES = 1000
+
+# Most frequent string values listed per path
+TOP_VALUES = 5
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def sniff_structured_format(text):
+    """Return 'json' or 'ndjson' if text looks like JSON, otherwise None."""
+    prefix = text[:SNIFF_PREFIX_CHARS].lstrip('\ufeff \t\r\n')
+    if not prefix or prefix[0] not in '{[':
+        return None
+    first_line, newline, rest = prefix.partition('\n')
+    if prefix[0] == '{' and newline and rest.lstrip().startswith('{'):
+        try:
+            json.loads(first_line)
+            return 'ndjson'
+        except ValueError:
+            # A pretty-printed object spans several lines
+            pass
+    return 'json'
+
+
+def _type_name(value):
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, int):
+        return 'integer'
+    if isinstance(value, float):
+        return 'number'
+    if isinstance(value, str):
+        return 'string'
+    if isinstance(value, list):
+        return 'array'
+    if isinstance(value, dict):
+        return 'object'
+    return type(value).__name__
+
+
+def _child_path(path, key):
+    key = str(key)
+    return f"{path}.{key}" if _IDENTIFIER.match(key) else f"{path}[{json.dumps(key)}]"
+
+
+class StructureSummary:
+    """
+    Merged schema of a stream of JSON values. Every path ('$.items[].price') keeps its type
+    counts and value statistics, and every array path keeps a small reservoir of sample elements,
+    so memory depends on the shape of the data rather than its size.
+    """
+    def __init__(self):
+        self.paths = {}
+        self._random = random.Random(0)
+
+    def _stats(self, path, parent=None):
+        stats = self.paths.get(path)
+        if stats is None:
+            stats = {'count': 0, 'types': {}, 'parent': parent}
+            self.paths[path] = stats
+        return stats
+
+    def add(self, value, path='$', parent=None):
+        """Merge one value observed at path into the schema."""
+        stats = self._stats(path, parent)
+        stats['count'] += 1
+        type_name = _type_name(value)
+        stats['types'][type_name] = stats['types'].get(type_name, 0) + 1
+
+        if type_name == 'object':
+            for key, item in value.items():
+                self.add(item, _child_path(path, key), path)
+        elif type_name == 'array':
+            self._observe_length(stats, len(value))
+            for item in value:
+                self._add_element(path, item)
+        elif type_name in ('integer', 'number'):
+            stats['min'] = min(stats.get('min', value), value)
+            stats['max'] = max(stats.get('max', value), value)
+            stats['sum'] = stats.get('sum', 0) + value
+            stats['numeric'] = stats.get('numeric', 0) + 1
+        elif type_name == 'string':
+            self._observe_string(stats, value)
+
+    def add_elements(self, path, values):
+        """Merge the elements of an array that is parsed one element at a time."""
+        stats = self._stats(path)
+        stats['count'] += 1
+        stats['types']['array'] = stats['types'].get('array', 0) + 1
+        length = 0
+        for item in values:
+            self._add_element(path, item)
+            length += 1
+        self._observe_length(stats, length)
+        return length
+
+    def _add_element(self, array_path, item):
+        element_path = array_path + '[]'
+        self.add(item, element_path)
+        # Reservoir sampling keeps a uniform sample of every element seen at this path
+        stats = self.paths[element_path]
+        samples = stats.setdefault('samples', [])
+        if len(samples) < SAMPLES_PER_ARRAY:
+            samples.append(_format_sample(item))
+        else:
+            slot = self._random.randrange(stats['count'])
+            if slot < SAMPLES_PER_ARRAY:
+                samples[slot] = _format_sample(item)
+
+    def _observe_length(self, stats, length):
+        stats['min_length'] = min(stats.get('min_length', length), length)
+        stats['max_length'] = max(stats.get('max_length', length), length)
+
+    def _observe_string(self, stats, value):
+        stats['min_length'] = min(stats.get('min_length', len(value)), len(value))
+        stats['max_length'] = max(stats.get('max_length', len(value)), len(value))
+        values = stats.setdefault('values', {})
+        if value in values:
+            values[value] += 1
+        elif len(values) < MAX_TRACKED_VALUES:
+            values[value] = 1
+        else:
+            stats['values_capped'] = True
+
+
+def _format_sample(value):
+    sample = json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=str)
+    return sample if len(sample) <= SAMPLE_MAX_CHARS else sample[:SAMPLE_MAX_CHARS - 1] + "…"
+
+
+def _skip_whitespace(text, position):
+    return _WHITESPACE.match(text, position).end()
+
+
+class _ArrayElements:
+    """Iterate the elements of the JSON array at text[start] one at a time; end is set once exhausted."""
+    def __init__(self, text, start):
+        self.text = text
+        self.start = start
+        self.end = None
+
+    def __iter__(self):
+        text = self.text
+        position = _skip_whitespace(text, self.start + 1)
+        if text.startswith(']', position):
+            self.end = position + 1
+            return
+        while True:
+            value, position = _decoder.raw_decode(text, position)
+            yield value
+            position = _skip_whitespace(text, position)
+            if text.startswith(']', position):
+                self.end = position + 1
+                return
+            if not text.startswith(',', position):
+                raise ValueError(f"Expected ',' or ']' at character {position}")
+            position = _skip_whitespace(text, position + 1)
+
+
+def _add_json_document(summary, text):
+    """
+    Parse a JSON document incrementally and return the number of records it holds.
+    Top-level arrays, and arrays that are direct members of a top-level object (the usual
+    {"data": [...]} API dump), are decoded element by element instead of all at once.
+    """
+    position = _skip_whitespace(text, 1 if text.startswith('\ufeff') else 0)
+    if text.startswith('[', position):
+        return summary.add_elements('$', _ArrayElements(text, position))
+    if not text.startswith('{', position):
+        summary.add(_decoder.raw_decode(text, position)[0])
+        return 1
+
+    summary.add({})
+    records = 1
+    position = _skip_whitespace(text, position + 1)
+    while not text.startswith('}', position):
+        key, position = _decoder.raw_decode(text, position)
+        position = _skip_whitespace(text, position)
+        if not text.startswith(':', position):
+            raise ValueError(f"Expected ':' at character {position}")
+        position = _skip_whitespace(text, position + 1)
+        path = _child_path('$', key)
+        if text.startswith('[', position):
+            elements = _ArrayElements(text, position)
+            summary._stats(path, '$')
+            records = max(records, summary.add_elements(path, elements))
+            position = elements.end
+        else:
+            value, position = _decoder.raw_decode(text, position)
+            summary.add(value, path, '$')
+        position = _skip_whitespace(text, position)
+        if text.startswith(',', position):
+            position = _skip_whitespace(text, position + 1)
+        elif not text.startswith('}', position):
+            raise ValueError(f"Expected ',' or '}}' at character {position}")
+    return records
+
+
+def _iter_ndjson(text, report):
+    """Yield the records of newline-delimited JSON, counting lines that do not parse."""
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            report['invalid_lines'] += 1
+
+
+def _format_number(value):
+    return f"{value:,.6g}" if isinstance(value, float) else f"{value:,}"
+
+
+def _describe_path(path, stats, summary):
+    """Render one schema line: types, presence and value statistics of a path."""
+    total = stats['count']
+    types = sorted(stats['types'].items(), key=lambda item: -item[1])
+    if len(types) == 1:
+        description = types[0][0]
+    else:
+        description = " | ".join(f"{name} {count / total:.0%}" for name, count in types)
+    parts = [f"{path}: {description}"]
+
+    parent = summary.paths.get(stats['parent']) if stats['parent'] else None
+    if parent is not None:
+        objects = parent['types'].get('object', 0)
+        if objects and total < objects:
+            parts.append(f"present in {total / objects:.0%}")
+    elif path.endswith('[]'):
+        parts.append(f"{total:,} elements")
+
+    if 'array' in stats['types'] and 'min_length' in stats:
+        parts.append(f"length {stats['min_length']:,}-{stats['max_length']:,}")
+    if stats.get('numeric'):
+        parts.append(f"min {_format_number(stats['min'])}, max {_format_number(stats['max'])}, "
+                     f"mean {stats['sum'] / stats['numeric']:,.6g}")
+    if 'values' in stats:
+        values = stats['values']
+        distinct = f"{len(values):,}+" if stats.get('values_capped') else f"{len(values):,}"
+        parts.append(f"{distinct} distinct, length {stats['min_length']}-{stats['max_length']}")
+        # Only list top values when they repeat; unique ids and free text say nothing this way
+        top = sorted(values.items(), key=lambda item: -item[1])[:TOP_VALUES]
+        if top and top[0][1] > 1:
+            parts.append("top: " + ", ".join(f"{_format_sample(value)} ({count:,})" for value, count in top))
+    return "; ".join(parts)
+
+
+def format_digest(summary, input_format, char_count, records, token_budget):
+    """
+    Render a summary as a digest of at most token_budget estimated tokens: the schema first,
+    then sample elements of each array path while they fit. Returns (text, report).
+    """
+    header = (f"# Structure digest\n"
+              f"{input_format.upper()} input of {char_count:,} characters and {records:,} top-level records. "
+              f"It is too large to include verbatim, so this shows its merged schema with value statistics "
+              f"per path, followed by representative sample records.")
+    sections = [header]
+    used = estimate_tokens(header)
+
+    schema_lines = []
+    omitted_paths = 0
+    for path, stats in summary.paths.items():
+        line = _describe_path(path, stats, summary)
+        cost = estimate_tokens(line) + 1
+        if used + cost > token_budget:
+            omitted_paths += 1
+            continue
+        schema_lines.append(line)
+        used += cost
+    if omitted_paths:
+        schema_lines.append(f"({omitted_paths:,} more paths omitted to stay within the token budget)")
+    sections.append("## Schema\n" + "\n".join(schema_lines))
+
+    samples_shown = 0
+    for path, stats in summary.paths.items():
+        samples = stats.get('samples')
+        # Samples of scalar arrays add nothing to the statistics above
+        if not samples or not ({'object', 'array'} & stats['types'].keys()):
+            continue
+        block = f"## Samples of {path} ({len(samples)} of {stats['count']:,})\n" + "\n".join(samples)
+        cost = estimate_tokens(block) + 1
+        if used + cost > token_budget:
+            continue
+        sections.append(block)
+        samples_shown += len(samples)
+        used += cost
+
+    report = {
+        'format': input_format,
+        'records': records,
+        'paths': len(summary.paths),
+        'omitted_paths': omitted_paths,
+        'samples': samples_shown
+    }
+    return "\n\n".join(sections) + "\n", report
+
+
+def summarize_structured_text(text, input_format, token_budget):
+    """
+    Build a structural digest of JSON, NDJSON or YAML text sized to token_budget.
+    Returns a dict with the digest text and a report, or None if the text does not parse
+    (the caller then falls back to sending it as plain text).
+    """
+    summary = StructureSummary()
+    report = {'invalid_lines': 0}
+    try:
+        if input_format == 'ndjson':
+            records = summary.add_elements('$', _iter_ndjson(text, report))
+            if not records:
+                return None
+        elif input_format == 'yaml':
+            if not YAML_AVAILABLE:
+                return None
+            documents = list(yaml.safe_load_all(text))
+            if len(documents) == 1:
+                summary.add(documents[0])
+                records = len(documents[0]) if isinstance(documents[0], list) else 1
+            else:
+                records = summary.add_elements('$', documents)
+        else:
+            records = _add_json_document(summary, text)
+    except (ValueError, RecursionError) as e:
+        print(f"Structured input did not parse as {input_format}: {e}")
+        return None
+    except Exception as e:
+        if YAML_AVAILABLE and isinstance(e, yaml.YAMLError):
+            print(f"Structured input did not parse as YAML: {e}")
+            return None
+        raise
+
+    digest, digest_report = format_digest(summary, input_format, len(text), records, token_budget)
+    digest_report['invalid_lines'] = report['invalid_lines']
+    digest_report['estimated_tokens'] = estimate_tokens(digest)
+    digest_report['text'] = digest
+    return digest_report
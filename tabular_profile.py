@@ -0,0 +1,340 @@
+# Column profiles and row samples for tabular uploads (CSV, TSV, XLSX)
+import csv
+import io
+import os
+import re
+import sys
+import zipfile
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from content_sniffing import SNIFF_PREFIX_BYTES, detect_text_encoding
+from ingestion import open_buffer
+
+# Extensions handled as tables, with their delimiter (None for spreadsheets)
+TABULAR_EXTENSIONS = {'csv': ',', 'tsv': '\t', 'xlsx': None}
+
+# Rows beyond this are not read; the profile says so
+TABULAR_MAX_ROWS = int(os.environ.get('TABULAR_MAX_ROWS', 2000000))
+
+# Rows included verbatim in the profile
+TABULAR_SAMPLE_ROWS = int(os.environ.get('TABULAR_SAMPLE_ROWS', 40))
+
+# Most frequent values listed per column, and histogram bins for numeric and date columns
+TABULAR_TOP_K = 10
+TABULAR_HISTOGRAM_BINS = 10
+
+# A column with at most this many distinct values can be used to stratify the row sample
+STRATIFY_MAX_GROUPS = 20
+
+# Sample cells are shortened to this many characters
+MAX_CELL_CHARS = 80
+
+# Cell values treated as missing
+MISSING_VALUES = ['', 'na', 'n/a', 'nan', 'null', 'none', '-']
+
+BOOLEAN_VALUES = {'true', 'false', 'yes', 'no', 't', 'f', 'y', 'n'}
+
+_ISO_DATE = re.compile(r'^\d{4}-\d{2}-\d{2}([ T]\d{2}:\d{2}(:\d{2})?)?$')
+
+_S = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_R = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+_PACKAGE_R = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+
+def iter_delimited_rows(file_bytes, delimiter):
+    """Stream the rows of a CSV or TSV upload."""
+    csv.field_size_limit(min(sys.maxsize, 2 ** 31 - 1))
+    encoding = detect_text_encoding(bytes(file_bytes[:SNIFF_PREFIX_BYTES])) or 'utf-8'
+    text = io.TextIOWrapper(open_buffer(file_bytes), encoding=encoding, errors='replace', newline='')
+    return csv.reader(text, delimiter=delimiter)
+
+
+def _xlsx_column_index(cell_ref):
+    """Convert the letters of a cell reference such as 'AB12' to a zero-based column index."""
+    index = 0
+    for char in cell_ref:
+        if not char.isalpha():
+            break
+        index = index * 26 + (ord(char.upper()) - ord('A') + 1)
+    return index - 1
+
+
+def _xlsx_shared_strings(archive):
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return []
+    strings = []
+    with archive.open('xl/sharedStrings.xml') as shared_xml:
+        for _, element in ET.iterparse(shared_xml):
+            if element.tag == _S + 'si':
+                strings.append("".join(node.text or '' for node in element.iter(_S + 't')))
+                element.clear()
+    return strings
+
+
+def _xlsx_first_sheet_path(archive):
+    """Resolve the first worksheet listed in the workbook, falling back to sheet1.xml."""
+    try:
+        workbook = ET.fromstring(archive.read('xl/workbook.xml'))
+        sheet = workbook.find(f'{_S}sheets/{_S}sheet')
+        rels = ET.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+        for rel in rels.iter(_PACKAGE_R + 'Relationship'):
+            if rel.get('Id') == sheet.get(_R + 'id'):
+                target = rel.get('Target').lstrip('/')
+                return target if target.startswith('xl/') else f"xl/{target}"
+    except (KeyError, AttributeError, ET.ParseError):
+        pass
+    return 'xl/worksheets/sheet1.xml'
+
+
+def iter_xlsx_rows(xlsx_bytes):
+    """
+    Stream the rows of the first worksheet of an XLSX workbook.
+    The sheet XML is read with iterparse and every finished row is cleared, like iter_docx_blocks.
+    """
+    with zipfile.ZipFile(open_buffer(xlsx_bytes)) as archive:
+        shared_strings = _xlsx_shared_strings(archive)
+        with archive.open(_xlsx_first_sheet_path(archive)) as sheet_xml:
+            for _, element in ET.iterparse(sheet_xml):
+                if element.tag != _S + 'row':
+                    continue
+                row = []
+                for cell in element.iter(_S + 'c'):
+                    cell_type = cell.get('t')
+                    if cell_type == 'inlineStr':
+                        value = "".join(node.text or '' for node in cell.iter(_S + 't'))
+                    else:
+                        value_node = cell.find(_S + 'v')
+                        value = value_node.text if value_node is not None and value_node.text else ''
+                        if cell_type == 's' and value:
+                            value = shared_strings[int(value)]
+                        elif cell_type == 'b' and value:
+                            value = 'TRUE' if value == '1' else 'FALSE'
+                    # Empty cells are omitted from the XML, so place values by their reference
+                    column = _xlsx_column_index(cell.get('r', '')) if cell.get('r') else len(row)
+                    row.extend([''] * (column - len(row)))
+                    row.append(value)
+                yield row
+                element.clear()
+
+
+def load_columns(rows, max_rows=TABULAR_MAX_ROWS):
+    """
+    Read rows into one NumPy object array per column. The first non-empty row is the header.
+    Returns (header, columns, truncated).
+    """
+    header = None
+    cells = []
+    truncated = False
+    for row in rows:
+        if header is None:
+            if any(cell.strip() for cell in row):
+                header = [cell.strip() or f"column_{index + 1}" for index, cell in enumerate(row)]
+                cells = [[] for _ in header]
+            continue
+        if len(cells[0]) >= max_rows:
+            truncated = True
+            break
+        width = len(header)
+        row = row[:width] + [''] * (width - len(row))
+        for column, cell in zip(cells, row):
+            column.append(cell.strip())
+
+    if header is None:
+        return [], [], False
+    return header, [np.array(column, dtype=object) for column in cells], truncated
+
+
+def _missing_mask(values):
+    lowered = np.array([value.lower() for value in values], dtype=object)
+    return np.isin(lowered, MISSING_VALUES)
+
+
+def _histogram(numbers, bins=TABULAR_HISTOGRAM_BINS):
+    counts, edges = np.histogram(numbers, bins=bins)
+    return [{'low': float(edges[index]), 'high': float(edges[index + 1]), 'count': int(count)}
+            for index, count in enumerate(counts)]
+
+
+def _top_values(values, top_k=TABULAR_TOP_K):
+    uniques, counts = np.unique(values, return_counts=True)
+    order = np.argsort(-counts, kind='stable')[:top_k]
+    return len(uniques), [{'value': str(uniques[index]), 'count': int(counts[index])} for index in order]
+
+
+def profile_column(name, values):
+    """Infer the type of one column and compute its summary statistics in vectorized passes."""
+    missing = _missing_mask(values)
+    present = values[~missing]
+    profile = {'name': name, 'type': 'empty', 'count': int(present.size), 'missing': int(missing.sum())}
+    if present.size == 0:
+        return profile
+
+    try:
+        numbers = present.astype(float)
+    except ValueError:
+        numbers = None
+
+    if numbers is not None:
+        finite = numbers[np.isfinite(numbers)]
+        profile['type'] = 'integer' if finite.size and np.all(np.mod(finite, 1) == 0) else 'float'
+        profile['distinct'] = int(np.unique(numbers).size)
+        if finite.size:
+            percentiles = np.percentile(finite, [5, 25, 50, 75, 95])
+            profile.update({
+                'min': float(finite.min()),
+                'max': float(finite.max()),
+                'mean': float(finite.mean()),
+                'std': float(finite.std()),
+                'percentiles': dict(zip(['p5', 'p25', 'p50', 'p75', 'p95'], percentiles.tolist()))
+            })
+            # Codes and ratings read better as value counts than as a histogram
+            if profile['distinct'] <= TABULAR_TOP_K:
+                _, profile['top_values'] = _top_values(present)
+            else:
+                profile['histogram'] = _histogram(finite)
+        return profile
+
+    distinct, top_values = _top_values(present)
+    profile['distinct'] = distinct
+    profile['top_values'] = top_values
+
+    if distinct <= len(BOOLEAN_VALUES) and all(item['value'].lower() in BOOLEAN_VALUES for item in top_values):
+        profile['type'] = 'boolean'
+        return profile
+
+    if _ISO_DATE.match(present[0]):
+        try:
+            dates = present.astype('datetime64[s]')
+        except ValueError:
+            dates = None
+        if dates is not None:
+            seconds = dates.astype(np.int64)
+            profile.update({
+                'type': 'datetime',
+                'min': str(dates.min()),
+                'max': str(dates.max()),
+                'histogram': [dict(bucket,
+                                   low=str(np.datetime64(int(bucket['low']), 's')),
+                                   high=str(np.datetime64(int(bucket['high']), 's')))
+                              for bucket in _histogram(seconds)]
+            })
+            return profile
+
+    lengths = np.fromiter((len(value) for value in present), dtype=np.int64, count=present.size)
+    profile['type'] = 'text'
+    profile['length'] = {'min': int(lengths.min()), 'mean': float(lengths.mean()), 'max': int(lengths.max())}
+    return profile
+
+
+def _choose_strata(profiles):
+    """Pick the categorical column with the fewest missing values to stratify the sample by."""
+    candidates = [index for index, profile in enumerate(profiles)
+                  if profile['type'] in ('text', 'boolean') and 2 <= profile.get('distinct', 0) <= STRATIFY_MAX_GROUPS]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda index: profiles[index]['missing'])
+
+
+def sample_rows(columns, profiles, sample_size=TABULAR_SAMPLE_ROWS):
+    """
+    Choose row indexes for the sample. Rows are spread evenly through each group of the
+    stratifying column (if there is one), with every group represented at least once.
+    Returns (indexes, strata column index or None).
+    """
+    row_count = columns[0].size if columns else 0
+    if row_count <= sample_size:
+        return np.arange(row_count), None
+
+    strata = _choose_strata(profiles)
+    if strata is None:
+        return np.unique(np.linspace(0, row_count - 1, sample_size).astype(np.int64)), None
+
+    _, groups = np.unique(columns[strata], return_inverse=True)
+    group_sizes = np.bincount(groups)
+    allocation = np.maximum(1, np.round(sample_size * group_sizes / row_count)).astype(np.int64)
+    picks = []
+    for group, size in enumerate(allocation):
+        members = np.flatnonzero(groups == group)
+        picks.append(members[np.linspace(0, members.size - 1, min(size, members.size)).astype(np.int64)])
+    return np.unique(np.concatenate(picks)), strata
+
+
+def _format_number(value):
+    return f"{value:,.6g}" if abs(value) < 1e15 else f"{value:.6g}"
+
+
+def _format_cell(value):
+    value = value.replace("|", "\\|").replace("\n", " ")
+    return value if len(value) <= MAX_CELL_CHARS else value[:MAX_CELL_CHARS - 1] + "…"
+
+
+def _format_column(profile, row_count):
+    lines = [f"### `{profile['name']}` ({profile['type']})"]
+    missing_share = profile['missing'] / row_count if row_count else 0
+    lines.append(f"- values: {profile['count']:,}, missing: {profile['missing']:,} ({missing_share:.1%})"
+                 + (f", distinct: {profile['distinct']:,}" if 'distinct' in profile else ""))
+
+    if profile['type'] in ('integer', 'float') and 'min' in profile:
+        lines.append(f"- min {_format_number(profile['min'])}, max {_format_number(profile['max'])}, "
+                     f"mean {_format_number(profile['mean'])}, std {_format_number(profile['std'])}")
+        lines.append("- percentiles: " + ", ".join(f"{key} {_format_number(value)}"
+                                                   for key, value in profile['percentiles'].items()))
+        if 'histogram' in profile:
+            lines.append("- histogram: " + " | ".join(
+                f"[{_format_number(bucket['low'])}, {_format_number(bucket['high'])}): {bucket['count']:,}"
+                for bucket in profile['histogram']))
+    elif profile['type'] == 'datetime':
+        lines.append(f"- range {profile['min']} to {profile['max']}")
+        lines.append("- histogram: " + " | ".join(f"from {bucket['low']}: {bucket['count']:,}" for bucket in profile['histogram']))
+    elif profile['type'] == 'text':
+        length = profile['length']
+        lines.append(f"- length min {length['min']}, mean {length['mean']:.1f}, max {length['max']}")
+
+    if profile.get('top_values'):
+        lines.append("- top values: " + ", ".join(f"\"{_format_cell(item['value'])}\" ({item['count']:,})"
+                                                  for item in profile['top_values']))
+    return "\n".join(lines)
+
+
+def profile_table(file_bytes, file_ext):
+    """
+    Build a compact data profile of a CSV, TSV or XLSX upload: per-column types and statistics
+    followed by a stratified row sample. Returns a dict with the profile text and its metadata.
+    Sections are separated by blank lines so the text can be cut column by column.
+    """
+    delimiter = TABULAR_EXTENSIONS[file_ext]
+    rows = iter_xlsx_rows(file_bytes) if delimiter is None else iter_delimited_rows(file_bytes, delimiter)
+    header, columns, truncated = load_columns(rows)
+    row_count = columns[0].size if columns else 0
+
+    profiles = [profile_column(name, values) for name, values in zip(header, columns)]
+    indexes, strata = sample_rows(columns, profiles)
+
+    sections = [
+        "# Data profile\n"
+        f"{file_ext.upper()} table with {row_count:,} rows and {len(header)} columns. "
+        + (f"Only the first {row_count:,} rows were read. " if truncated else "")
+        + "The statistics below cover every row; a sample of rows follows them."
+    ]
+    sections.append("## Columns\n" + "\n".join(f"- `{profile['name']}`: {profile['type']}" for profile in profiles))
+    sections.extend(_format_column(profile, row_count) for profile in profiles)
+
+    if header:
+        title = f"## Sample rows ({len(indexes):,} of {row_count:,}"
+        title += f", stratified by `{header[strata]}`)" if strata is not None else ")"
+        table = ["| " + " | ".join(_format_cell(name) for name in header) + " |",
+                 "| " + " | ".join("---" for _ in header) + " |"]
+        for index in indexes:
+            table.append("| " + " | ".join(_format_cell(column[index]) for column in columns) + " |")
+        sections.append(title + "\n" + "\n".join(table))
+
+    return {
+        'text': "\n\n".join(sections) + "\n",
+        'row_count': row_count,
+        'column_count': len(header),
+        'rows_truncated': truncated,
+        'sample_rows': int(len(indexes)),
+        'stratified_by': header[strata] if strata is not None else None
+    }
@@ -0,0 +1,48 @@
+"""Small synthetic documents built in memory for the tests."""
+import io
+import zipfile
+
+VOCABULARY = ['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'theta', 'kappa', 'lambda', 'sigma']
+
+
+def make_pdf(page_texts):
+    """Build a minimal PDF of Helvetica text, one string per page; newlines start new lines."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in page_texts:
+        lines = " 0 -14 Td ".join(f"({line}) Tj" for line in text.split("\n"))
+        stream = f"BT /F1 12 Tf 72 720 Td {lines} ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += f"{number} 0 obj\n{body}\nendobj\n".encode('latin-1')
+    xref = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode('latin-1')
+    pdf += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode('latin-1')
+    pdf += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode('latin-1')
+    return pdf
+
+
+def make_zip(members, compression=zipfile.ZIP_DEFLATED):
+    """Build a ZIP archive from (name, bytes) pairs."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression) as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def paragraphs(count, words=60, seed=0):
+    """Distinct paragraphs of plain words, separated by blank lines."""
+    return "".join(
+        " ".join(f"{VOCABULARY[(index * 7 + word * 3 + seed) % len(VOCABULARY)]}{(index + word) % 13}"
+                 for word in range(words)) + "\n\n"
+        for index in range(count))
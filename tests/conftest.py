@@ -0,0 +1,84 @@
+"""
+Shared setup of the test suite. The server modules are imported from the repository root, and
+the caches and state files they keep on disk are pointed at a temporary directory before any
+of them is imported, so the tests never read or write the server's own state.
+"""
+import os
+import shutil
+import sys
+import tempfile
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STATE_DIR = tempfile.mkdtemp(prefix='file-visualizer-tests-')
+
+for name, path in [('EXTRACTION_CACHE_DIR', 'extraction-cache'),
+                   ('IMAGE_CACHE_DIR', 'image-cache'),
+                   ('SUMMARY_CACHE_DIR', 'summary-cache'),
+                   ('CHUNKED_UPLOAD_DIR', 'chunked-uploads'),
+                   ('TOKEN_CALIBRATION_PATH', 'token-calibration.json'),
+                   ('BUDGET_PLANNER_PATH', 'budget-planner.json')]:
+    os.environ[name] = os.path.join(STATE_DIR, path)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(STATE_DIR, ignore_errors=True)
+
+
+@pytest.fixture
+def client():
+    """Flask test client of the server; imported lazily so tests of single modules do not load it."""
+    import server
+    return server.app.test_client()
+
+
+class FakeClaude:
+    """
+    Stand-in for the Anthropic client: records the parameters of every request and answers
+    with reply and usage. messages.create returns a whole message, beta.messages.stream streams
+    the reply as one text delta.
+    """
+    def __init__(self, reply="<p>generated</p>", usage=None):
+        self.reply = reply
+        self.usage = usage or {'input_tokens': 100, 'output_tokens': 20}
+        self.requests = []
+        self.messages = SimpleNamespace(create=self.create, stream=self.stream)
+        self.beta = SimpleNamespace(messages=SimpleNamespace(stream=self.stream))
+
+    def create(self, **params):
+        self.requests.append(params)
+        return SimpleNamespace(content=[{'type': 'text', 'text': self.reply}], usage=dict(self.usage),
+                               stop_reason='end_turn')
+
+    def stream(self, **params):
+        self.requests.append(params)
+        return FakeStream(self.reply, dict(self.usage))
+
+
+class FakeStream:
+    def __init__(self, reply, usage):
+        self.chunks = [SimpleNamespace(type='content_block_delta', thinking=None, delta=SimpleNamespace(text=reply))]
+        self.usage = usage
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+
+@pytest.fixture
+def fake_claude(monkeypatch):
+    """A FakeClaude that the server uses instead of the Anthropic API; calibration is left untouched."""
+    import server
+    claude = FakeClaude()
+    monkeypatch.setattr(server, 'create_anthropic_client', lambda api_key: claude)
+    monkeypatch.setattr(server.token_estimator, 'observe', lambda *args, **kwargs: None)
+    monkeypatch.setattr(server.budget_planner, 'observe', lambda *args, **kwargs: None)
+    return claude
@@ -0,0 +1,66 @@
+import pytest
+
+import document_images
+import server
+from analysis_store import AnalysisStore
+from builders import paragraphs
+from extraction_cache import ExtractionCache
+
+
+def document(text):
+    return {'text': text, 'file_type': 'txt', 'char_count': len(text), 'boilerplate': None}
+
+
+def test_store_returns_and_replaces_analyses():
+    store = AnalysisStore(ttl=60, max_chars=1000)
+    first = store.put('a.txt', document("first"))
+    assert store.get(first)['document']['text'] == "first"
+    store.put('a.txt', document("second"), analysis_id='fixed')
+    store.put('a.txt', document("third"), analysis_id='fixed')
+    assert store.get('fixed')['document']['text'] == "third"
+    with pytest.raises(ValueError):
+        store.put('big.txt', document("x" * 1001))
+
+
+def test_generation_reuses_the_analyzed_text(client, fake_claude, monkeypatch):
+    text = paragraphs(5, seed=11)
+    analysis = client.post('/api/analyze-tokens', json={'content': text, 'file_name': 'notes.txt'}).get_json()
+    assert analysis['analysis_id']
+    assert client.post('/api/analyze-tokens', json={'content': text, 'file_name': 'notes.txt'}).get_json()['analysis_id'] \
+        == analysis['analysis_id']
+
+    def no_extraction(*args, **kwargs):
+        raise AssertionError("the analyzed document was extracted again")
+    monkeypatch.setattr(server, 'extract_document_cached', no_extraction)
+    monkeypatch.setattr(server, 'open_request_upload', no_extraction)
+
+    response = client.post('/process', json={'analysis_id': analysis['analysis_id'], 'api_key': 'key'})
+    assert response.status_code == 200
+    assert response.get_json()['html'] == fake_claude.reply
+    [request] = fake_claude.requests
+    assert text.strip() in request['messages'][0]['content']
+
+
+def test_unknown_analysis_without_a_payload_is_not_found(client):
+    response = client.post('/process', json={'analysis_id': 'missing', 'api_key': 'key'})
+    assert response.status_code == 404
+
+
+def test_analysis_images_come_from_the_image_cache(monkeypatch, tmp_path):
+    cache = ExtractionCache(disk_dir=str(tmp_path))
+    monkeypatch.setattr(document_images, 'image_cache', cache)
+    key = document_images.image_cache_key('digest', 'docx')
+    cache.put(key, {'images': [{'media_type': 'image/png', 'data': 'iVBORw==', 'estimated_tokens': 5}],
+                    'report': {'attached': 1, 'estimated_tokens': 5}, 'char_count': 8})
+    analysis = {'analysis_id': 'id', 'upload_id': None, 'file_type': 'docx', 'document': document(''), 'image_key': key}
+
+    images, report = server.analysis_images(analysis)
+    assert [image['data'] for image in images] == [b'\x89PNG']
+    assert report['cache_hit'] is True
+
+
+def test_analysis_without_cached_images_or_bytes_has_none(monkeypatch, tmp_path):
+    monkeypatch.setattr(document_images, 'image_cache', ExtractionCache(disk_dir=str(tmp_path)))
+    analysis = {'analysis_id': 'id', 'upload_id': None, 'file_type': 'docx', 'document': document(''),
+                'image_key': document_images.image_cache_key('digest', 'docx')}
+    assert server.analysis_images(analysis) == ([], None)
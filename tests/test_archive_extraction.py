@@ -0,0 +1,74 @@
+import pytest
+
+import archive_extraction
+from archive_extraction import (ARCHIVE_RATIO_MIN_BYTES, ArchiveError, extract_archive, fit_archive_to_budget,
+                                inspect_archive)
+from builders import make_zip, paragraphs
+from token_estimation import estimate_tokens
+
+
+def test_high_compression_ratio_member_is_skipped():
+    archive = make_zip([('bomb.txt', b'\0' * (ARCHIVE_RATIO_MIN_BYTES * 4)), ('notes.txt', b'plain notes')])
+    report = inspect_archive(archive)
+    assert [member['name'] for member in report['files']] == ['notes.txt']
+    assert report['skipped'] == [{'name': 'bomb.txt', 'reason': 'suspicious compression ratio'}]
+
+
+def test_too_many_members_is_rejected(monkeypatch):
+    monkeypatch.setattr(archive_extraction, 'ARCHIVE_MAX_MEMBERS', 3)
+    with pytest.raises(ArchiveError) as caught:
+        inspect_archive(make_zip([(f"file{index}.txt", b'x') for index in range(5)]))
+    assert caught.value.status_code == 413
+
+
+def test_nested_hidden_and_unsupported_members_are_skipped():
+    archive = make_zip([('inner.zip', make_zip([('a.txt', b'a')])), ('__MACOSX/._a.txt', b'x'),
+                        ('tool.exe', b'MZ'), ('a.txt', b'a')])
+    assert inspect_archive(archive)['skipped'] == [
+        {'name': 'inner.zip', 'reason': 'nested archive'},
+        {'name': '__MACOSX/._a.txt', 'reason': 'hidden file'},
+        {'name': 'tool.exe', 'reason': 'unsupported file type'}
+    ]
+
+
+def test_members_are_extracted_under_file_headers():
+    entry = extract_archive(make_zip([('docs/a.md', b'# A\n\nalpha'), ('b.txt', b'beta'), ('c.png', b'\x89PNG')]))
+    assert entry['text'] == "## File: docs/a.md\n\n# A\n\nalpha\n\n## File: b.txt\n\nbeta"
+    assert [item['name'] for item in entry['archive']['files']] == ['docs/a.md', 'b.txt']
+    assert entry['archive']['skipped'] == [{'name': 'c.png', 'reason': 'unsupported file type'}]
+
+
+def archive_entry(sizes):
+    return extract_archive(make_zip([(f"file{index:02d}.txt", paragraphs(count, seed=index).encode('utf-8'))
+                                     for index, count in enumerate(sizes)]))
+
+
+def test_small_files_are_kept_and_large_ones_share_the_rest():
+    entry = archive_entry([1, 40, 1, 40])
+    result = fit_archive_to_budget(entry, 1500)
+    assert result['estimated_tokens'] == estimate_tokens(result['text']) <= 1500
+    assert [item['partial'] for item in result['manifest']] == [False, True, False, True]
+    assert result['text'].count(archive_extraction.FILE_OMISSION_MARKER) == 2
+    assert result['omitted_files'] == []
+    assert (result['included_units'], result['omitted_units']) == (2, 2)
+
+
+def test_archives_that_fit_are_kept_whole():
+    entry = archive_entry([2, 3])
+    result = fit_archive_to_budget(entry, 100000)
+    assert result['text'] == entry['text']
+    assert not result['truncated']
+
+
+@pytest.mark.parametrize('budget', [0, 20, 100, 500, 2000])
+def test_many_files_with_a_tiny_budget_stay_within_it(budget):
+    entry = archive_entry([10] * 50)
+    result = fit_archive_to_budget(entry, budget)
+    assert result['estimated_tokens'] == estimate_tokens(result['text']) <= budget
+    kept = len(result['manifest'])
+    assert kept + len(result['omitted_files']) == 50
+    assert result['text'].count(archive_extraction.FILE_OMISSION_MARKER) <= kept
+    if result['omitted_files'] and result['text']:
+        assert f"[... {len(result['omitted_files'])} more files omitted" in result['text']
+    # The files left out are the last ones of the archive
+    assert result['omitted_files'] == [f"file{index:02d}.txt" for index in range(kept, 50)]
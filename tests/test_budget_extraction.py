@@ -0,0 +1,58 @@
+import pytest
+
+import extraction_cache
+from builders import make_pdf, paragraphs
+from document_extraction import collect_document_within_budget, collect_units_within_budget, iter_text_units
+from extraction_cache import ExtractionCache
+from token_estimation import estimate_tokens
+
+
+def test_content_within_the_budget_is_kept_whole():
+    text = paragraphs(3)
+    result = collect_units_within_budget(iter_text_units(text), 100000)
+    assert not result['truncated']
+    assert result['text'] == text
+    assert result['omitted_units'] == 0
+
+
+@pytest.mark.parametrize('budget', [5, 50, 333, 500, 1234, 5000])
+def test_joined_text_fits_the_budget(budget):
+    text = paragraphs(200)
+    result = collect_units_within_budget(iter_text_units(text), budget)
+    assert result['truncated']
+    assert text.startswith(result['text'])
+    assert result['estimated_tokens'] == estimate_tokens(result['text']) <= budget
+    manifest = result['manifest'][0]
+    assert manifest['end'] == result['included_units'] + (1 if manifest['partial'] else 0)
+    assert result['omitted_units'] == 200 - result['included_units']
+
+
+def test_parsing_stops_at_the_budget():
+    consumed = []
+
+    def units():
+        for unit in iter_text_units(paragraphs(100)):
+            consumed.append(unit['index'])
+            yield unit
+
+    result = collect_units_within_budget(units(), 300)
+    assert len(consumed) == result['included_units'] + 1
+
+
+def test_pdf_pages_are_parsed_up_to_the_budget():
+    pdf = make_pdf([f"Page {index} " + "word " * 40 for index in range(10)])
+    result = collect_document_within_budget(pdf, 'pdf', 60)
+    assert result['truncated']
+    assert result['unit_kind'] == 'page'
+    assert result['page_lengths'] is None
+    assert estimate_tokens(result['text']) <= 60
+
+
+def test_cached_documents_are_cut_from_the_stored_text(monkeypatch, tmp_path):
+    monkeypatch.setattr(extraction_cache, 'extraction_cache', ExtractionCache(disk_dir=str(tmp_path)))
+    data = paragraphs(100).encode('utf-8')
+    extraction_cache.extract_document_cached(data, 'txt')
+    result = extraction_cache.extract_document_within_budget(data, 'txt', 200)
+    assert result['cache_hit'] is True
+    assert result['truncated']
+    assert estimate_tokens(result['text']) <= 200
@@ -0,0 +1,81 @@
+import itertools
+
+import pytest
+
+from budget_planner import (MIN_BUCKET_OBSERVATIONS, MIN_OUTPUT_TOKENS, MIN_THINKING_TOKENS, PRIOR_OUTPUT_TOKENS,
+                            BudgetPlanner)
+
+MODEL = 'claude-3-7-sonnet-20250219'
+
+
+@pytest.fixture
+def planner(tmp_path):
+    return BudgetPlanner(path=str(tmp_path / 'planner.json'))
+
+
+def test_thinking_stays_off_when_not_requested(planner):
+    plan = planner.plan('text', 2000, MODEL, 128000, 0)
+    assert plan['thinking_budget'] == 0
+    assert plan['max_tokens'] == int(PRIOR_OUTPUT_TOKENS[1] * 1.25)
+    assert plan['basis'] == 'prior'
+
+
+def test_thinking_is_dropped_when_max_tokens_has_no_room_for_it(planner):
+    plan = planner.plan('text', 2000, MODEL, 1000, 8000)
+    assert (plan['max_tokens'], plan['thinking_budget']) == (1000, 0)
+
+
+@pytest.mark.parametrize('max_tokens, thinking_budget, latency_target, input_tokens', list(itertools.product(
+    [1000, 4096, 20000, 128000], [0, 1024, 8000, 32000], [None, 6, 30, 600], [100, 20000, 150000])))
+def test_requested_values_are_never_exceeded(planner, max_tokens, thinking_budget, latency_target, input_tokens):
+    plan = planner.plan('table', input_tokens, MODEL, max_tokens, thinking_budget, latency_target=latency_target)
+    assert plan['max_tokens'] <= max_tokens
+    assert plan['thinking_budget'] <= thinking_budget
+    assert plan['thinking_budget'] == 0 or MIN_THINKING_TOKENS <= plan['thinking_budget'] < plan['max_tokens']
+
+
+def test_latency_target_shrinks_the_plan(planner):
+    relaxed = planner.plan('text', 20000, MODEL, 128000, 16000)
+    hurried = planner.plan('text', 20000, MODEL, 128000, 16000, latency_target=60)
+    assert hurried['max_tokens'] < relaxed['max_tokens']
+    assert hurried['max_tokens'] >= MIN_OUTPUT_TOKENS
+
+
+def test_fixed_budgets_are_used_as_sent(planner):
+    plan = planner.plan('text', 2000, MODEL, 50000, 9000, adaptive=False)
+    assert (plan['max_tokens'], plan['thinking_budget']) == (50000, 9000)
+
+
+def test_observed_runs_replace_the_prior_and_are_persisted(planner):
+    for _ in range(MIN_BUCKET_OBSERVATIONS):
+        plan = planner.plan('text', 2000, MODEL, 128000, 0)
+        planner.observe(plan, 3000, 3100, 45.0)
+    plan = planner.plan('text', 2000, MODEL, 128000, 0)
+    assert (plan['basis'], plan['expected_output_tokens']) == ('observed', 3000)
+    assert plan['max_tokens'] == MIN_OUTPUT_TOKENS
+    # Other content types of the same size fall back to the runs of any type
+    assert planner.plan('table', 2000, MODEL, 128000, 0)['basis'] == 'observed'
+
+    reloaded = BudgetPlanner(path=planner.path)
+    assert reloaded.plan('text', 2000, MODEL, 128000, 0)['expected_output_tokens'] == 3000
+    assert reloaded.stats() == planner.stats()
+
+
+def test_runs_cut_short_are_recorded_longer(planner):
+    plan = planner.plan('text', 2000, MODEL, 10000, 0)
+    for _ in range(MIN_BUCKET_OBSERVATIONS):
+        planner.observe(plan, 6000, plan['max_tokens'], 60.0)
+    assert planner.plan('text', 2000, MODEL, 128000, 0)['expected_output_tokens'] == 9000
+
+
+def test_stream_request_omits_thinking_when_it_is_off(client, fake_claude):
+    client.post('/api/process-stream', json={'content': 'hello', 'api_key': 'key', 'max_tokens': 1000,
+                                             'thinking_budget': 8000}).get_data()
+    assert 'thinking' not in fake_claude.requests[-1]
+    assert fake_claude.requests[-1]['max_tokens'] <= 1000
+
+    client.post('/api/process-stream', json={'content': 'hello', 'api_key': 'key', 'max_tokens': 64000,
+                                             'thinking_budget': 8000}).get_data()
+    thinking = fake_claude.requests[-1]['thinking']
+    assert thinking['type'] == 'enabled'
+    assert MIN_THINKING_TOKENS <= thinking['budget_tokens'] <= 8000
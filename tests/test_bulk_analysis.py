@@ -0,0 +1,42 @@
+import json
+
+import server
+from builders import paragraphs
+
+
+def ndjson(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_each_document_gets_a_line(client):
+    upload_id = server.upload_store.put('stored.txt', paragraphs(2).encode('utf-8'))
+    response = client.post('/api/analyze-tokens/bulk', json={
+        'max_tokens': 8000,
+        'documents': [{'id': 'pasted', 'content': paragraphs(3)},
+                      {'id': 'stored', 'upload_id': upload_id},
+                      {'id': 'gone', 'upload_id': 'missing'},
+                      {'id': 'empty', 'content': ''}]
+    })
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    lines = sorted(ndjson(response), key=lambda line: line['index'])
+    assert [(line['index'], line['id'], line['status']) for line in lines] == [
+        (0, 'pasted', 200), (1, 'stored', 200), (2, 'gone', 404), (3, 'empty', 400)]
+    assert lines[0]['estimated_tokens'] > 0 and lines[0]['analysis_id']
+    assert "upload_id" in lines[2]['error']
+
+
+def test_shared_settings_apply_to_every_document(client):
+    documents = [{'content': paragraphs(2, seed=seed)} for seed in range(3)]
+    small = ndjson(client.post('/api/analyze-tokens/bulk', json={'documents': documents, 'max_tokens': 1000}))
+    large = ndjson(client.post('/api/analyze-tokens/bulk', json={'documents': documents, 'max_tokens': 60000}))
+    budgets = {line['token_histogram']['token_budget'] for line in small}
+    assert len(budgets) == 1
+    assert budgets.isdisjoint(line['token_histogram']['token_budget'] for line in large)
+
+
+def test_missing_or_oversized_document_lists_are_rejected(client, monkeypatch):
+    assert client.post('/api/analyze-tokens/bulk', json={'content': 'x'}).status_code == 400
+    assert client.post('/api/analyze-tokens/bulk', json={'documents': 'x'}).status_code == 400
+    monkeypatch.setattr(server, 'BULK_ANALYZE_MAX_DOCUMENTS', 2)
+    assert client.post('/api/analyze-tokens/bulk', json={'documents': [{}, {}, {}]}).status_code == 413
@@ -0,0 +1,130 @@
+import hashlib
+import os
+import threading
+
+import pytest
+
+from chunked_upload import ChunkedUploadError, ChunkedUploadStore
+
+DATA = bytes(range(10))
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ChunkedUploadStore(upload_dir=str(tmp_path))
+
+
+def upload_all(store, data=DATA, chunk_size=4, sha256=None):
+    state = store.init('file.bin', len(data), chunk_size=chunk_size, sha256=sha256)
+    for offset in range(0, len(data), chunk_size):
+        chunk = data[offset:offset + chunk_size]
+        store.put_chunk(state['upload_id'], offset, chunk, chunk_sha256=hashlib.sha256(chunk).hexdigest())
+    return state['upload_id']
+
+
+def status_of(call, *args, **kwargs):
+    with pytest.raises(ChunkedUploadError) as caught:
+        call(*args, **kwargs)
+    return caught.value.status_code
+
+
+def test_matching_hash_assembles_the_file(store):
+    digest = hashlib.sha256(DATA).hexdigest()
+    final_state, data = store.finalize(upload_all(store, sha256=digest))
+    assert final_state['sha256'] == digest
+    assert bytes(data) == DATA
+    assert os.listdir(store.upload_dir) == []
+
+
+def test_chunk_with_wrong_hash_is_rejected(store):
+    state = store.init('file.bin', len(DATA), chunk_size=4)
+    assert status_of(store.put_chunk, state['upload_id'], 0, DATA[:4], chunk_sha256='0' * 64) == 422
+    assert store.status(state['upload_id'])['missing'] == [0, 1, 2]
+
+
+def test_assembled_file_with_wrong_hash_can_be_repaired(store):
+    upload_id = upload_all(store, data=b'x' * 10, sha256=hashlib.sha256(DATA).hexdigest())
+    assert status_of(store.finalize, upload_id) == 422
+    for offset in range(0, len(DATA), 4):
+        store.put_chunk(upload_id, offset, DATA[offset:offset + 4])
+    assert bytes(store.finalize(upload_id)[1]) == DATA
+
+
+def test_missing_chunks_block_finalize(store):
+    state = store.init('file.bin', len(DATA), chunk_size=4)
+    store.put_chunk(state['upload_id'], 0, DATA[:4])
+    assert status_of(store.finalize, state['upload_id']) == 409
+
+
+def test_malformed_digest_is_rejected(store):
+    assert status_of(store.init, 'file.bin', 10, sha256='not-a-digest') == 400
+
+
+def test_chunk_after_finalize_is_a_404(store):
+    upload_id = upload_all(store)
+    store.finalize(upload_id)
+    assert status_of(store.put_chunk, upload_id, 0, DATA[:4]) == 404
+    assert status_of(store.finalize, upload_id) == 404
+
+
+def test_chunk_racing_a_finalize_is_a_409(store):
+    upload_id = upload_all(store)
+    state = store._load_state(upload_id)
+    # The finalize claims the file between the chunk reading the state and opening the file
+    os.rename(store._data_path(upload_id), store._finalizing_path(upload_id))
+    original_load = store._load_state
+    store._load_state = lambda requested: state if requested == upload_id else original_load(requested)
+    assert status_of(store.put_chunk, upload_id, 0, DATA[:4]) == 409
+    assert status_of(store.finalize, upload_id) == 409
+
+
+def test_concurrent_finalizes_complete_once(store):
+    for _ in range(5):
+        upload_id = upload_all(store)
+        results = []
+        barrier = threading.Barrier(4)
+
+        def finalize():
+            barrier.wait()
+            try:
+                results.append(bytes(store.finalize(upload_id)[1]))
+            except ChunkedUploadError as e:
+                results.append(e.status_code)
+
+        threads = [threading.Thread(target=finalize) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results.count(DATA) == 1
+        assert all(result in (404, 409) for result in results if result != DATA)
+
+
+def test_unfinished_uploads_are_capped(tmp_path):
+    store = ChunkedUploadStore(upload_dir=str(tmp_path), max_pending=2, max_pending_bytes=100)
+    store.init('a.bin', 10)
+    second = store.init('b.bin', 10)
+    assert status_of(store.init, 'c.bin', 10) == 429
+    store._remove_files(second['upload_id'])
+    assert status_of(store.init, 'c.bin', 91) == 429
+    store.init('c.bin', 90)
+
+
+def test_endpoint_rejects_malformed_size(client):
+    response = client.post('/upload/chunked', json={'file_name': 'a.pdf', 'size': 'abc'})
+    assert response.status_code == 400
+
+
+def test_endpoints_upload_and_finalize_once(client):
+    started = client.post('/upload/chunked', json={'file_name': 'notes.txt', 'size': len(DATA), 'chunk_size': 8,
+                                                  'sha256': hashlib.sha256(DATA).hexdigest()}).get_json()
+    upload_id = started['upload_id']
+    bad = client.put(f"/upload/chunked/{upload_id}?offset=0", data=DATA[:8], headers={'X-Chunk-SHA256': 'f' * 64})
+    assert bad.status_code == 422
+    for offset in (0, 8):
+        assert client.put(f"/upload/chunked/{upload_id}?offset={offset}", data=DATA[offset:offset + 8]).status_code == 200
+    finalized = client.post(f"/upload/chunked/{upload_id}/finalize", json={})
+    assert finalized.status_code == 200
+    assert finalized.get_json()['size'] == len(DATA)
+    assert client.post(f"/upload/chunked/{upload_id}/finalize", json={}).status_code == 404
+    assert client.put(f"/upload/chunked/{upload_id}?offset=0", data=DATA[:8]).status_code == 404
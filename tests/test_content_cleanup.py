@@ -0,0 +1,92 @@
+import content_cleanup
+from builders import make_pdf, paragraphs
+from content_cleanup import (BoilerplateStripper, _minhash_signature, _shingle_hashes, dedupe_paragraphs,
+                             iter_stripped_pages)
+from document_extraction import extract_document
+
+
+def report_pages(count=30):
+    pages = []
+    for index in range(count):
+        pages.append("\n".join([
+            "ACME Corporation Annual Report 2024",
+            # Numeric body lines at the top edge: a total that changes and one that repeats
+            str(1000 + index * 3),
+            "21",
+            f"Body text of page {index}, which talks about item {index * 17}.",
+            f"Page {index + 1} of {count}"
+        ]))
+    return pages
+
+
+def test_headers_and_page_numbers_are_removed():
+    stripper = BoilerplateStripper()
+    stripped = stripper.strip_pages(report_pages())
+    for index, page_text in enumerate(stripped):
+        assert "ACME Corporation" not in page_text
+        assert f"Page {index + 1} of 30" not in page_text
+        assert f"Body text of page {index}," in page_text
+    assert stripper.report()['lines_removed'] == 60
+
+
+def test_numeric_body_lines_are_kept():
+    stripped = BoilerplateStripper().strip_pages(report_pages())
+    for index, page_text in enumerate(stripped):
+        lines = page_text.split("\n")
+        assert str(1000 + index * 3) in lines
+        assert "21" in lines
+
+
+def test_page_numbers_need_not_start_at_one():
+    pages = [f"Chapter text {index}\n- {index + 5} -" for index in range(10)]
+    stripped = BoilerplateStripper().strip_pages(pages)
+    assert stripped == [f"Chapter text {index}" for index in range(10)]
+
+
+def test_short_documents_are_left_alone():
+    pages = report_pages(2)
+    assert BoilerplateStripper().strip_pages(pages) == pages
+
+
+def test_streamed_pages_are_stripped_like_whole_documents():
+    pages = report_pages(45)
+    units = ({'kind': 'page', 'index': index, 'total': len(pages), 'text': text} for index, text in enumerate(pages))
+    streamed = [unit['text'] for unit in iter_stripped_pages(units, BoilerplateStripper())]
+    assert streamed == BoilerplateStripper().strip_pages(pages)
+
+
+def test_pdf_extraction_reports_the_savings():
+    pdf = make_pdf([f"Quarterly Review\nFindings of section {index}\n{index + 1}" for index in range(6)])
+    entry = extract_document(pdf, 'pdf')
+    assert entry['boilerplate']['lines_removed'] == 12
+    assert "Quarterly Review" not in entry['text']
+    assert all(f"Findings of section {index}" in entry['text'] for index in range(6))
+
+
+def test_near_duplicate_paragraphs_are_collapsed():
+    original = paragraphs(1, words=60, seed=4).strip()
+    edited = original.replace(original.split()[10], "changed", 1)
+    other = paragraphs(1, words=60, seed=5).strip()
+    deduped, report = dedupe_paragraphs("\n\n".join([original, other, edited, original]) + "\n")
+    assert report['duplicates_removed'] == 2
+    assert report['estimated_tokens_saved'] > 0
+    assert deduped.count(original) == 1
+    assert other in deduped
+    assert "changed" not in deduped
+    assert deduped.count("[Repeated content omitted") == 2
+
+
+def test_short_and_distinct_symbol_paragraphs_are_kept():
+    first = "\n".join("| --- | === | +++ | ~~~ |" for _ in range(12))
+    second = "\n".join("| ### | *** | !!! | ??? |" for _ in range(12))
+    text = f"{first}\n\n{second}\n\nShort line.\n\nShort line.\n"
+    deduped, report = dedupe_paragraphs(text)
+    assert report['duplicates_removed'] == 0
+    assert deduped == text
+
+
+def test_signatures_do_not_depend_on_numpy(monkeypatch):
+    shingles = _shingle_hashes(paragraphs(1, seed=6))
+    with_numpy = _minhash_signature(shingles)
+    monkeypatch.setattr(content_cleanup, 'NUMPY_AVAILABLE', False)
+    assert _minhash_signature(shingles) == with_numpy
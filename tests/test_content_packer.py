@@ -0,0 +1,57 @@
+import pytest
+
+from builders import paragraphs
+from content_packer import pack_units
+from document_extraction import iter_text_units
+from token_estimation import estimate_tokens
+
+
+def numbered_paragraphs(count):
+    return "".join(f"Paragraph number {index}. " + paragraphs(1, words=40, seed=index) for index in range(count))
+
+
+@pytest.mark.parametrize('budget', [1000, 3000, 6000])
+def test_spread_keeps_the_start_the_end_and_samples_of_the_middle(budget):
+    text = numbered_paragraphs(100)
+    result = pack_units(iter_text_units(text), budget, 'spread')
+    assert result['strategy'] == 'spread'
+    assert result['estimated_tokens'] == estimate_tokens(result['text']) <= budget
+    assert result['text'].startswith("Paragraph number 0.")
+    assert "Paragraph number 99." in result['text']
+    assert result['included_units'] + result['omitted_units'] == result['total_units'] == 100
+    assert result['text'].count("paragraph(s) omitted to fit the token budget") == len(result['manifest']) - 1
+
+
+def test_markers_count_the_units_left_out():
+    result = pack_units(iter_text_units(numbered_paragraphs(100)), 1000, 'spread')
+    markers = [int(line.split()[1]) for line in result['text'].splitlines() if line.startswith("[... ")]
+    assert sum(markers) == result['omitted_units']
+    assert result['manifest'][0]['start'] == 0 and result['manifest'][-1]['end'] == 100
+
+
+def test_middle_samples_are_spread_out():
+    result = pack_units(iter_text_units(numbered_paragraphs(100)), 3000, 'spread')
+    middle = result['manifest'][1:-1]
+    assert len(middle) >= 2
+    assert middle[0]['start'] < 50 < middle[-1]['start']
+
+
+def test_content_that_fits_is_kept_whole():
+    text = numbered_paragraphs(5)
+    result = pack_units(iter_text_units(text), 10000, 'spread')
+    assert (result['strategy'], result['text'], result['truncated']) == ('head', text, False)
+
+
+def test_head_keeps_the_beginning():
+    result = pack_units(iter_text_units(numbered_paragraphs(100)), 500, 'head')
+    assert result['strategy'] == 'head'
+    assert result['estimated_tokens'] <= 500
+    assert result['text'].startswith("Paragraph number 0.")
+    assert "Paragraph number 99." not in result['text']
+
+
+def test_spread_falls_back_to_head_when_the_first_unit_fills_the_head_share():
+    text = paragraphs(1, words=400) + numbered_paragraphs(20)
+    result = pack_units(iter_text_units(text), 600, 'spread')
+    assert result['strategy'] == 'head'
+    assert result['estimated_tokens'] <= 600
@@ -0,0 +1,55 @@
+import base64
+
+import pytest
+
+from builders import make_pdf, make_zip
+from content_sniffing import UnsupportedContentError, detect_text_encoding, looks_like_base64, sniff_upload
+
+
+def test_pdf_is_found_whatever_its_name():
+    assert sniff_upload(make_pdf(["hello"]), 'report.txt')['file_type'] == 'pdf'
+    assert sniff_upload(b'\x00\x01junk' + make_pdf(["hello"]), 'scan.bin')['file_type'] == 'pdf'
+    # A PDF header quoted inside text does not make it a PDF
+    assert sniff_upload(b'Notes about the %PDF-1.4 header', 'notes.md')['file_type'] == 'md'
+
+
+def test_zip_packages_are_told_apart():
+    docx = make_zip([('word/document.xml', b'<w:document/>')])
+    assert sniff_upload(docx, 'upload.bin')['file_type'] == 'docx'
+    assert sniff_upload(make_zip([('a.txt', b'a')]), 'letter.docx')['file_type'] == 'zip'
+
+
+def test_unsupported_binary_is_rejected():
+    with pytest.raises(UnsupportedContentError, match="PNG image"):
+        sniff_upload(b'\x89PNG\r\n\x1a\n' + b'\0' * 64, 'chart.pdf')
+    with pytest.raises(UnsupportedContentError, match="unknown format"):
+        sniff_upload(bytes(range(32)) * 8, 'data.txt')
+
+
+def test_text_keeps_its_declared_type():
+    assert sniff_upload('café'.encode('utf-8'), 'menu.csv') == {'file_type': 'csv', 'encoding': 'utf-8',
+                                                               'declared_type': 'csv'}
+    assert sniff_upload(b'plain words', 'notes.exe')['file_type'] == 'txt'
+
+
+@pytest.mark.parametrize('prefix, encoding', [
+    (b'\xef\xbb\xbfhello', 'utf-8-sig'),
+    ('hello'.encode('utf-16'), 'utf-16'),
+    ('hello world'.encode('utf-16-le'), 'utf-16-le'),
+    ('hello world'.encode('utf-16-be'), 'utf-16-be'),
+    ('naïve'.encode('utf-8'), 'utf-8'),
+    ('naïve'.encode('cp1252'), 'cp1252'),
+    (b'', None),
+])
+def test_text_encoding_is_detected(prefix, encoding):
+    assert detect_text_encoding(prefix) == encoding
+
+
+def test_base64_fields_are_recognized():
+    assert looks_like_base64(base64.b64encode(make_pdf(["hello"])).decode('ascii'))
+    assert looks_like_base64('data:application/pdf;base64,JVBERi0=')
+    assert looks_like_base64(base64.b64encode(b'some plain text').decode('ascii'))
+    # Words and digits that happen to be valid base64 are raw text
+    assert not looks_like_base64('Document')
+    assert not looks_like_base64('1234')
+    assert not looks_like_base64('hello world!')
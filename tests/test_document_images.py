@@ -0,0 +1,77 @@
+import base64
+import io
+
+import pytest
+
+import document_images
+from builders import make_zip
+from extraction_cache import ExtractionCache
+from helper_function import api_content_blocks
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def png(width, height, color):
+    output = io.BytesIO()
+    Image.new('RGB', (width, height), color).save(output, format='PNG')
+    return output.getvalue()
+
+
+@pytest.fixture
+def image_cache(monkeypatch, tmp_path):
+    cache = ExtractionCache(disk_dir=str(tmp_path))
+    monkeypatch.setattr(document_images, 'image_cache', cache)
+    return cache
+
+
+def docx_with_images():
+    logo = png(200, 100, (200, 30, 30))
+    return make_zip([('word/document.xml', b'<w:document/>'),
+                     ('word/media/image1.png', logo),
+                     ('word/media/image2.png', png(3000, 2000, (30, 90, 200))),
+                     ('word/media/image3.png', logo),
+                     ('word/media/image4.png', png(16, 16, (0, 0, 0)))])
+
+
+def test_images_are_deduplicated_downscaled_and_cached(image_cache):
+    docx = docx_with_images()
+    images, report = document_images.extract_document_images(docx, 'docx')
+
+    assert report == dict(report, found=4, duplicates=1, attached=2, skipped=1, cache_hit=False)
+    assert [image['source'] for image in images] == ['image1.png', 'image2.png']
+    large = images[1]
+    assert max(large['width'], large['height']) <= document_images.IMAGE_MAX_EDGE
+    assert large['width'] * large['height'] <= document_images.IMAGE_MAX_PIXELS
+    assert len(large['data']) <= document_images.IMAGE_TARGET_BYTES
+    assert report['estimated_tokens'] == sum(image['estimated_tokens'] for image in images)
+
+    cached_images, cached_report = document_images.extract_document_images(docx, 'docx')
+    assert cached_report['cache_hit'] is True
+    assert [image['data'] for image in cached_images] == [image['data'] for image in images]
+
+
+def test_attachments_stop_at_the_byte_budget(image_cache):
+    images, report = document_images.extract_document_images(docx_with_images(), 'docx', max_bytes=2000)
+    assert report['bytes'] <= 2000
+    assert report['attached'] == len(images) < 2
+
+
+def test_other_documents_have_no_images(image_cache):
+    assert document_images.extract_document_images(b'plain text', 'txt') == ([], None)
+
+
+def test_image_blocks_for_both_apis():
+    image = {'media_type': 'image/png', 'data': png(80, 80, (1, 2, 3))}
+    [claude_block] = document_images.claude_image_blocks([image])
+    assert claude_block['source'] == {'type': 'base64', 'media_type': 'image/png',
+                                      'data': base64.b64encode(image['data']).decode('ascii')}
+    assert document_images.gemini_image_parts([image]) == [{'mime_type': 'image/png', 'data': image['data']}]
+
+
+def test_content_blocks_encode_raw_image_bytes():
+    content = [{'type': 'image', 'source': {'media_type': 'image/png', 'data': b'\x89PNG'}},
+               {'type': 'text', 'text': 'Describe it'}, 'ignored']
+    assert api_content_blocks(content) == [
+        {'type': 'image', 'source': {'media_type': 'image/png', 'data': 'iVBORw==', 'type': 'base64'}},
+        {'type': 'text', 'text': 'Describe it'}
+    ]
@@ -0,0 +1,74 @@
+import io
+
+import pytest
+
+from document_extraction import extract_docx_text, iter_docx_blocks, iter_docx_paragraphs
+
+docx = pytest.importorskip('docx')
+
+
+def build_docx(build):
+    document = docx.Document()
+    build(document)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def python_docx_text(docx_bytes):
+    """The extraction path server.py used before the streaming extractor."""
+    document = docx.Document(io.BytesIO(docx_bytes))
+    return "\n".join(paragraph.text for paragraph in document.paragraphs)
+
+
+def body_paragraphs(document):
+    document.add_paragraph("Plain paragraph with ünïcode and <markup> & entities.")
+    paragraph = document.add_paragraph("Bold start, ")
+    paragraph.add_run("italic middle").italic = True
+    paragraph.add_run("\tafter a tab")
+    paragraph.add_run().add_break()
+    paragraph.add_run("after a break")
+    document.add_paragraph("")
+    for index in range(50):
+        document.add_paragraph(f"Numbered paragraph {index}")
+
+
+def test_paragraphs_match_the_python_docx_path():
+    docx_bytes = build_docx(body_paragraphs)
+    assert extract_docx_text(docx_bytes) == python_docx_text(docx_bytes)
+
+
+def test_headings_are_marked_and_otherwise_match():
+    def build(document):
+        document.add_heading("Report", 0)
+        document.add_heading("Introduction", 1)
+        document.add_paragraph("Body")
+        document.add_heading("Details", 3)
+
+    docx_bytes = build_docx(build)
+    text = extract_docx_text(docx_bytes)
+    assert text.split("\n") == ["# Report", "# Introduction", "Body", "### Details"]
+    assert [line.lstrip("# ") for line in text.split("\n")] == python_docx_text(docx_bytes).split("\n")
+
+
+def test_tables_are_extracted_in_document_order():
+    def build(document):
+        document.add_paragraph("Before")
+        table = document.add_table(rows=2, cols=2)
+        for row in range(2):
+            for column in range(2):
+                table.cell(row, column).text = f"r{row}c{column}"
+        table.cell(1, 1).add_table(rows=1, cols=1).cell(0, 0).text = "nested"
+        document.add_paragraph("After")
+
+    text = extract_docx_text(build_docx(build))
+    assert text.split("\n") == ["Before", "| r0c0 | r0c1 |", "| r1c0 | r1c1 nested |", "After"]
+
+
+def test_blocks_are_streamed():
+    blocks = iter_docx_blocks(build_docx(body_paragraphs))
+    assert next(blocks) == {'kind': 'paragraph', 'text': "Plain paragraph with ünïcode and <markup> & entities."}
+    blocks.close()
+
+    units = list(iter_docx_paragraphs(build_docx(body_paragraphs)))
+    assert "".join(unit['text'] for unit in units) == extract_docx_text(build_docx(body_paragraphs))
@@ -0,0 +1,58 @@
+import hashlib
+
+import pytest
+
+import extraction_cache
+from builders import paragraphs
+from extraction_cache import ExtractionCache
+
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path):
+    cache = ExtractionCache(disk_dir=str(tmp_path))
+    monkeypatch.setattr(extraction_cache, 'extraction_cache', cache)
+    return cache
+
+
+def test_repeat_upload_is_a_cache_hit(cache):
+    data = paragraphs(5, seed=1).encode('utf-8')
+    first = extraction_cache.extract_document_cached(data, 'txt')
+    second = extraction_cache.extract_document_cached(data, 'txt')
+    assert first['cache_hit'] is False
+    assert second['cache_hit'] is True
+    assert second['text'] == first['text']
+    assert second['sha256'] == hashlib.sha256(data).hexdigest()
+    assert cache.stats()['hits'] == 1
+
+
+def test_disk_tier_survives_a_new_memory_tier(monkeypatch, cache, tmp_path):
+    data = paragraphs(5, seed=2).encode('utf-8')
+    extraction_cache.extract_document_cached(data, 'txt')
+
+    restarted = ExtractionCache(disk_dir=str(tmp_path))
+    monkeypatch.setattr(extraction_cache, 'extraction_cache', restarted)
+    assert extraction_cache.extract_document_cached(data, 'txt')['cache_hit'] is True
+    assert restarted.stats()['disk_hits'] == 1
+
+
+def test_same_bytes_under_another_type_are_a_miss(cache):
+    data = paragraphs(3, seed=3).encode('utf-8')
+    extraction_cache.extract_document_cached(data, 'txt')
+    assert extraction_cache.extract_document_cached(data, 'md')['cache_hit'] is False
+
+
+def test_stale_disk_entries_are_ignored(monkeypatch, tmp_path):
+    ExtractionCache(disk_dir=str(tmp_path)).put('key', {'text': 'old', 'char_count': 3})
+    monkeypatch.setattr(extraction_cache, 'EXTRACTION_CACHE_VERSION', extraction_cache.EXTRACTION_CACHE_VERSION + 1)
+    assert ExtractionCache(disk_dir=str(tmp_path)).get('key') is None
+
+
+def test_memory_tier_evicts_least_recently_used(tmp_path):
+    cache = ExtractionCache(max_entries=10, max_chars=10, disk_dir=str(tmp_path), disk_max_bytes=0)
+    cache.put('a', {'text': 'aaaa', 'char_count': 4})
+    cache.put('b', {'text': 'bbbb', 'char_count': 4})
+    cache.get('a')
+    cache.put('c', {'text': 'cccc', 'char_count': 4})
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.stats()['memory_chars'] == 8
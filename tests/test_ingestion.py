@@ -0,0 +1,50 @@
+import base64
+
+import ingestion
+from builders import make_pdf, paragraphs
+from document_extraction import extract_document, extract_pdf_pages
+
+
+def test_small_upload_is_decoded_to_bytes():
+    data = paragraphs(2).encode('utf-8')
+    with ingestion.ingest_base64(base64.b64encode(data).decode('ascii')) as upload:
+        assert not upload.is_mapped
+        assert upload.buffer == data
+        assert upload.size == len(data)
+
+
+def test_data_url_and_missing_padding_are_accepted():
+    encoded = base64.b64encode(b'hello world!!').decode('ascii').rstrip('=')
+    with ingestion.ingest_base64(f"data:text/plain;base64,{encoded}") as upload:
+        assert upload.buffer == b'hello world!!'
+
+
+def test_large_upload_is_decoded_into_a_memory_map(monkeypatch):
+    monkeypatch.setattr(ingestion, 'INGEST_MMAP_THRESHOLD', 100)
+    monkeypatch.setattr(ingestion, 'BASE64_DECODE_STEP', 64)
+    data = paragraphs(20).encode('utf-8')
+    upload = ingestion.ingest_base64(base64.b64encode(data).decode('ascii'))
+    try:
+        assert upload.is_mapped
+        assert isinstance(upload.buffer, memoryview)
+        assert bytes(upload.buffer) == data
+        assert extract_document(upload.buffer, 'txt')['text'] == data.decode('utf-8')
+    finally:
+        upload.close()
+    assert upload.size == 0
+
+
+def test_mapped_pdf_is_extracted_without_a_file(monkeypatch):
+    monkeypatch.setattr(ingestion, 'INGEST_MMAP_THRESHOLD', 100)
+    pdf = make_pdf(["Mapped page"])
+    with ingestion.ingest_base64(base64.b64encode(pdf).decode('ascii')) as upload:
+        assert upload.is_mapped
+        assert extract_pdf_pages(upload.buffer)[0].strip() == "Mapped page"
+
+
+def test_streams_over_a_memoryview_are_seekable():
+    stream = ingestion.open_buffer(memoryview(b'0123456789'))
+    stream.seek(4)
+    assert stream.read(3) == b'456'
+    stream.seek(-2, 2)
+    assert stream.read() == b'89'
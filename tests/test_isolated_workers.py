@@ -0,0 +1,66 @@
+import os
+import time
+
+import pytest
+
+import document_extraction
+from document_extraction import ExtractionError, run_isolated, run_isolated_many
+
+
+def double(value):
+    return value * 2
+
+
+def sleep_forever():
+    time.sleep(60)
+
+
+def crash():
+    os._exit(3)
+
+
+def allocate_too_much():
+    return len(bytearray(1024 ** 3))
+
+
+def fail():
+    raise ValueError("bad document")
+
+
+def test_results_come_back_in_order():
+    assert run_isolated(double, 21) == 42
+    assert run_isolated_many([(double, (index,)) for index in range(5)]) == [0, 2, 4, 6, 8]
+
+
+def test_overrunning_worker_is_killed():
+    started = time.time()
+    with pytest.raises(ExtractionError) as caught:
+        run_isolated(sleep_forever, timeout=0.5)
+    assert (caught.value.code, caught.value.status_code) == ('extraction_timeout', 422)
+    assert time.time() - started < 10
+
+
+def test_crashed_worker_is_reported():
+    with pytest.raises(ExtractionError) as caught:
+        run_isolated(crash)
+    assert (caught.value.code, caught.value.status_code) == ('extraction_crashed', 422)
+
+
+@pytest.mark.skipif(document_extraction.resource is None, reason="resource limits are not available")
+def test_memory_limit_is_enforced(monkeypatch):
+    monkeypatch.setattr(document_extraction, 'EXTRACTION_MEMORY_LIMIT_MB', 64)
+    with pytest.raises(ExtractionError) as caught:
+        run_isolated(allocate_too_much)
+    assert (caught.value.code, caught.value.status_code) == ('extraction_memory_limit', 413)
+
+
+def test_parser_errors_are_raised_unchanged():
+    with pytest.raises(ValueError, match="bad document"):
+        run_isolated(fail)
+
+
+def test_one_failure_stops_the_batch():
+    started = time.time()
+    with pytest.raises(ExtractionError):
+        run_isolated_many([(crash, ()), (sleep_forever, ())], timeout=30)
+    assert time.time() - started < 10
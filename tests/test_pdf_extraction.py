@@ -0,0 +1,29 @@
+import document_extraction
+from builders import make_pdf
+
+
+def test_parallel_extraction_keeps_page_order(monkeypatch):
+    monkeypatch.setattr(document_extraction, 'EXTRACTION_WORKERS', 4)
+    monkeypatch.setattr(document_extraction, 'PDF_PAGES_PER_TASK', 5)
+    page_count = document_extraction.PARALLEL_PDF_MIN_PAGES + 7
+    pdf = make_pdf([f"Marker page {index + 1}" for index in range(page_count)])
+
+    pages = document_extraction.extract_pdf_pages(pdf)
+
+    assert len(pages) == page_count
+    for index, page_text in enumerate(pages):
+        assert f"Marker page {index + 1}" in page_text
+
+
+def test_small_documents_are_extracted_in_one_range():
+    pdf = make_pdf(["First page", "Second page"])
+    pages = document_extraction.extract_pdf_pages(pdf)
+    assert [page.strip() for page in pages] == ["First page", "Second page"]
+    assert document_extraction.extract_pdf_text(pdf) == "".join(page + "\n" for page in pages)
+
+
+def test_page_ranges_cover_every_page_once():
+    ranges = document_extraction._split_page_ranges(23, 5)
+    assert ranges[0] == (0, 5)
+    assert ranges[-1] == (20, 23)
+    assert [page for start, end in ranges for page in range(start, end)] == list(range(23))
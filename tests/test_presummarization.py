@@ -0,0 +1,114 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import presummarization
+from builders import paragraphs
+from extraction_cache import ExtractionCache
+from presummarization import chunk_text, presummarize_text, summary_key
+from token_estimation import estimate_tokens
+
+DOCUMENT = "".join(f"# Part {part}\n\n" + paragraphs(40, seed=part) for part in range(8))
+
+
+class SummaryClient:
+    """Answers every summary request with a short summary naming its chunk's first line."""
+    def __init__(self):
+        self.requests = []
+        self._lock = threading.Lock()
+        self.messages = SimpleNamespace(create=self.create)
+
+    def create(self, **params):
+        with self._lock:
+            self.requests.append(params)
+        chunk = params['messages'][0]['content'].split("\n\n", 1)[1]
+        return SimpleNamespace(content=[{'type': 'text', 'text': f"Summary of: {chunk.splitlines()[0][:40]}"}],
+                               usage={'input_tokens': 900, 'output_tokens': 30})
+
+
+@pytest.fixture(autouse=True)
+def summary_cache(monkeypatch, tmp_path):
+    cache = ExtractionCache(disk_dir=str(tmp_path))
+    monkeypatch.setattr(presummarization, 'summary_cache', cache)
+    return cache
+
+
+def run(generator):
+    """Drain a presummarize_text generator; returns (progress events, result)."""
+    events = []
+    while True:
+        try:
+            events.append(next(generator))
+        except StopIteration as stop:
+            return [event for event in events if event is not None], stop.value
+
+
+def test_chunks_join_back_into_the_text():
+    chunks = chunk_text(DOCUMENT, max_tokens=3000, min_tokens=800)
+    assert "".join(chunks) == DOCUMENT
+    assert len(chunks) > 3
+    assert all(estimate_tokens(chunk) <= 3000 for chunk in chunks)
+
+
+def test_long_paragraphs_are_cut_to_the_chunk_size():
+    text = " ".join(["word"] * 5000)
+    chunks = chunk_text(text, max_tokens=300, min_tokens=100)
+    assert "".join(chunks) == text
+    assert all(estimate_tokens(chunk) <= 300 for chunk in chunks)
+
+
+def test_an_edit_only_moves_nearby_chunk_boundaries():
+    chunks = chunk_text(DOCUMENT, max_tokens=3000, min_tokens=800)
+    edited = DOCUMENT.replace("# Part 7", "# Part seven, revised", 1)
+    edited_chunks = chunk_text(edited, max_tokens=3000, min_tokens=800)
+    assert edited_chunks[:len(chunks) // 2] == chunks[:len(chunks) // 2]
+
+
+def test_summary_key_depends_on_the_model_and_the_text():
+    assert summary_key('a', 'text') == summary_key('a', 'text')
+    assert summary_key('a', 'text') != summary_key('b', 'text')
+    assert summary_key('a', 'text') != summary_key('a', 'text.')
+
+
+def test_text_is_condensed_to_the_budget():
+    client = SummaryClient()
+    budget = estimate_tokens(DOCUMENT) // 3
+    events, (text, report) = run(presummarize_text(client, DOCUMENT, budget))
+    assert report['estimated_tokens'] == estimate_tokens(text) <= budget
+    assert report['original_tokens'] == estimate_tokens(DOCUMENT)
+    assert report['usage']['input_tokens'] == 900 * len(client.requests)
+    assert len(events) == len(client.requests)
+    assert all(request['model'] == presummarization.SUMMARY_MODEL for request in client.requests)
+    # Chunks that were not needed for the budget stay verbatim
+    assert "Summary of:" in text and "alpha" in text
+
+
+def test_cached_summaries_are_not_requested_again(summary_cache):
+    budget = estimate_tokens(DOCUMENT) // 3
+    first_client = SummaryClient()
+    run(presummarize_text(first_client, DOCUMENT, budget))
+    assert first_client.requests
+
+    second_client = SummaryClient()
+    events, (second_text, report) = run(presummarize_text(second_client, DOCUMENT, budget))
+    assert second_client.requests == []
+    assert events == []
+    assert report['estimated_tokens'] == estimate_tokens(second_text) <= budget
+    assert report['levels'][0]['cached_chunks'] == report['levels'][0]['summarized_chunks'] > 0
+    assert report['usage']['input_tokens'] == 0
+
+
+def test_text_within_the_budget_is_left_alone():
+    client = SummaryClient()
+    _, (text, report) = run(presummarize_text(client, DOCUMENT, estimate_tokens(DOCUMENT)))
+    assert text == DOCUMENT
+    assert report['levels'] == [] and client.requests == []
+
+
+def test_failed_requests_are_raised():
+    def fail(**params):
+        raise RuntimeError("rate limited")
+    client = SimpleNamespace(messages=SimpleNamespace(create=fail))
+    with pytest.raises(RuntimeError, match="rate limited"):
+        run(presummarize_text(client, DOCUMENT, 1000))
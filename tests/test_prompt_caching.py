@@ -0,0 +1,117 @@
+import json
+from types import SimpleNamespace
+
+import helper_function
+import server
+from builders import paragraphs
+from helper_function import api_content_blocks, cache_breakpoint, cacheable_system, prompt_cache_min_tokens
+from prompt_registry import prompt_registry
+from usage_metrics import UsageMetrics, usage_cost, usage_counts
+
+EPHEMERAL = {'type': 'ephemeral'}
+CACHED_USAGE = {'input_tokens': 50, 'output_tokens': 20, 'cache_creation_input_tokens': 1200,
+                'cache_read_input_tokens': 3600}
+
+
+def stream_events(response):
+    events = []
+    for chunk in response.get_data(as_text=True).split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in chunk.splitlines() if ": " in line)
+        if 'data' in lines:
+            events.append((lines.get('event'), json.loads(lines['data'])))
+    return events
+
+
+def message_complete(response):
+    [complete] = [data for event, data in stream_events(response) if data.get('type') == 'message_complete']
+    return complete
+
+
+def test_breakpoint_needs_a_prefix_the_model_can_cache():
+    blocks = [{'type': 'text', 'text': 'shared'}, {'type': 'text', 'text': 'outline'}]
+    assert cache_breakpoint(blocks, 1023, 'claude-3-7-sonnet-20250219') == blocks
+    marked = cache_breakpoint(blocks, 1024, 'claude-3-7-sonnet-20250219')
+    assert [block.get('cache_control') for block in marked] == [None, EPHEMERAL]
+    assert 'cache_control' not in blocks[1]
+    assert cache_breakpoint("system", 2000, 'claude-3-7-sonnet-20250219') == \
+        [{'type': 'text', 'text': 'system', 'cache_control': EPHEMERAL}]
+    assert prompt_cache_min_tokens('claude-3-5-haiku-20241022') == 2048
+    assert cache_breakpoint("system", 2000, 'claude-3-5-haiku-20241022') == "system"
+
+
+def test_caching_can_be_turned_off(monkeypatch):
+    monkeypatch.setattr(helper_function, 'PROMPT_CACHING', False)
+    assert cache_breakpoint("system", 5000, 'claude-3-7-sonnet-20250219') == "system"
+
+
+def test_short_system_prompts_are_not_marked():
+    # The page-generation prompts are shorter than any cacheable prefix, so they are sent as they are
+    assert prompt_registry.max_system_prompt_tokens() < prompt_cache_min_tokens('claude-3-7-sonnet-20250219')
+    system, _ = prompt_registry.system_prompt(large=True, extremely_large=True)
+    assert cacheable_system(system, 'claude-3-7-sonnet-20250219') == system
+    long_system = paragraphs(40)
+    assert cacheable_system(long_system, 'claude-3-7-sonnet-20250219')[-1]['cache_control'] == EPHEMERAL
+
+
+def test_fallback_client_blocks_keep_the_breakpoint():
+    assert api_content_blocks([{'type': 'text', 'text': 'a', 'cache_control': EPHEMERAL}]) == \
+        [{'type': 'text', 'text': 'a', 'cache_control': EPHEMERAL}]
+
+
+def test_usage_is_read_from_objects_and_dicts():
+    assert usage_counts(None) is None
+    assert usage_counts({'input_tokens': 5, 'cache_read_input_tokens': None}) == {
+        'input_tokens': 5, 'output_tokens': 0, 'cache_read_input_tokens': 0, 'cache_creation_input_tokens': 0}
+    assert usage_counts(SimpleNamespace(**CACHED_USAGE)) == CACHED_USAGE
+    assert usage_cost(CACHED_USAGE) == (50 * 3.0 + 1200 * 3.75 + 3600 * 0.3 + 20 * 15.0) / 1000000
+
+
+def test_metrics_count_cache_hits_and_writes():
+    metrics = UsageMetrics()
+    metrics.record(CACHED_USAGE)
+    metrics.record(dict(CACHED_USAGE, cache_creation_input_tokens=0))
+    snapshot = metrics.snapshot()
+    assert (snapshot['requests'], snapshot['cache_hits'], snapshot['cache_writes']) == (2, 2, 1)
+    assert snapshot['tokens']['cache_read_input_tokens'] == 7200
+    assert snapshot['cache_read_ratio'] == round(7200 / (100 + 1200 + 7200), 4)
+
+
+def test_cache_usage_reaches_the_stream_and_the_metrics(client, fake_claude):
+    fake_claude.usage = CACHED_USAGE
+    before = client.get('/api/metrics').get_json()['usage']['tokens']
+    response = client.post('/api/process-stream', json={'content': paragraphs(3), 'api_key': 'key',
+                                                         'max_tokens': 8000, 'thinking_budget': 0})
+    usage = message_complete(response)['usage']
+    assert (usage['cache_creation_input_tokens'], usage['cache_read_input_tokens']) == (1200, 3600)
+    after = client.get('/api/metrics').get_json()['usage']['tokens']
+    for name in ('cache_creation_input_tokens', 'cache_read_input_tokens'):
+        assert after[name] - before[name] == CACHED_USAGE[name]
+
+
+def test_sections_share_a_cacheable_outline_turn(client, fake_claude, monkeypatch):
+    fake_claude.usage = CACHED_USAGE
+    monkeypatch.setattr(server, 'split_sections', lambda content: {
+        'sections': [{'index': index, 'id': f"section-{index + 1}", 'label': f"Part {index + 1}", 'tokens': 200,
+                      'text': paragraphs(2, seed=index)} for index in range(3)],
+        'omitted_sections': 0})
+    format_prompt = paragraphs(12, seed=9)
+    response = client.post('/api/process-stream', json={'content': paragraphs(6), 'api_key': 'key', 'sectioned': True,
+                                                         'format_prompt': format_prompt, 'thinking_budget': 0})
+    usage = message_complete(response)['usage']
+    assert usage['cache_read_input_tokens'] == 3 * CACHED_USAGE['cache_read_input_tokens']
+
+    shared = [request['messages'][0]['content'][0] for request in fake_claude.requests]
+    assert len(fake_claude.requests) == 3
+    assert all(block == shared[0] for block in shared)
+    assert shared[0]['cache_control'] == EPHEMERAL
+    assert format_prompt in shared[0]['text'] and "3. Part 3" in shared[0]['text']
+    assert all('cache_control' not in request['messages'][0]['content'][1] for request in fake_claude.requests)
+
+
+def test_short_outline_turns_are_not_marked(client, fake_claude):
+    response = client.post('/api/process-stream', json={'content': paragraphs(4), 'api_key': 'key', 'sectioned': True,
+                                                         'thinking_budget': 0})
+    message_complete(response)
+    [request] = fake_claude.requests
+    assert request['system'] == prompt_registry.render('section_system')
+    assert 'cache_control' not in request['messages'][0]['content'][0]
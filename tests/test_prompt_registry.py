@@ -0,0 +1,69 @@
+import pytest
+
+import prompt_registry as registry_module
+import server
+from prompt_registry import (INCREMENTAL_RENDERING_GUIDELINE, PromptRegistry, PromptTemplate, WEBPAGE_SYSTEM_V1,
+                             WEBPAGE_SYSTEM_V2, prompt_registry)
+from token_estimation import estimate_tokens, token_estimator
+
+
+def system_text(system):
+    return system if isinstance(system, str) else "".join(block['text'] for block in system)
+
+
+def test_versions_share_everything_but_the_guideline():
+    assert WEBPAGE_SYSTEM_V2.replace(INCREMENTAL_RENDERING_GUIDELINE, "") == WEBPAGE_SYSTEM_V1
+    assert WEBPAGE_SYSTEM_V1 not in WEBPAGE_SYSTEM_V2
+
+
+def test_templates_render_fields_and_count_their_tokens():
+    template = PromptTemplate('greeting', 1, "Hello {name}, here is {content}.")
+    assert template.fields == ['name', 'content']
+    assert template.render(name="Ada", content="the report") == "Hello Ada, here is the report."
+    assert template.render(name="Ada") == "Hello Ada, here is ."
+    assert template.static_chars == len("Hello , here is .")
+    assert template.tokens(name="Ada", content="the report") == \
+        estimate_tokens("Hello , here is .") + estimate_tokens("Ada") + estimate_tokens("the report")
+    with pytest.raises(ValueError):
+        PromptTemplate('padded', 1, "{name:>10}")
+
+
+def test_latest_version_is_used_unless_pinned():
+    assert prompt_registry.get('webpage_system').version == 2
+    pinned = PromptRegistry(pins='webpage_system=1')
+    assert pinned.render('webpage_system') == WEBPAGE_SYSTEM_V1
+    assert pinned.system_prompt()[0] == WEBPAGE_SYSTEM_V1
+    with pytest.raises(ValueError):
+        PromptRegistry(pins='webpage_system=9')
+
+
+def test_system_prompts_are_assembled_per_version_and_size():
+    text, tokens = prompt_registry.system_prompt()
+    assert (text, tokens) == (WEBPAGE_SYSTEM_V2, estimate_tokens(WEBPAGE_SYSTEM_V2))
+    assert prompt_registry.system_prompt(version=1)[0] == WEBPAGE_SYSTEM_V1
+    large, _ = prompt_registry.system_prompt(large=True, extremely_large=True)
+    assert large == (WEBPAGE_SYSTEM_V2 + registry_module.LARGE_CONTENT_GUIDELINES_V1
+                     + registry_module.EXTREMELY_LARGE_CONTENT_V1)
+    assert prompt_registry.max_system_prompt_tokens() == estimate_tokens(large)
+
+
+def test_token_counts_follow_a_refit(monkeypatch):
+    before = prompt_registry.system_prompt()[1]
+    assert prompt_registry.manifest()['webpage_system'] == {'version': 2, 'static_tokens': before}
+    monkeypatch.setattr(token_estimator, '_coefficients', [value * 2 for value in token_estimator._coefficients])
+    monkeypatch.setattr(token_estimator, 'fit_version', token_estimator.fit_version + 1)
+    after = prompt_registry.system_prompt()[1]
+    assert after == estimate_tokens(WEBPAGE_SYSTEM_V2)
+    assert abs(after - 2 * before) <= 1
+    assert prompt_registry.manifest()['webpage_system']['static_tokens'] == after
+
+
+def test_each_endpoint_keeps_its_system_prompt_version(client, fake_claude):
+    assert client.post('/process', json={'file_name': 'a.txt', 'file_content': 'hello', 'api_key': 'key'}).status_code == 200
+    assert system_text(fake_claude.requests[-1]['system']) == WEBPAGE_SYSTEM_V1
+
+    response = client.post('/api/process-stream', json={'content': 'hello', 'api_key': 'key', 'max_tokens': 8000,
+                                                         'thinking_budget': 0})
+    response.get_data()
+    assert system_text(fake_claude.requests[-1]['system']) == WEBPAGE_SYSTEM_V2
+    assert server.LEGACY_SYSTEM_PROMPT_VERSION == 1
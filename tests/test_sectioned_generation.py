@@ -0,0 +1,111 @@
+import threading
+import time
+
+import pytest
+
+from builders import paragraphs
+from sectioned_generation import clean_fragment, outline_text, run_sections, split_sections, stitch_page
+from token_estimation import estimate_tokens
+
+
+def chapters(count, paragraphs_each=6):
+    return "".join(f"# Chapter {index + 1}\n\n" + paragraphs(paragraphs_each, seed=index) for index in range(count))
+
+
+def test_sections_follow_the_outline_and_cover_the_text():
+    text = chapters(8)
+    report = split_sections(text, section_tokens=estimate_tokens(text) // 3)
+    sections = report['sections']
+    assert report['unit_kind'] == 'section'
+    assert "".join(section['text'] for section in sections) == text
+    assert [section['id'] for section in sections] == [f"section-{index + 1}" for index in range(len(sections))]
+    assert all(section['text'].startswith("# Chapter") for section in sections)
+    assert sections[0]['label'].startswith("Chapter 1")
+
+
+def test_sections_are_balanced_and_within_the_limit():
+    text = chapters(12)
+    limit = estimate_tokens(text) // 4
+    sections = split_sections(text, section_tokens=limit)['sections']
+    sizes = [section['tokens'] for section in sections]
+    assert max(sizes) <= limit
+    assert max(sizes) < 2 * min(sizes)
+
+
+def test_oversized_chapters_are_split_into_paragraphs():
+    text = "# Only chapter\n\n" + paragraphs(40)
+    limit = estimate_tokens(text) // 5
+    report = split_sections(text, section_tokens=limit)
+    assert len(report['sections']) >= 5
+    assert all(section['tokens'] <= limit for section in report['sections'])
+    assert all(section['label'] == "Only chapter" for section in report['sections'])
+
+
+def test_sections_beyond_the_maximum_are_counted():
+    text = chapters(10)
+    report = split_sections(text, section_tokens=estimate_tokens(text) // 10, max_sections=3)
+    assert len(report['sections']) == 3
+    assert report['omitted_sections'] > 0
+    assert report['omitted_tokens'] > 0
+
+
+def test_outline_numbers_the_sections():
+    sections = [{'index': 0, 'label': 'Intro'}, {'index': 1, 'label': 'Results'}]
+    assert outline_text(sections) == "1. Intro\n2. Results"
+
+
+def test_sections_run_concurrently_and_report_failures():
+    sections = [{'index': index} for index in range(6)]
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def generate(section):
+        with lock:
+            running.append(section['index'])
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(section['index'])
+        if section['index'] == 2:
+            raise RuntimeError("overloaded")
+        return section['index'] * 10
+
+    results = [result for result in run_sections(sections, generate, concurrency=3) if result is not None]
+    assert sorted(section['index'] for section, _, _ in results) == list(range(6))
+    assert max(peak) == 3
+    errors = {section['index']: error for section, _, error in results if error is not None}
+    assert list(errors) == [2] and str(errors[2]) == "overloaded"
+    assert {section['index']: value for section, value, error in results if error is None}[5] == 50
+
+
+def test_slow_sections_send_heartbeats():
+    def generate(section):
+        time.sleep(0.3)
+        return 'done'
+
+    results = list(run_sections([{'index': 0}], generate, heartbeat=0.1))
+    assert results[0] is None
+    assert results[-1][1] == 'done'
+
+
+@pytest.mark.parametrize('reply, expected', [
+    ('<section id="wrong" class="p-4"><h2>Intro</h2></section>', '<section class="p-4" id="section-1"><h2>Intro</h2></section>'),
+    ('```html\n<section><h2>Intro</h2></section>\n```', '<section id="section-1"><h2>Intro</h2></section>'),
+    ('Here it is: <div>body</div> Hope this helps', '<section id="section-1">\n<div>body</div>\n</section>'),
+    ('plain <text>', '<section id="section-1">\n<text>\n</section>'),
+    ('no markup & more', '<section id="section-1">\nno markup &amp; more\n</section>'),
+])
+def test_fragments_are_cleaned_and_get_their_id(reply, expected):
+    assert clean_fragment(reply, {'id': 'section-1'}) == expected
+
+
+def test_page_is_stitched_in_document_order():
+    sections = [{'index': 0, 'id': 'section-1', 'label': 'Part 1'}, {'index': 1, 'id': 'section-2', 'label': 'Part <2>'}]
+    fragments = {1: '<section id="section-2"><p>second</p></section>',
+                 0: '<section id="section-1"><h2>The <em>opening</em></h2></section>'}
+    page = stitch_page("Report & notes", sections, fragments)
+    assert page.index('id="section-1"><h2>') < page.index('id="section-2"><p>')
+    assert '<title>Report &amp; notes</title>' in page
+    assert '<a href="#section-1"' in page and '>The opening</a>' in page
+    assert '>Part &lt;2&gt;</a>' in page
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+import structured_summary
+from structured_summary import sniff_structured_format, summarize_structured_text
+from token_estimation import estimate_tokens
+
+
+def orders(count=300):
+    return [{'id': index, 'status': ['paid', 'open', 'refunded'][index % 3], 'total': index * 2.5,
+             'items': [{'sku': f"sku-{index % 7}", 'qty': index % 4 + 1}],
+             **({'coupon': 'SPRING'} if index % 4 == 0 else {})}
+            for index in range(count)]
+
+
+def test_json_array_is_summarized_by_path():
+    text = json.dumps(orders())
+    report = summarize_structured_text(text, 'json', 4000)
+    digest = report['text']
+    assert report['records'] == 300
+    assert "$[].id: integer; min 0, max 299" in digest
+    assert "$[].status: string; 3 distinct" in digest
+    assert "top: \"paid\" (100)" in digest
+    assert "$[].coupon: string; present in 25%" in digest
+    assert "$[].items[].qty: integer" in digest
+    assert "## Samples of $[]" in digest
+    assert report['estimated_tokens'] == estimate_tokens(digest) <= 4000
+    assert len(digest) < len(text) / 5
+
+
+def test_api_dump_counts_the_records_of_its_array():
+    report = summarize_structured_text(json.dumps({'page': 1, 'data': orders(50)}), 'json', 4000)
+    assert report['records'] == 50
+    assert "$.page: integer" in report['text']
+    assert "$.data[].total: number" in report['text']
+
+
+def test_ndjson_counts_invalid_lines():
+    text = "\n".join(json.dumps(order) for order in orders(20)) + "\nnot json\n\n"
+    assert sniff_structured_format(text) == 'ndjson'
+    report = summarize_structured_text(text, 'ndjson', 4000)
+    assert report['records'] == 20
+    assert report['invalid_lines'] == 1
+
+
+def test_schema_is_cut_to_the_budget():
+    wide = [{f"field_{column}": column for column in range(300)} for _ in range(3)]
+    report = summarize_structured_text(json.dumps(wide), 'json', 300)
+    assert report['omitted_paths'] > 0
+    assert report['samples'] == 0
+    assert report['estimated_tokens'] <= 300 + estimate_tokens("(300 more paths omitted to stay within the token budget)")
+
+
+def test_text_that_does_not_parse_falls_back():
+    assert summarize_structured_text('{"a": 1,', 'json', 1000) is None
+    assert sniff_structured_format("plain words") is None
+    assert sniff_structured_format('{\n  "pretty": true\n}') == 'json'
+
+
+@pytest.mark.skipif(not structured_summary.YAML_AVAILABLE, reason="PyYAML is not installed")
+def test_yaml_documents_are_records():
+    text = "---\nname: a\nreplicas: 2\n---\nname: b\nreplicas: 3\n"
+    report = summarize_structured_text(text, 'yaml', 2000)
+    assert report['records'] == 2
+    assert "$[].replicas: integer; min 2, max 3" in report['text']
@@ -0,0 +1,74 @@
+from builders import make_zip
+from tabular_profile import iter_xlsx_rows, load_columns, profile_table
+
+S_NAMESPACE = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+
+
+def sales_csv(rows=500, delimiter=','):
+    lines = [delimiter.join(['id', 'region', 'amount', 'active', 'day', 'note'])]
+    for index in range(rows):
+        amount = 'n/a' if index % 50 == 0 else f"{index * 1.5:.1f}"
+        region = ['north', 'south', 'east'][index % 3]
+        lines.append(delimiter.join([str(index), region, amount, 'yes' if index % 2 else 'no',
+                                     f"2024-01-{index % 28 + 1:02d}", f"note {index}"]))
+    return ("\n".join(lines) + "\n").encode('utf-8')
+
+
+def test_csv_columns_are_typed_and_summarized():
+    table = profile_table(sales_csv(), 'csv')
+    assert (table['row_count'], table['column_count']) == (500, 6)
+    text = table['text']
+    assert "CSV table with 500 rows and 6 columns" in text
+    assert "### `id` (integer)" in text
+    assert "### `amount` (float)" in text
+    assert "missing: 10 (2.0%)" in text
+    assert "### `active` (boolean)" in text
+    assert "### `day` (datetime)" in text
+    assert "### `region` (text)" in text
+    assert '- top values: "north" (167), "south" (167), "east" (166)' in text
+
+
+def test_row_sample_is_stratified_and_bounded():
+    table = profile_table(sales_csv(), 'csv')
+    sample = table['text'].split("## Sample rows", 1)[1]
+    assert table['sample_rows'] <= 45
+    assert table['stratified_by'] in ('region', 'active')
+    for region in ('north', 'south', 'east'):
+        assert f"| {region} |" in sample
+    # The profile is much smaller than the rows it describes
+    assert len(table['text']) < len(sales_csv()) / 2
+
+
+def test_tsv_and_small_tables_keep_every_row():
+    table = profile_table(sales_csv(rows=5, delimiter='\t'), 'tsv')
+    assert table['row_count'] == 5
+    assert table['sample_rows'] == 5
+    assert table['stratified_by'] is None
+
+
+def test_rows_beyond_the_limit_are_not_read():
+    header, columns, truncated = load_columns(iter([['a', 'b']] + [[str(index), 'x'] for index in range(10)]), max_rows=4)
+    assert header == ['a', 'b']
+    assert truncated
+    assert list(columns[0]) == ['0', '1', '2', '3']
+
+
+def build_xlsx(sheet_rows):
+    shared = ['name', 'score', 'alice', 'bob']
+    shared_xml = (f'<sst xmlns="{S_NAMESPACE}">' + "".join(f'<si><t>{text}</t></si>' for text in shared) + '</sst>')
+    sheet_xml = f'<worksheet xmlns="{S_NAMESPACE}"><sheetData>{sheet_rows}</sheetData></worksheet>'
+    return make_zip([('xl/workbook.xml', f'<workbook xmlns="{S_NAMESPACE}"/>'),
+                     ('xl/sharedStrings.xml', shared_xml),
+                     ('xl/worksheets/sheet1.xml', sheet_xml)])
+
+
+def test_xlsx_rows_resolve_shared_strings_and_gaps():
+    xlsx = build_xlsx(
+        '<row r="1"><c r="A1" t="s"><v>0</v></c><c r="B1" t="s"><v>1</v></c><c r="C1" t="inlineStr"><is><t>ok</t></is></c></row>'
+        '<row r="2"><c r="A2" t="s"><v>2</v></c><c r="C2" t="b"><v>1</v></c></row>'
+        '<row r="3"><c r="A3" t="s"><v>3</v></c><c r="B3"><v>7.5</v></c></row>')
+    assert list(iter_xlsx_rows(xlsx)) == [['name', 'score', 'ok'], ['alice', '', 'TRUE'], ['bob', '7.5']]
+
+    table = profile_table(xlsx, 'xlsx')
+    assert (table['row_count'], table['column_count']) == (2, 3)
+    assert "### `score` (float)" in table['text']
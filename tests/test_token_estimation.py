@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+from token_estimation import (DEFAULT_RELATIVE_ERROR, PRIOR_REQUEST_OVERHEAD, TOKEN_FEATURES, TokenEstimator,
+                              input_token_budget, text_features)
+
+PROSE = "The quick brown fox jumps over the lazy dog. " * 20
+
+
+@pytest.fixture
+def estimator(tmp_path):
+    return TokenEstimator(path=str(tmp_path / 'calibration.json'))
+
+
+def test_characters_are_classed_by_their_utf8_length():
+    features = dict(zip(TOKEN_FEATURES, text_features("ab 12\n  é中😀!")))
+    assert features == {'letters': 2, 'digits': 2, 'spaces': 3, 'space_runs': 1, 'newlines': 1, 'punctuation': 1,
+                        'utf8_2byte': 1, 'utf8_3byte': 1, 'utf8_4byte': 1}
+
+
+def test_priors_give_about_four_characters_per_token(estimator):
+    assert 0.15 < estimator.estimate(PROSE) / len(PROSE) < 0.3
+    assert estimator.estimate("") == 0
+    assert estimator.estimate_request("system", PROSE) == \
+        estimator.estimate("system") + estimator.estimate(PROSE) + PRIOR_REQUEST_OVERHEAD
+    assert estimator.bounds(1000) == (int(1000 * (1 - DEFAULT_RELATIVE_ERROR)), int(1000 * (1 + DEFAULT_RELATIVE_ERROR)) + 1)
+
+
+def test_observations_refit_the_coefficients(estimator):
+    before = estimator.estimate_request(PROSE)
+    actual = before * 2
+    for _ in range(20):
+        estimator.observe(PROSE, actual)
+    assert estimator.fit_version == 20
+    assert estimator.observations == 20
+    assert abs(estimator.estimate_request(PROSE) - actual) < abs(before - actual) / 4
+    assert estimator.relative_error() < DEFAULT_RELATIVE_ERROR
+
+
+def test_empty_usage_is_ignored(estimator):
+    estimator.observe(PROSE, 0)
+    assert (estimator.observations, estimator.fit_version) == (0, 0)
+
+
+def test_the_fit_is_persisted_and_reloaded(estimator):
+    for actual in (300, 320, 310):
+        estimator.observe(PROSE, actual)
+    reloaded = TokenEstimator(path=estimator.path)
+    assert reloaded.observations == 3
+    assert reloaded.estimate_request(PROSE) == estimator.estimate_request(PROSE)
+    assert reloaded.stats() == estimator.stats()
+
+
+def test_statistics_of_another_feature_set_are_not_loaded(tmp_path):
+    path = tmp_path / 'calibration.json'
+    path.write_text(json.dumps({'features': ['letters'], 'xtx': [[1.0]], 'xty': [1.0], 'errors': [], 'observations': 9}))
+    assert TokenEstimator(path=str(path)).observations == 0
+
+
+def test_input_budget_leaves_room_for_the_output_and_thinking():
+    assert input_token_budget('claude-3-7-sonnet-20250219', 10000) == 190000
+    assert input_token_budget('claude-3-7-sonnet-20250219', 4000) == 195000
+    assert input_token_budget('claude-3-7-sonnet-20250219', 8000, thinking_budget=16000) == 184000
+    assert input_token_budget('unknown-model', 250000) == 0
@@ -0,0 +1,62 @@
+import pytest
+
+import server
+from analysis_store import AnalysisError
+from builders import paragraphs
+from token_estimation import estimate_tokens
+from token_histogram import token_histogram, token_sections
+
+
+def test_pages_are_counted_separately():
+    pages = ["first page text\n", "second page, a little longer\n", "third\n"]
+    sections = token_sections({'text': "".join(pages), 'page_lengths': [len(page) for page in pages]})
+    assert sections['unit_kind'] == 'page'
+    assert [section['label'] for section in sections['sections']] == ['Page 1', 'Page 2', 'Page 3']
+    assert [section['tokens'] for section in sections['sections']] == [estimate_tokens(page) for page in pages]
+
+
+def test_headings_label_the_sections():
+    text = "Intro words\n\n# Methods\nWe measured.\n\n## Results\nIt worked.\n"
+    sections = token_sections({'text': text})
+    assert sections['unit_kind'] == 'section'
+    assert [section['label'] for section in sections['sections']] == ['Start', 'Methods', 'Results']
+    assert "".join(text[section['start']:section['end']] for section in sections['sections']) == text
+
+
+def test_many_paragraphs_are_merged_into_ranges():
+    sections = token_sections({'text': paragraphs(30)}, max_sections=10)
+    assert (sections['unit_kind'], sections['unit_count']) == ('paragraph', 30)
+    assert len(sections['sections']) == 10
+    assert sections['sections'][0]['label'] == 'Paragraph 1 – Paragraph 3'
+
+
+def test_histogram_marks_the_first_section_over_the_budget():
+    sections = {'unit_kind': 'page', 'unit_count': 4,
+                'sections': [{'label': f"Page {number}", 'tokens': 100} for number in range(1, 5)]}
+    histogram = token_histogram(sections, 250)
+    assert histogram['first_excluded'] == 2
+    assert [row['cumulative_tokens'] for row in histogram['sections']] == [100, 200, 300, 400]
+    assert [row['fits'] for row in histogram['sections']] == [True, True, False, False]
+    assert token_histogram(sections, 400)['first_excluded'] is None
+
+
+def test_analysis_key_follows_the_content_not_the_upload():
+    data = paragraphs(3).encode('utf-8')
+    first = server.upload_store.put('notes.txt', data)
+    second = server.upload_store.put('notes.txt', data)
+    assert first != second
+    assert server.analysis_key({'upload_id': first}, '', '') == server.analysis_key({'upload_id': second}, '', '')
+    assert server.analysis_key({'upload_id': first}, '', '') != \
+        server.analysis_key({'upload_id': first, 'max_tokens': 1000}, '', '')
+    # Text formats are told apart by their extension
+    assert server.analysis_key({}, "a,b", 'data.csv') != server.analysis_key({}, "a,b", 'data.txt')
+    with pytest.raises(AnalysisError) as caught:
+        server.analysis_key({'upload_id': 'missing'}, '', '')
+    assert caught.value.status_code == 404
+
+
+def test_analysis_reports_the_histogram(client):
+    response = client.post('/api/analyze-tokens', json={'content': "# One\nalpha\n\n# Two\nbeta\n", 'file_name': 'a.md'})
+    histogram = response.get_json()['token_histogram']
+    assert [row['label'] for row in histogram['sections']] == ['One', 'Two']
+    assert histogram['first_excluded'] is None
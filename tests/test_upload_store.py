@@ -0,0 +1,69 @@
+import io
+import time
+
+import pytest
+
+from builders import paragraphs
+from upload_store import UploadStore
+
+
+def test_upload_id_can_be_used_repeatedly():
+    store = UploadStore()
+    upload_id = store.put('notes.txt', b'hello')
+    assert store.get(upload_id)['data'] == b'hello'
+    assert store.get(upload_id)['file_name'] == 'notes.txt'
+
+
+def test_uploads_expire_after_their_ttl(monkeypatch):
+    store = UploadStore(ttl=60)
+    upload_id = store.put('notes.txt', b'hello')
+    later = time.time() + 61
+    monkeypatch.setattr(time, 'time', lambda: later)
+    assert store.get(upload_id) is None
+
+
+def test_cleanup_removes_expired_uploads(monkeypatch):
+    store = UploadStore(ttl=60)
+    store.put('old.txt', b'old')
+    later = time.time() + 61
+    monkeypatch.setattr(time, 'time', lambda: later)
+    kept = store.put('new.txt', b'new')
+    assert store.cleanup_expired() == 1
+    assert store.get(kept) is not None
+
+
+def test_oldest_uploads_are_dropped_past_the_size_limit():
+    store = UploadStore(max_bytes=10)
+    first = store.put('a.txt', b'aaaaaa')
+    second = store.put('b.txt', b'bbbbbb')
+    assert store.get(first) is None
+    assert store.get(second) is not None
+    with pytest.raises(ValueError):
+        store.put('c.txt', b'c' * 11)
+
+
+def test_digest_is_kept_with_the_entry():
+    store = UploadStore()
+    entry = store.get(store.put('a.txt', b'abc'))
+    assert store.digest(entry) == 'ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad'
+    assert entry['sha256'] == store.digest(entry)
+
+
+def test_uploaded_file_is_analyzed_by_upload_id(client):
+    content = paragraphs(4).encode('utf-8')
+    response = client.post('/upload', data={'file': (io.BytesIO(content), 'notes.txt')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert 'file_content' not in body
+    assert body['size'] == len(content)
+
+    analyses = [client.post('/api/analyze-tokens', json={'upload_id': body['upload_id']}) for _ in range(2)]
+    assert [analysis.status_code for analysis in analyses] == [200, 200]
+    assert analyses[0].get_json()['estimated_tokens'] > 0
+    assert analyses[0].get_json()['analysis_id'] == analyses[1].get_json()['analysis_id']
+
+
+def test_unknown_upload_id_is_a_404(client):
+    response = client.post('/api/analyze-tokens', json={'upload_id': 'f' * 32})
+    assert response.status_code == 404
@@ -0,0 +1,280 @@
+# Token estimation and input budgets for the supported models
+import json
+import os
+import threading
+from collections import deque
+
+# Total context window (input + output) per model
+MODEL_CONTEXT_WINDOWS = {
+    'claude-3-7-sonnet-20250219': 200000,
+    'claude-3-5-sonnet-20241022': 200000,
+    'claude-3-5-haiku-20241022': 200000,
+    'claude-3-haiku-20240307': 200000,
+    'gemini-2.5-pro-exp-03-25': 1000000,
+}
+DEFAULT_CONTEXT_WINDOW = 200000
+
+# Maximum input tokens we ever send in one request, leaving room for overhead
+MAX_INPUT_TOKENS = 195000
+
+# Character classes the estimator counts. Non-ASCII characters are classed by their UTF-8
+# length: 2 bytes for Latin extensions, Greek, Cyrillic, Arabic and Hebrew, 3 bytes for
+# CJK, kana, Hangul and typographic punctuation, 4 bytes for emoji
+TOKEN_FEATURES = ['letters', 'digits', 'spaces', 'space_runs', 'newlines', 'punctuation',
+                  'utf8_2byte', 'utf8_3byte', 'utf8_4byte']
+
+# Starting tokens per character of each class, about 4 characters per token for English prose
+# and one token per CJK character; replaced by fitted values as completed requests report usage
+PRIOR_TOKENS_PER_CHAR = {
+    'letters': 0.2,
+    'digits': 0.4,
+    'spaces': 0.03,
+    'space_runs': 0.1,
+    'newlines': 0.4,
+    'punctuation': 0.5,
+    'utf8_2byte': 0.5,
+    'utf8_3byte': 1.0,
+    'utf8_4byte': 1.5,
+}
+
+# Fixed tokens per request for message framing
+PRIOR_REQUEST_OVERHEAD = 8
+
+# How strongly the fit is pulled towards the priors, in observations' worth of evidence
+CALIBRATION_PRIOR_WEIGHT = 2.0
+
+# Relative error bound used until enough requests have been observed, and the number needed
+DEFAULT_RELATIVE_ERROR = 0.35
+CALIBRATION_MIN_OBSERVATIONS = 5
+
+# Recent relative errors kept for the error bound, and the quantile reported
+CALIBRATION_ERROR_WINDOW = 200
+CALIBRATION_ERROR_QUANTILE = 0.9
+
+# Where the fitted statistics are kept between restarts
+TOKEN_CALIBRATION_PATH = os.environ.get('TOKEN_CALIBRATION_PATH', '/tmp/file-visualizer-token-calibration.json')
+
+_LETTER, _DIGIT, _SPACE, _NEWLINE, _PUNCTUATION, _LEAD_2, _LEAD_3, _LEAD_4, _OTHER = range(1, 10)
+
+
+def _byte_class_table():
+    table = bytearray([_OTHER]) * 256
+    for byte in range(0x21, 0x7f):
+        table[byte] = _PUNCTUATION
+    for byte in b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz':
+        table[byte] = _LETTER
+    for byte in b'0123456789':
+        table[byte] = _DIGIT
+    for byte in b' \t':
+        table[byte] = _SPACE
+    for byte in b'\r\n':
+        table[byte] = _NEWLINE
+    # Count characters by their UTF-8 lead byte; continuation bytes are not counted
+    for byte in range(0xc2, 0xe0):
+        table[byte] = _LEAD_2
+    for byte in range(0xe0, 0xf0):
+        table[byte] = _LEAD_3
+    for byte in range(0xf0, 0xf5):
+        table[byte] = _LEAD_4
+    return bytes(table)
+
+
+_BYTE_CLASSES = _byte_class_table()
+
+
+def text_features(text):
+    """
+    Count the character classes of text in TOKEN_FEATURES order. Classes are counted on the
+    UTF-8 bytes with one translate and a few counts, so this stays cheap on large inputs.
+    """
+    data = text.encode('utf-8', 'surrogatepass')
+    classes = data.translate(_BYTE_CLASSES)
+    return [
+        classes.count(_LETTER),
+        classes.count(_DIGIT),
+        classes.count(_SPACE),
+        # Indentation and alignment runs are tokenized differently from single spaces
+        data.count(b'  '),
+        classes.count(_NEWLINE),
+        classes.count(_PUNCTUATION),
+        classes.count(_LEAD_2),
+        classes.count(_LEAD_3),
+        classes.count(_LEAD_4),
+    ]
+
+
+def _solve(matrix, vector):
+    """Solve a small dense linear system by Gaussian elimination with partial pivoting."""
+    size = len(vector)
+    rows = [list(matrix[i]) + [vector[i]] for i in range(size)]
+    for column in range(size):
+        pivot = max(range(column, size), key=lambda row: abs(rows[row][column]))
+        if abs(rows[pivot][column]) < 1e-12:
+            raise ValueError("Singular system")
+        rows[column], rows[pivot] = rows[pivot], rows[column]
+        for row in range(column + 1, size):
+            factor = rows[row][column] / rows[column][column]
+            if factor:
+                for k in range(column, size + 1):
+                    rows[row][k] -= factor * rows[column][k]
+    solution = [0.0] * size
+    for row in range(size - 1, -1, -1):
+        total = rows[row][size] - sum(rows[row][k] * solution[k] for k in range(row + 1, size))
+        solution[row] = total / rows[row][row]
+    return solution
+
+
+class TokenEstimator:
+    """
+    Local token estimator: a linear model over character-class counts plus a fixed per-request
+    overhead. Coefficients start from PRIOR_TOKENS_PER_CHAR and are refitted from the
+    input_tokens the API reports for completed requests, by least squares on relative error
+    with the priors as a ridge penalty. The sufficient statistics are persisted so the fit
+    survives restarts. The estimate is additive: the tokens of a text are the sum of its parts'.
+    """
+    def __init__(self, path=TOKEN_CALIBRATION_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        size = len(TOKEN_FEATURES) + 1
+        self._xtx = [[0.0] * size for _ in range(size)]
+        self._xty = [0.0] * size
+        self._errors = deque(maxlen=CALIBRATION_ERROR_WINDOW)
+        self.observations = 0
+        self._coefficients = [PRIOR_TOKENS_PER_CHAR[name] for name in TOKEN_FEATURES]
+        self._overhead = PRIOR_REQUEST_OVERHEAD
+        # Bumped on every refit, so estimates cached elsewhere know when to recompute
+        self.fit_version = 0
+        self._load()
+
+    def estimate(self, text):
+        """Estimated tokens of text on its own, without the per-request overhead."""
+        if not text:
+            return 0
+        coefficients = self._coefficients
+        return int(sum(c * x for c, x in zip(coefficients, text_features(text))))
+
+    def estimate_request(self, *texts):
+        """Estimated input tokens of a request made of texts (system prompt, user content, ...)."""
+        return sum(self.estimate(text) for text in texts) + int(self._overhead)
+
+    def relative_error(self):
+        """
+        The CALIBRATION_ERROR_QUANTILE quantile of recent relative errors, measured on each
+        request before it was used for fitting, or DEFAULT_RELATIVE_ERROR until enough were seen.
+        """
+        with self._lock:
+            errors = sorted(self._errors)
+        if len(errors) < CALIBRATION_MIN_OBSERVATIONS:
+            return DEFAULT_RELATIVE_ERROR
+        return errors[min(len(errors) - 1, int(len(errors) * CALIBRATION_ERROR_QUANTILE))]
+
+    def bounds(self, tokens):
+        """Return (low, high) around an estimate using the current error bound."""
+        error = self.relative_error()
+        return int(tokens * (1 - error)), int(tokens * (1 + error)) + 1
+
+    def observe(self, text, actual_tokens):
+        """Record the input_tokens the API reported for a request whose text input was text."""
+        if actual_tokens <= 0:
+            return
+        features = text_features(text) + [1]
+        predicted = sum(c * x for c, x in zip(self._coefficients + [self._overhead], features))
+
+        # Weighting by 1 / actual fits relative rather than absolute error, so long inputs do not dominate
+        weighted = [x / actual_tokens for x in features]
+        with self._lock:
+            self._errors.append(abs(predicted - actual_tokens) / actual_tokens)
+            for i, xi in enumerate(weighted):
+                row = self._xtx[i]
+                for j, xj in enumerate(weighted):
+                    row[j] += xi * xj
+                self._xty[i] += xi
+            self.observations += 1
+            self._fit()
+            state = self._state()
+        self._save(state)
+
+    def stats(self):
+        return {
+            'observations': self.observations,
+            'relative_error': round(self.relative_error(), 4),
+            'tokens_per_char': dict(zip(TOKEN_FEATURES, (round(c, 4) for c in self._coefficients))),
+            'request_overhead': round(self._overhead, 1)
+        }
+
+    def _fit(self):
+        # Caller holds the lock. Ridge towards the priors: add weight * I to X'WX and weight * prior to X'Wy
+        priors = [PRIOR_TOKENS_PER_CHAR[name] for name in TOKEN_FEATURES] + [PRIOR_REQUEST_OVERHEAD]
+        matrix = [list(row) for row in self._xtx]
+        vector = list(self._xty)
+        for i, prior in enumerate(priors):
+            matrix[i][i] += CALIBRATION_PRIOR_WEIGHT
+            vector[i] += CALIBRATION_PRIOR_WEIGHT * prior
+        try:
+            solution = _solve(matrix, vector)
+        except ValueError:
+            return
+        # A class that costs negative tokens is an artefact of too few observations
+        self._coefficients = [max(0.0, value) for value in solution[:-1]]
+        self._overhead = max(0.0, solution[-1])
+        self.fit_version += 1
+
+    def _state(self):
+        # Caller holds the lock
+        return {
+            'features': TOKEN_FEATURES,
+            'xtx': self._xtx,
+            'xty': self._xty,
+            'errors': list(self._errors),
+            'observations': self.observations
+        }
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        if state.get('features') != TOKEN_FEATURES:
+            # Statistics for a different feature set cannot be reused
+            return
+        with self._lock:
+            self._xtx = state['xtx']
+            self._xty = state['xty']
+            self._errors.extend(state['errors'])
+            self.observations = state['observations']
+            self._fit()
+
+    def _save(self, state):
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Write to a unique temporary name and rename so a crash never leaves a partial file
+            temp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Failed to save token calibration: {str(e)}")
+
+
+# Shared estimator; extraction workers load the fit that was persisted when they started
+token_estimator = TokenEstimator()
+
+
+def estimate_tokens(text):
+    """Estimate the number of tokens in a piece of text."""
+    return token_estimator.estimate(text)
+
+
+def input_token_budget(model, max_tokens, system_prompt="", thinking_budget=0):
+    """
+    Return how many tokens of user content fit in a request to model.
+    The requested output (max_tokens) and the system prompt share the context window with the input.
+    Thinking counts towards max_tokens; a thinking budget above it is reserved in full.
+    """
+    context_window = MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+    output_reserve = max(max_tokens, thinking_budget)
+    budget = min(MAX_INPUT_TOKENS, context_window - output_reserve) - estimate_tokens(system_prompt)
+    return max(0, budget)
@@ -0,0 +1,110 @@
+# Per-page and per-section token breakdown of extracted documents
+import re
+
+from document_extraction import iter_text_units
+from token_estimation import estimate_tokens
+
+# Sections reported at most; neighbouring sections are merged into ranges beyond this
+TOKEN_HISTOGRAM_MAX_SECTIONS = 200
+
+# Markdown-style headings, as written by the DOCX extractor and found in text uploads
+_HEADING = re.compile(r'^#{1,6}[ \t]+(\S.*)$', re.M)
+
+# Heading text shown in a section label
+MAX_LABEL_CHARS = 60
+
+
+def _page_spans(page_lengths):
+    spans = []
+    start = 0
+    for number, length in enumerate(page_lengths, 1):
+        spans.append((f"Page {number}", start, start + length))
+        start += length
+    return spans
+
+
+def _heading_spans(text):
+    spans = []
+    start = 0
+    label = "Start"
+    for match in _HEADING.finditer(text):
+        if match.start() > start:
+            spans.append((label, start, match.start()))
+        start = match.start()
+        label = match.group(1).strip()[:MAX_LABEL_CHARS]
+    spans.append((label, start, len(text)))
+    return spans
+
+
+def _paragraph_spans(text):
+    spans = []
+    start = 0
+    for unit in iter_text_units(text):
+        spans.append((f"Paragraph {unit['index'] + 1}", start, start + len(unit['text'])))
+        start += len(unit['text'])
+    return spans
+
+
+def document_spans(entry):
+    """
+    Split an extraction into labelled character spans: pages for PDFs, files for archives,
+    headings where the text has them and paragraphs otherwise. Returns (unit_kind, spans).
+    """
+    text = entry['text']
+    if entry.get('page_lengths'):
+        return 'page', _page_spans(entry['page_lengths'])
+    if entry.get('archive'):
+        return 'file', [(item['name'], item['offset'], item['offset'] + item['length'])
+                        for item in entry['archive']['files']]
+    if _HEADING.search(text):
+        return 'section', _heading_spans(text)
+    return 'paragraph', _paragraph_spans(text)
+
+
+def _merge_spans(spans, max_sections):
+    """Merge consecutive spans into at most max_sections ranges labelled by their first and last span."""
+    if len(spans) <= max_sections:
+        return spans
+    group_size = -(-len(spans) // max_sections)
+    merged = []
+    for index in range(0, len(spans), group_size):
+        group = spans[index:index + group_size]
+        label = group[0][0] if len(group) == 1 else f"{group[0][0]} – {group[-1][0]}"
+        merged.append((label, group[0][1], group[-1][2]))
+    return merged
+
+
+def token_sections(entry, max_sections=TOKEN_HISTOGRAM_MAX_SECTIONS):
+    """
+    Estimate the tokens of every page or section of an extraction. The result depends only on
+    the extracted text, so it is computed once per analysis and kept with it.
+    """
+    unit_kind, spans = document_spans(entry)
+    text = entry['text']
+    sections = [{'label': label, 'start': start, 'end': end, 'tokens': estimate_tokens(text[start:end])}
+                for label, start, end in _merge_spans(spans, max_sections)]
+    return {'unit_kind': unit_kind, 'unit_count': len(spans), 'sections': sections}
+
+
+def token_histogram(sections, token_budget):
+    """
+    Lay the sections out against token_budget: each section gets its running total and whether
+    it fits completely. The first section that does not fit is where the input gets cut.
+    """
+    cumulative = 0
+    first_excluded = None
+    rows = []
+    for index, section in enumerate(sections['sections']):
+        cumulative += section['tokens']
+        fits = cumulative <= token_budget
+        if not fits and first_excluded is None:
+            first_excluded = index
+        rows.append(dict(section, cumulative_tokens=cumulative, fits=fits))
+    return {
+        'unit_kind': sections['unit_kind'],
+        'unit_count': sections['unit_count'],
+        'token_budget': token_budget,
+        'total_tokens': cumulative,
+        'first_excluded': first_excluded,
+        'sections': rows
+    }
@@ -0,0 +1,90 @@
+# Server-side store for uploaded files, referenced by upload_id
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# Uploads expire this many seconds after they were stored
+UPLOAD_TTL = int(os.environ.get('UPLOAD_TTL', 3600))
+
+# Total bytes held by the store; the oldest uploads are dropped beyond this
+UPLOAD_STORE_MAX_BYTES = int(os.environ.get('UPLOAD_STORE_MAX_BYTES', 1024 * 1024 * 1024))
+
+
+class UploadStore:
+    """
+    In-memory, TTL-bounded store of uploaded files so the browser sends each file only once
+    and later requests refer to it by upload_id.
+    """
+    def __init__(self, ttl=UPLOAD_TTL, max_bytes=UPLOAD_STORE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._uploads = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, file_name, data):
+        """Store the bytes of an uploaded file and return its upload_id."""
+        if len(data) > self.max_bytes:
+            raise ValueError(f"Upload of {len(data)} bytes exceeds the upload store limit of {self.max_bytes} bytes")
+
+        upload_id = uuid.uuid4().hex
+        self._insert(upload_id, {
+            'upload_id': upload_id,
+            'file_name': file_name,
+            'data': data,
+            'size': len(data),
+            'created_at': time.time()
+        })
+        return upload_id
+
+    def get(self, upload_id):
+        """Return the entry for upload_id, or None if it is unknown or expired."""
+        with self._lock:
+            entry = self._uploads.get(upload_id)
+            if entry is None:
+                return None
+            if time.time() - entry['created_at'] > self.ttl:
+                self._remove(upload_id)
+                return None
+            return entry
+
+    def digest(self, entry):
+        """Return the SHA-256 hex digest of an entry's bytes, computed on first use and kept with the entry."""
+        if 'sha256' not in entry:
+            entry['sha256'] = hashlib.sha256(entry['data']).hexdigest()
+        return entry['sha256']
+
+    def delete(self, upload_id):
+        with self._lock:
+            self._remove(upload_id)
+
+    def cleanup_expired(self):
+        """Remove expired uploads and return how many were removed."""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            expired = [upload_id for upload_id, entry in self._uploads.items() if entry['created_at'] < cutoff]
+            for upload_id in expired:
+                self._remove(upload_id)
+        return len(expired)
+
+    def _insert(self, key, entry):
+        with self._lock:
+            self._uploads[key] = entry
+            self._total_bytes += entry['size']
+            # Drop the oldest entries until we are back under the size limit
+            while self._total_bytes > self.max_bytes:
+                _, evicted = self._uploads.popitem(last=False)
+                self._total_bytes -= evicted['size']
+
+    def _remove(self, upload_id):
+        # Caller holds the lock
+        entry = self._uploads.pop(upload_id, None)
+        if entry is not None:
+            self._total_bytes -= entry['size']
+
+
+# Shared store used by server.py
+upload_store = UploadStore()
@@ -0,0 +1,79 @@
+# Token usage reported by the Claude API, including prompt-cache reads and writes
+import threading
+import time
+
+# Usage fields read from API responses. input_tokens only counts input after the last cache
+# breakpoint; the cached prefix is reported as cache reads or cache writes
+USAGE_FIELDS = ['input_tokens', 'output_tokens', 'cache_read_input_tokens', 'cache_creation_input_tokens']
+
+# Claude 3.7 Sonnet pricing in dollars per million tokens. Cache writes cost 1.25x and
+# cache reads 0.1x the base input price
+INPUT_PRICE = 3.0
+OUTPUT_PRICE = 15.0
+CACHE_WRITE_PRICE = 3.75
+CACHE_READ_PRICE = 0.3
+
+
+def usage_counts(usage):
+    """Read USAGE_FIELDS from an SDK usage object or a usage dict; missing fields count as 0."""
+    if usage is None:
+        return None
+    if isinstance(usage, dict):
+        return {name: usage.get(name) or 0 for name in USAGE_FIELDS}
+    return {name: getattr(usage, name, 0) or 0 for name in USAGE_FIELDS}
+
+
+def total_input_tokens(counts):
+    """All input tokens of a request, cached or not."""
+    return counts['input_tokens'] + counts['cache_read_input_tokens'] + counts['cache_creation_input_tokens']
+
+
+def usage_cost(counts):
+    """Dollar cost of a request from its usage counts."""
+    return (counts['input_tokens'] * INPUT_PRICE
+            + counts['cache_creation_input_tokens'] * CACHE_WRITE_PRICE
+            + counts['cache_read_input_tokens'] * CACHE_READ_PRICE
+            + counts['output_tokens'] * OUTPUT_PRICE) / 1000000
+
+
+class UsageMetrics:
+    """Running totals of the usage of completed Claude requests, for /api/metrics."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.requests = 0
+        self.cache_hits = 0
+        self.cache_writes = 0
+        self.totals = dict.fromkeys(USAGE_FIELDS, 0)
+        self.total_cost = 0.0
+
+    def record(self, counts):
+        with self._lock:
+            self.requests += 1
+            if counts['cache_read_input_tokens']:
+                self.cache_hits += 1
+            if counts['cache_creation_input_tokens']:
+                self.cache_writes += 1
+            for name in USAGE_FIELDS:
+                self.totals[name] += counts[name]
+            self.total_cost += usage_cost(counts)
+
+    def snapshot(self):
+        with self._lock:
+            totals = dict(self.totals)
+            cached = totals['cache_read_input_tokens']
+            all_input = total_input_tokens(totals)
+            return {
+                'since': self.started_at,
+                'requests': self.requests,
+                'cache_hits': self.cache_hits,
+                'cache_writes': self.cache_writes,
+                'tokens': totals,
+                # Share of all input tokens that were served from the prompt cache
+                'cache_read_ratio': round(cached / all_input, 4) if all_input else 0.0,
+                'total_cost': round(self.total_cost, 4)
+            }
+
+
+# Shared metrics used by server.py
+usage_metrics = UsageMetrics()